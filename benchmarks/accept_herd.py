@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'''many greenlets accepting on one listening socket
+
+this reports how long it takes (and how much CPU) for a few hundred acceptor
+greenlets sharing a single listener to take a stream of incoming connections.
+'''
+
+import optparse
+import resource
+import socket
+import time
+
+import greenhouse
+
+
+def acceptor(server, done):
+    while 1:
+        client, addr = server.accept()
+        client.close()
+        done.increment()
+
+
+def connector(port, count):
+    # plain sockets: connecting over loopback doesn't block, and this keeps
+    # the client side's cost out of the measurement
+    for i in xrange(count):
+        sock = socket.socket()
+        sock.connect(("127.0.0.1", port))
+        sock.close()
+        greenhouse.pause()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-a", "--acceptors", type=int, default=200)
+    parser.add_option("-c", "--connectors", type=int, default=10)
+    parser.add_option("-n", "--connections", type=int, default=1000)
+    options, args = parser.parse_args()
+
+    server = greenhouse.Socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", 0))
+    server.listen(128)
+    port = server.getsockname()[1]
+
+    done = greenhouse.Counter()
+    for i in xrange(options.acceptors):
+        greenhouse.schedule(acceptor, args=(server, done))
+    greenhouse.pause()
+
+    each = options.connections // options.connectors
+    total = each * options.connectors
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    for i in xrange(options.connectors):
+        greenhouse.schedule(connector, args=(port, each))
+    done.wait(total)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = ((after.ru_utime + after.ru_stime) -
+            (before.ru_utime + before.ru_stime))
+    print "%d accepts by %d greenlets in %.2fs (%.0f/sec), %.2fs CPU" % (
+            total, options.acceptors, elapsed, total / elapsed, cpu)
+
+
+if __name__ == '__main__':
+    main()
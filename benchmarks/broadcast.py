@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+'''broadcasting to many clients when one of them has stopped reading
+
+a producer greenlet sends every message to each client in turn, for a fixed
+length of time, while reader greenlets count what arrives at all but one of
+the clients. with --naive each message goes out with sendall(), so once the
+stuck client's socket buffer fills the producer blocks and everyone stops
+getting messages. otherwise each client has a greenhouse.WriteQueue, which
+drops the stuck client's backlog when it stalls. this reports the messages
+per second the healthy clients received.
+'''
+
+import optparse
+import socket
+import time
+
+import greenhouse
+
+
+def reader(sock, counts, index, size):
+    while 1:
+        data = sock.recv(65536)
+        if not data:
+            break
+        counts[index] += len(data)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-c", "--clients", type=int, default=50)
+    parser.add_option("-s", "--size", type=int, default=200)
+    parser.add_option("-t", "--time", type=float, default=2.0)
+    parser.add_option("--naive", action="store_true")
+    options, args = parser.parse_args()
+
+    servers, clients = [], []
+    for i in xrange(options.clients):
+        a, b = socket.socketpair()
+        servers.append(greenhouse.Socket(fromsock=a))
+        clients.append(greenhouse.Socket(fromsock=b))
+
+    # the first client never reads
+    counts = [0] * options.clients
+    for i, client in enumerate(clients[1:], 1):
+        greenhouse.schedule(reader, args=(client, counts, i, options.size))
+
+    if options.naive:
+        send = [sock.sendall for sock in servers]
+    else:
+        send = [greenhouse.WriteQueue(sock, high_water=262144,
+            stall_timeout=0.02, on_stall=greenhouse.io.writequeue.drop).write
+            for sock in servers]
+
+    message = "x" * options.size
+    deadline = time.time() + options.time
+
+    @greenhouse.schedule
+    def producer():
+        while time.time() < deadline:
+            for func in send:
+                func(message)
+            greenhouse.pause()
+
+    greenhouse.pause_for(options.time)
+    received = sum(counts[1:]) / options.size / (options.clients - 1)
+    print "%s: %.0f messages/sec to each healthy client" % (
+            "naive" if options.naive else "queue", received / options.time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''sequential file reads alongside a latency-sensitive greenlet
+
+one greenlet reads a large file through greenhouse.File in chunks while
+another wakes up every millisecond, the way a server's connection handlers
+would. reported are the read throughput and the worst delay the ticker saw
+past its wake-up time. --threads 0 does the reads in the hub as before,
+--read-ahead 0 turns off the background read-ahead.
+'''
+
+import optparse
+import os
+import tempfile
+import time
+
+import greenhouse
+
+
+def reader(path, chunk, done):
+    with greenhouse.File(path) as fp:
+        while fp.read(chunk):
+            pass
+    done.set()
+
+
+def ticker(delays, done):
+    while not done.is_set():
+        target = time.time() + 0.001
+        greenhouse.pause_until(target)
+        delays.append(time.time() - target)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--size", type=int, default=256,
+            help="size of the file in MB")
+    parser.add_option("-c", "--chunk", type=int, default=1048576)
+    parser.add_option("-t", "--threads", type=int, default=4)
+    parser.add_option("-r", "--read-ahead", type=int, default=65536)
+    options, args = parser.parse_args()
+
+    greenhouse.io.threadpool.set_size(options.threads)
+    greenhouse.File.READ_AHEAD_SIZE = options.read_ahead
+
+    fd, path = tempfile.mkstemp()
+    try:
+        block = os.urandom(1048576)
+        for i in xrange(options.size):
+            os.write(fd, block)
+        os.close(fd)
+
+        # once to get it into the page cache
+        with open(path) as fp:
+            while fp.read(1048576):
+                pass
+
+        done = greenhouse.Event()
+        delays = []
+        greenhouse.schedule(ticker, args=(delays, done))
+
+        start = time.time()
+        reader(path, options.chunk, done)
+        elapsed = time.time() - start
+    finally:
+        os.unlink(path)
+
+    print "%.0f MB/sec, ticker late by %.2fms at worst over %d ticks" % (
+            options.size / elapsed, max(delays or [0]) * 1000, len(delays))
+
+
+if __name__ == '__main__':
+    main()
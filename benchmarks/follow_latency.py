@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''how quickly appended lines are noticed in a file being followed
+
+a writer greenlet appends a timestamped line every few milliseconds, and a
+follower reports how long each one took to be seen. the default follows the
+file with greenhouse.follow(), --poll INTERVAL does it the old way, checking
+os.stat() every INTERVAL seconds. the process's CPU time is reported too.
+'''
+
+import optparse
+import os
+import tempfile
+import time
+
+import greenhouse
+
+
+def writer(path, count, gap):
+    with open(path, 'a', 0) as fp:
+        for i in xrange(count):
+            greenhouse.pause_for(gap)
+            fp.write("%r\n" % time.time())
+
+
+def with_follow(path, count, delays):
+    lines = greenhouse.follow(path)
+    try:
+        for line in lines:
+            delays.append(time.time() - float(line))
+            if len(delays) == count:
+                break
+    finally:
+        lines.close()
+
+
+def with_polling(path, count, delays, interval):
+    offset = 0
+    with open(path) as fp:
+        while len(delays) < count:
+            size = os.stat(path).st_size
+            if size > offset:
+                fp.seek(offset)
+                for line in fp.read(size - offset).splitlines():
+                    delays.append(time.time() - float(line))
+                offset = size
+            else:
+                greenhouse.pause_for(interval)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-c", "--count", type=int, default=500)
+    parser.add_option("-g", "--gap", type=float, default=0.005)
+    parser.add_option("--poll", type=float)
+    options, args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        delays = []
+        greenhouse.schedule(writer, args=(path, options.count, options.gap))
+
+        start = time.clock()
+        if options.poll:
+            with_polling(path, options.count, delays, options.poll)
+        else:
+            with_follow(path, options.count, delays)
+        cpu = time.clock() - start
+    finally:
+        os.unlink(path)
+
+    delays.sort()
+    print "%d lines, seen after %.3fms median and %.3fms at worst, %.2fs CPU" % (
+            len(delays), delays[len(delays) // 2] * 1000, delays[-1] * 1000,
+            cpu)
+
+
+if __name__ == '__main__':
+    main()
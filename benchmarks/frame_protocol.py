@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+'''length-prefixed frames, hand-rolled versus Socket.recv_frame
+
+the sender streams small frames with a four-byte length header. the "manual"
+receiver does what protocols on greenhouse have had to do: a recv() loop that
+concatenates chunks until it has the header, then again for the body. the
+"builtin" one uses recv_frame().
+'''
+
+import optparse
+import socket
+import struct
+import time
+
+import greenhouse
+
+
+def sender(sock, frames, size):
+    payload = "x" * size
+    batch = "".join(struct.pack("!I", size) + payload for i in xrange(100))
+    for i in xrange(frames // 100):
+        sock.sendall(batch)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def recv_exactly(sock, size):
+    data = ""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def manual_receiver(sock, done):
+    count = 0
+    while 1:
+        head = recv_exactly(sock, 4)
+        if not head:
+            break
+        size, = struct.unpack("!I", head)
+        recv_exactly(sock, size)
+        count += 1
+    done.append(count)
+
+
+def builtin_receiver(sock, done):
+    count = 0
+    while sock.recv_frame() is not None:
+        count += 1
+    done.append(count)
+
+
+def run(receiver, frames, size):
+    a, b = socket.socketpair()
+    done = []
+    greenhouse.schedule(sender, args=(greenhouse.Socket(fromsock=a),
+        frames, size))
+    greenhouse.schedule(receiver, args=(greenhouse.Socket(fromsock=b), done))
+
+    start = time.time()
+    while not done:
+        greenhouse.pause_for(0.001)
+    return done[0], time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--frames", type=int, default=200000)
+    parser.add_option("-s", "--size", type=int, default=40)
+    options, args = parser.parse_args()
+
+    for name, receiver in [("manual", manual_receiver),
+            ("builtin", builtin_receiver)]:
+        count, elapsed = run(receiver, options.frames, options.size)
+        print "%-8s %d frames in %.2fs: %.0f/sec" % (
+                name, count, elapsed, count / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+'''many mostly-idle greenlets with staggered timeouts
+
+every greenlet sleeps for about a second at a time with a little jitter, the
+way per-connection timeouts on an idle server do. this reports how many times
+the poller woke up per second and how much CPU the process burned, with and
+without timer slack.
+'''
+
+import optparse
+import random
+import resource
+import time
+
+import greenhouse
+
+
+def sleeper(interval, jitter, until):
+    while time.time() < until:
+        greenhouse.pause_for(interval + random.random() * jitter)
+
+
+def run(count, duration, slack):
+    greenhouse.set_timer_slack(slack)
+    until = time.time() + duration
+
+    for i in xrange(count):
+        greenhouse.schedule(sleeper, args=(1.0, 0.1, until))
+
+    wakeups = greenhouse.scheduler.state.poll_wakeups
+    before_wakeups = wakeups.total
+    before_cpu = resource.getrusage(resource.RUSAGE_SELF)
+
+    greenhouse.pause_for(duration + 1.2)
+
+    after_cpu = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = ((after_cpu.ru_utime + after_cpu.ru_stime) -
+            (before_cpu.ru_utime + before_cpu.ru_stime))
+    return (wakeups.total - before_wakeups) / duration, cpu
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--count", type=int, default=5000)
+    parser.add_option("-d", "--duration", type=float, default=5.0)
+    parser.add_option("-s", "--slack", type=float, default=0.05)
+    options, args = parser.parse_args()
+
+    for slack in (0.0, options.slack):
+        rate, cpu = run(options.count, options.duration, slack)
+        print "slack %.3fs: %8.1f wakeups/sec, %.2fs CPU" % (slack, rate, cpu)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+'''random fixed-size record lookups in an index file
+
+reads --records-sized records at random offsets out of one file, as an index
+lookup would, the given way:
+
+- "seek" with seek() and read() on a greenhouse.File
+- "pread" with File.pread()
+- "mmap" by slicing a MappedFile
+- "view" with MappedFile.view(), which doesn't copy the record at all
+'''
+
+import optparse
+import os
+import random
+import tempfile
+import time
+
+import greenhouse
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--lookups", type=int, default=200000)
+    parser.add_option("-r", "--record", type=int, default=64)
+    parser.add_option("-m", "--megabytes", type=int, default=64)
+    options, args = parser.parse_args()
+    how = args[0] if args else "mmap"
+
+    fd, path = tempfile.mkstemp()
+    try:
+        block = os.urandom(1048576)
+        for i in xrange(options.megabytes):
+            os.write(fd, block)
+        os.close(fd)
+
+        record = options.record
+        offsets = [random.randrange(options.megabytes * 1048576 - record)
+                for i in xrange(options.lookups)]
+
+        fp = greenhouse.File(path)
+        mapping = fp.mmap()
+        mapping.prefetch()
+
+        start = time.time()
+        if how == "seek":
+            for offset in offsets:
+                fp.seek(offset)
+                fp.read(record)
+        elif how == "pread":
+            for offset in offsets:
+                fp.pread(record, offset)
+        elif how == "mmap":
+            for offset in offsets:
+                mapping[offset:offset + record]
+        elif how == "view":
+            for offset in offsets:
+                mapping.view(offset, record)
+        elapsed = time.time() - start
+
+        mapping.close()
+        fp.close()
+    finally:
+        os.unlink(path)
+
+    print "%s: %d lookups in %.2fs, %.2fus each" % (
+            how, options.lookups, elapsed, elapsed * 1e6 / options.lookups)
+
+
+if __name__ == '__main__':
+    main()
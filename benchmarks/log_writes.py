@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''many greenlets logging to the same file
+
+each greenlet logs a run of records through one handler. the default is
+greenhouse.logging.AsyncHandler, --sync uses a standard FileHandler on the
+same file, with a system call for every record.
+'''
+
+import logging
+import optparse
+import os
+import tempfile
+import time
+
+import greenhouse
+
+
+def logs(log, records, done):
+    for i in xrange(records):
+        log.info("record %d of %d", i, records)
+        if not i % 10:
+            greenhouse.pause()
+    done.increment()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-g", "--greenlets", type=int, default=50)
+    parser.add_option("-r", "--records", type=int, default=2000)
+    parser.add_option("--sync", action="store_true")
+    options, args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        if options.sync:
+            handler = logging.FileHandler(path)
+        else:
+            handler = greenhouse.logging.AsyncHandler(path)
+        handler.setFormatter(logging.Formatter(
+            "[%(asctime)s] %(name)s/%(levelname)s | %(message)s"))
+        log = logging.getLogger("benchmark")
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        log.addHandler(handler)
+
+        done = greenhouse.Counter()
+        for i in xrange(options.greenlets):
+            greenhouse.schedule(logs, args=(log, options.records, done))
+
+        start = time.time()
+        done.wait(options.greenlets)
+        handler.close()
+        elapsed = time.time() - start
+    finally:
+        os.unlink(path)
+
+    total = options.greenlets * options.records
+    print "%d records in %.2fs: %.0f/sec" % (total, elapsed, total / elapsed)
+
+
+if __name__ == '__main__':
+    main()
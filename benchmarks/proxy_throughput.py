@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+'''bulk data through a proxy between two socket pairs
+
+"naive" is the usual pair of greenlets per connection doing recv() and
+sendall(); "copy" is greenhouse.proxy() without splice, and "splice" is
+greenhouse.proxy() with it. "direct" skips the proxy altogether, to show
+how much of the cost is just the sender and receiver.
+'''
+
+import optparse
+import resource
+import socket
+import time
+
+import greenhouse
+
+
+def naive_proxy(a, b):
+    def pump(src, dst, done):
+        while 1:
+            data = src.recv(65536)
+            if not data:
+                break
+            dst.sendall(data)
+        dst.shutdown(socket.SHUT_WR)
+        done.set()
+
+    done = greenhouse.Event()
+    greenhouse.schedule(pump, args=(b, a, done))
+    pump(a, b, greenhouse.Event())
+    done.wait()
+
+
+def tcp_socketpair():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    a = socket.create_connection(listener.getsockname())
+    b, addr = listener.accept()
+    listener.close()
+    return a, b
+
+
+def sender(sock, megabytes):
+    block = "x" * (1 << 20)
+    for i in xrange(megabytes):
+        sock.sendall(block)
+    sock.shutdown(socket.SHUT_WR)
+    while sock.recv(65536):
+        pass
+
+
+def receiver(sock, done):
+    total = 0
+    buf = bytearray(262144)
+    while 1:
+        got = sock.recv_into(buf)
+        if not got:
+            break
+        total += got
+    sock.shutdown(socket.SHUT_WR)
+    done.append(total)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-m", "--mode", default="splice",
+            help="'direct', 'naive', 'copy' or 'splice'")
+    parser.add_option("-t", "--tcp", action="store_true",
+            help="use TCP connections over loopback instead of unix sockets")
+    parser.add_option("-c", "--connections", type=int, default=20)
+    parser.add_option("-s", "--megabytes", type=int, default=50)
+    options, args = parser.parse_args()
+
+    if options.mode in ("direct", "naive"):
+        run_proxy = naive_proxy
+    else:
+        run_proxy = greenhouse.proxy
+        if options.mode == "copy":
+            greenhouse.syscalls.splice = None
+
+    pair = tcp_socketpair if options.tcp else socket.socketpair
+
+    done = []
+    for i in xrange(options.connections):
+        client, front = pair()
+        if options.mode == "direct":
+            server = front
+        else:
+            back, server = pair()
+            greenhouse.schedule(run_proxy, args=(
+                greenhouse.Socket(fromsock=front),
+                greenhouse.Socket(fromsock=back)))
+        greenhouse.schedule(sender, args=(greenhouse.Socket(fromsock=client),
+            options.megabytes))
+        greenhouse.schedule(receiver, args=(greenhouse.Socket(fromsock=server),
+            done))
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    while len(done) < options.connections:
+        greenhouse.pause_for(0.01)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = ((after.ru_utime + after.ru_stime) -
+            (before.ru_utime + before.ru_stime))
+    total = sum(done) >> 20
+    print "%-6s %dMB in %.2fs (%.0fMB/sec), %.2fs CPU" % (
+            options.mode, total, elapsed, total / elapsed, cpu)
+
+
+if __name__ == '__main__':
+    main()
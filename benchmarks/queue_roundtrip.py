@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+'''round trip time between two greenlets through a pair of queues
+
+a requester puts onto one queue and waits on a second, and a responder does
+the reverse. a few sockets sit idle in the poller meanwhile, as they would in
+a real server. run with and without direct handoff.
+'''
+
+import optparse
+import socket
+import time
+
+import greenhouse
+
+
+def responder(requests, responses, rounds):
+    for i in xrange(rounds):
+        responses.put(requests.get())
+
+
+def measure(rounds):
+    requests, responses = greenhouse.Queue(), greenhouse.Queue()
+    greenhouse.schedule(responder, args=(requests, responses, rounds))
+
+    start = time.time()
+    for i in xrange(rounds):
+        requests.put(i)
+        responses.get()
+    return (time.time() - start) / rounds
+
+
+def idle(sock):
+    sock.recv(1)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-r", "--rounds", type=int, default=50000)
+    parser.add_option("-i", "--idle", type=int, default=100)
+    options, args = parser.parse_args()
+
+    pairs = [socket.socketpair() for i in xrange(options.idle)]
+    for a, b in pairs:
+        greenhouse.schedule(idle, args=(greenhouse.Socket(fromsock=a),))
+    greenhouse.pause()
+
+    for flag in (False, True):
+        greenhouse.set_direct_handoff(flag)
+        rtt = measure(options.rounds)
+        print "direct handoff %-5s: %6.2fus per round trip" % (flag, rtt * 1e6)
+
+
+if __name__ == '__main__':
+    main()
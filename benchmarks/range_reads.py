@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+'''many greenlets reading random ranges out of one shared file
+
+each greenlet repeatedly picks an offset and reads a range from the same
+greenhouse.File, the way a server answering HTTP range requests would.
+--seek does it the old way, holding a lock around seek() and read(), while the
+default uses pread() and no lock at all.
+'''
+
+import optparse
+import os
+import random
+import tempfile
+import time
+
+import greenhouse
+
+
+def with_pread(fp, size, ranges, filesize, done):
+    for i in xrange(ranges):
+        fp.pread(size, random.randrange(filesize - size))
+    done.increment()
+
+
+def with_seek(fp, lock, size, ranges, filesize, done):
+    for i in xrange(ranges):
+        with lock:
+            fp.seek(random.randrange(filesize - size))
+            fp.read(size)
+    done.increment()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-g", "--greenlets", type=int, default=50)
+    parser.add_option("-r", "--ranges", type=int, default=200)
+    parser.add_option("-s", "--size", type=int, default=16384)
+    parser.add_option("-m", "--megabytes", type=int, default=64)
+    parser.add_option("--seek", action="store_true")
+    options, args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp()
+    try:
+        block = os.urandom(1048576)
+        for i in xrange(options.megabytes):
+            os.write(fd, block)
+        os.close(fd)
+        filesize = options.megabytes * 1048576
+
+        fp = greenhouse.File(path)
+        lock = greenhouse.Lock()
+        done = greenhouse.Counter()
+        for i in xrange(options.greenlets):
+            if options.seek:
+                greenhouse.schedule(with_seek, args=(fp, lock, options.size,
+                    options.ranges, filesize, done))
+            else:
+                greenhouse.schedule(with_pread, args=(fp, options.size,
+                    options.ranges, filesize, done))
+
+        start = time.time()
+        done.wait(options.greenlets)
+        elapsed = time.time() - start
+        fp.close()
+    finally:
+        os.unlink(path)
+
+    total = options.greenlets * options.ranges
+    print "%d reads in %.2fs: %.0f/sec" % (total, elapsed, total / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''line- and record-oriented reading through a socket's makefile()
+
+the file object reads from the socket in large chunks (the makefile bufsize),
+so lots of data sits buffered while it is consumed a small piece at a time.
+that's where a buffer that gets rewritten on every read falls over.
+
+the last case reads lines from a file through a very large chunk size, so
+that megabytes are buffered at a time.
+'''
+
+import optparse
+import os
+import socket
+import tempfile
+import time
+
+import greenhouse
+
+
+def writer(sock, pieces):
+    for piece in pieces:
+        sock.sendall(piece)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def timed_reads(pieces, reader, bufsize):
+    a, b = socket.socketpair()
+    greenhouse.schedule(writer, args=(greenhouse.Socket(fromsock=a), pieces))
+    fp = greenhouse.Socket(fromsock=b).makefile('r', bufsize)
+
+    start = time.time()
+    count = reader(fp)
+    return count, time.time() - start
+
+
+def read_lines(fp):
+    count = 0
+    for line in fp:
+        count += 1
+    return count
+
+
+def read_records(fp, size=64):
+    count = 0
+    while fp.read(size):
+        count += 1
+    return count
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--lines", type=int, default=100000)
+    parser.add_option("-b", "--bufsize", type=int, default=262144)
+    options, args = parser.parse_args()
+
+    line = "GET /some/resource/path HTTP/1.1 with-a-few-more-words\r\n"
+    pieces = [line * 100] * (options.lines // 100)
+
+    count, elapsed = timed_reads(pieces, read_lines, options.bufsize)
+    print "%d lines: %.2fs (%.0f lines/sec)" % (
+            count, elapsed, count / elapsed)
+
+    count, elapsed = timed_reads(pieces, read_records, options.bufsize)
+    print "%d 64-byte records: %.2fs (%.0f records/sec)" % (
+            count, elapsed, count / elapsed)
+
+    fd, path = tempfile.mkstemp()
+    try:
+        os.write(fd, "".join(pieces))
+        os.close(fd)
+        fp = greenhouse.File(path)
+        fp.CHUNKSIZE = 1024 * 1024
+        start = time.time()
+        count = read_lines(fp)
+        elapsed = time.time() - start
+        fp.close()
+    finally:
+        os.unlink(path)
+    print "%d lines from a file, 1MB chunks: %.2fs (%.0f lines/sec)" % (
+            count, elapsed, count / elapsed)
+
+
+if __name__ == '__main__':
+    main()
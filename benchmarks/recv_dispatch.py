@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+'''recv-heavy ping-pong over many socket pairs
+
+every pair has an echoing greenlet on one end and a client greenlet on the
+other, so nearly every recv() blocks and has to be woken by the poller. this
+measures the cost of getting from a readiness event to the waiting greenlet.
+'''
+
+import optparse
+import socket
+import time
+
+import greenhouse
+
+
+def echo(sock):
+    while 1:
+        data = sock.recv(64)
+        if not data:
+            break
+        sock.sendall(data)
+    sock.close()
+
+
+def client(sock, rounds, done):
+    for i in xrange(rounds):
+        sock.sendall("ping")
+        sock.recv(64)
+    sock.close()
+    done.increment()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-p", "--pairs", type=int, default=100)
+    parser.add_option("-r", "--rounds", type=int, default=500)
+    options, args = parser.parse_args()
+
+    done = greenhouse.Counter()
+    for i in xrange(options.pairs):
+        a, b = socket.socketpair()
+        greenhouse.schedule(echo, args=(greenhouse.Socket(fromsock=b),))
+        greenhouse.schedule(client, args=(greenhouse.Socket(fromsock=a),
+            options.rounds, done))
+
+    start = time.time()
+    done.wait(options.pairs)
+    elapsed = time.time() - start
+
+    total = options.pairs * options.rounds
+    print "%d round trips in %.2fs: %.0f/sec" % (total, elapsed, total / elapsed)
+
+
+if __name__ == '__main__':
+    main()
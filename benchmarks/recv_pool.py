@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+'''bulk receiving on many connections, with recv() or the slab pool
+
+every connection has a sender pushing 64KB messages and a receiver taking
+them in, either with recv(65536), which allocates a new string for every read,
+or recv_buffer(), which reads into slabs borrowed from the shared pool. run
+each mode in its own process, as peak RSS only ever goes up.
+'''
+
+import optparse
+import resource
+import socket
+import time
+
+import greenhouse
+from greenhouse.io import buffers
+
+
+def sender(sock, messages, size):
+    payload = "x" * size
+    for i in xrange(messages):
+        sock.sendall(payload)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def recv_receiver(sock, size, done):
+    total = reads = 0
+    while 1:
+        data = sock.recv(size)
+        if not data:
+            break
+        total += len(data)
+        reads += 1
+    done.append((total, reads))
+
+
+def pool_receiver(sock, size, done):
+    total = reads = 0
+    while 1:
+        view = sock.recv_buffer(size)
+        if not len(view):
+            break
+        total += len(view)
+        reads += 1
+    done.append((total, reads))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-m", "--mode", default="pool",
+            help="'recv' or 'pool'")
+    parser.add_option("-c", "--connections", type=int, default=2000)
+    parser.add_option("-n", "--messages", type=int, default=20)
+    parser.add_option("-s", "--size", type=int, default=65536)
+    options, args = parser.parse_args()
+
+    receiver = {'recv': recv_receiver, 'pool': pool_receiver}[options.mode]
+    buffers.slab_pool.slab_size = options.size
+
+    done = []
+    for i in xrange(options.connections):
+        a, b = socket.socketpair()
+        greenhouse.schedule(sender, args=(greenhouse.Socket(fromsock=a),
+            options.messages, options.size))
+        greenhouse.schedule(receiver, args=(greenhouse.Socket(fromsock=b),
+            options.size, done))
+
+    start = time.time()
+    while len(done) < options.connections:
+        greenhouse.pause_for(0.01)
+    elapsed = time.time() - start
+
+    total = sum(t for t, r in done)
+    reads = sum(r for t, r in done)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print "%-4s %dMB in %.2fs (%.0fMB/sec) over %d reads, peak RSS %dMB, " \
+            "%d slabs allocated" % (options.mode, total >> 20, elapsed,
+            (total >> 20) / elapsed, reads, rss >> 10,
+            buffers.slab_pool.created)
+
+
+if __name__ == '__main__':
+    main()
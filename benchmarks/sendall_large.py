@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+'''one large sendall() to a reader that takes small bites
+
+the receiving side reads a few KB at a time, so the sender goes through many
+partial sends. this reports the total time and CPU for the transfer.
+'''
+
+import optparse
+import resource
+import socket
+import time
+
+import greenhouse
+
+
+def reader(sock, total, chunk, done):
+    got = 0
+    while got < total:
+        got += len(sock.recv(chunk))
+    done.set()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--size", type=int, default=64,
+            help="payload size in MB")
+    parser.add_option("-c", "--chunk", type=int, default=4096)
+    options, args = parser.parse_args()
+
+    payload = "x" * (options.size * 1024 * 1024)
+    a, b = socket.socketpair()
+    sender = greenhouse.Socket(fromsock=a)
+    done = greenhouse.Event()
+    greenhouse.schedule(reader, args=(greenhouse.Socket(fromsock=b),
+            len(payload), options.chunk, done))
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    sender.sendall(payload)
+    done.wait()
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = ((after.ru_utime + after.ru_stime) -
+            (before.ru_utime + before.ru_stime))
+    print "%dMB in %d-byte reads: %.2fs, %.2fs CPU" % (
+            options.size, options.chunk, elapsed, cpu)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+'''serving a large file, through userspace versus with sendfile()
+
+the "copy" sender reads the file in chunks with greenhouse.File and
+sendall()s them; the "sendfile" one hands the whole thing to
+Socket.sendfile(). a receiver drains the other end of the socket pair.
+'''
+
+import optparse
+import os
+import resource
+import socket
+import tempfile
+import time
+
+import greenhouse
+
+
+def copy_sender(sock, path, chunk):
+    fp = greenhouse.File(path, 'rb')
+    try:
+        while 1:
+            data = fp.read(chunk)
+            if not data:
+                break
+            sock.sendall(data)
+    finally:
+        fp.close()
+    sock.shutdown(socket.SHUT_WR)
+
+
+def sendfile_sender(sock, path, chunk):
+    fp = greenhouse.File(path, 'rb')
+    try:
+        sock.sendfile(fp)
+    finally:
+        fp.close()
+    sock.shutdown(socket.SHUT_WR)
+
+
+def receiver(sock, done):
+    total = 0
+    buf = bytearray(262144)
+    while 1:
+        got = sock.recv_into(buf)
+        if not got:
+            break
+        total += got
+    done.append(total)
+
+
+def run(sender, path, chunk):
+    a, b = socket.socketpair()
+    done = []
+    greenhouse.schedule(sender, args=(greenhouse.Socket(fromsock=a),
+        path, chunk))
+    greenhouse.schedule(receiver, args=(greenhouse.Socket(fromsock=b), done))
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    while not done:
+        greenhouse.pause_for(0.001)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = ((after.ru_utime + after.ru_stime) -
+            (before.ru_utime + before.ru_stime))
+    return done[0], elapsed, cpu
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-m", "--megabytes", type=int, default=64)
+    parser.add_option("-c", "--chunk", type=int, default=65536)
+    options, args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp()
+    try:
+        block = os.urandom(1 << 20)
+        for i in xrange(options.megabytes):
+            os.write(fd, block)
+        os.close(fd)
+
+        for name, sender in [("copy", copy_sender),
+                ("sendfile", sendfile_sender)]:
+            total, elapsed, cpu = run(sender, path, options.chunk)
+            print "%-8s %dMB in %.2fs (%.0fMB/sec), %.2fs CPU" % (
+                    name, total >> 20, elapsed, (total >> 20) / elapsed, cpu)
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
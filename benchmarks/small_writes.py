@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+'''many small writes through a socket's makefile()
+
+the writer sends responses made of several short header-like lines each,
+flushing after every response, the way code ported from the standard library's
+socket servers tends to. the reader just drains the other end.
+'''
+
+import optparse
+import socket
+import time
+
+import greenhouse
+
+
+def writer(sock, responses, lines, bufsize):
+    fp = sock.makefile('w', bufsize)
+    for i in xrange(responses):
+        for j in xrange(lines):
+            fp.write("Header-%d: some value\r\n" % j)
+        fp.write("\r\n")
+        fp.flush()
+    fp.close()
+    sock.shutdown(socket.SHUT_WR)
+
+
+def reader(sock, done):
+    while sock.recv(65536):
+        pass
+    done.increment()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-p", "--pairs", type=int, default=10)
+    parser.add_option("-r", "--responses", type=int, default=2000)
+    parser.add_option("-l", "--lines", type=int, default=10)
+    parser.add_option("-b", "--bufsize", type=int, default=8192)
+    options, args = parser.parse_args()
+
+    done = greenhouse.Counter()
+    for i in xrange(options.pairs):
+        a, b = socket.socketpair()
+        greenhouse.schedule(writer, args=(greenhouse.Socket(fromsock=a),
+            options.responses, options.lines, options.bufsize))
+        greenhouse.schedule(reader, args=(greenhouse.Socket(fromsock=b), done))
+
+    start = time.time()
+    done.wait(options.pairs)
+    elapsed = time.time() - start
+
+    total = options.pairs * options.responses * (options.lines + 1)
+    print "%d writes in %.2fs: %.0f/sec" % (total, elapsed, total / elapsed)
+
+
+if __name__ == '__main__':
+    main()
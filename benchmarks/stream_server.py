@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+'''short-lived connections against a StreamServer and a plain accept loop
+
+a crowd of client greenlets each make connections one after another, send a
+ping and read the reply. the "naive" server is the accept() and schedule()
+loop from examples/echoserver.py, with a fresh greenlet per connection, the
+"server" one is greenhouse.StreamServer. this reports connections per second,
+the CPU used, and the most handlers that were running at any one time.
+'''
+
+import optparse
+import os
+import resource
+import socket
+import tempfile
+import time
+
+import greenhouse
+
+
+class Tracker(object):
+    def __init__(self):
+        self.running = self.peak = 0
+
+    def handler(self, sock, address):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            data = sock.recv(64)
+            greenhouse.pause()
+            sock.sendall(data)
+        finally:
+            self.running -= 1
+
+
+def naive(listener, handler):
+    def serve(sock, address):
+        try:
+            handler(sock, address)
+        finally:
+            sock.close()
+
+    def loop():
+        while 1:
+            client, address = listener.accept()
+            greenhouse.schedule(serve, args=(client, address))
+
+    greenhouse.schedule(loop)
+
+
+def client(address, count, done):
+    for i in xrange(count):
+        # connecting over a unix socket doesn't block, and a plain socket
+        # keeps greenhouse's name resolution out of the client's cost
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(address)
+        sock = greenhouse.Socket(fromsock=sock)
+        sock.sendall("ping")
+        sock.recv(64)
+        sock.close()
+    done.increment()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-c", "--clients", type=int, default=200)
+    parser.add_option("-n", "--connections", type=int, default=20)
+    parser.add_option("-m", "--max-connections", type=int, default=64)
+    parser.add_option("--naive", action="store_true")
+    options, args = parser.parse_args()
+
+    # a unix socket keeps TIME_WAIT out of the picture
+    address = os.path.join(tempfile.mkdtemp(), "server.sock")
+    listener = greenhouse.Socket(socket.AF_UNIX)
+    listener.bind(address)
+    listener.listen(1024)
+
+    tracker = Tracker()
+    if options.naive:
+        naive(listener, tracker.handler)
+    else:
+        server = greenhouse.StreamServer(listener, tracker.handler,
+                max_connections=options.max_connections)
+        server.start()
+
+    done = greenhouse.Counter()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    for i in xrange(options.clients):
+        greenhouse.schedule(client, args=(address, options.connections, done))
+    done.wait(options.clients)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = ((after.ru_utime + after.ru_stime) -
+            (before.ru_utime + before.ru_stime))
+    total = options.clients * options.connections
+    os.unlink(address)
+    os.rmdir(os.path.dirname(address))
+
+    print "%s: %d connections in %.2fs (%.0f/sec), %.2fs CPU, " \
+            "at most %d handlers at once" % (
+            "naive" if options.naive else "server", total, elapsed,
+            total / elapsed, cpu, tracker.peak)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+'''raw context switch rate through the scheduler
+
+a number of greenlets each pause() in a tight loop, so every iteration is one
+trip through the mainloop and one switch into a greenlet with nothing special
+(no hooks, no pending exception) attached to it.
+'''
+
+import optparse
+import time
+
+import greenhouse
+
+
+def spinner(rounds, done):
+    for i in xrange(rounds):
+        greenhouse.pause()
+    done.increment()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-g", "--greenlets", type=int, default=100)
+    parser.add_option("-r", "--rounds", type=int, default=5000)
+    options, args = parser.parse_args()
+
+    done = greenhouse.Counter()
+    for i in xrange(options.greenlets):
+        greenhouse.schedule(spinner, args=(options.rounds, done))
+
+    start = time.time()
+    done.wait(options.greenlets)
+    elapsed = time.time() - start
+
+    total = options.greenlets * options.rounds
+    print "%d switches in %.2fs: %.0f/sec" % (total, elapsed, total / elapsed)
+
+
+if __name__ == '__main__':
+    main()
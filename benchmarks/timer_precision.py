@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+'''how accurately short sleeps come back, with and without the timerfd
+
+runs a paced loop of short pause_for() calls and reports how late they were on
+average and at worst, plus the CPU used along the way.
+'''
+
+import optparse
+import resource
+import time
+
+import greenhouse
+
+
+def measure(interval, iterations):
+    lateness = []
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    for i in xrange(iterations):
+        start = time.time()
+        greenhouse.pause_for(interval)
+        lateness.append(time.time() - start - interval)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = ((after.ru_utime + after.ru_stime) -
+            (before.ru_utime + before.ru_stime))
+    lateness.sort()
+    return (sum(lateness) / len(lateness), lateness[len(lateness) // 2],
+            lateness[-1], cpu)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-i", "--interval", type=float, default=0.0002)
+    parser.add_option("-n", "--iterations", type=int, default=5000)
+    options, args = parser.parse_args()
+
+    backends = [("poll timeout", False)]
+    if greenhouse.syscalls.timerfd_create is not None:
+        backends.append(("timerfd", True))
+
+    for name, flag in backends:
+        greenhouse.set_high_resolution_timers(flag)
+        mean, median, worst, cpu = measure(
+                options.interval, options.iterations)
+        print "%-12s late by mean %7.1fus, median %7.1fus, max %8.1fus; " \
+                "%.2fs CPU" % (name, mean * 1e6, median * 1e6, worst * 1e6, cpu)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''UDP over loopback, one datagram per call or in batches
+
+the sending and the receiving are timed separately: each round sends a few
+thousand small datagrams to a socket that isn't reading, then reads them all
+back out of its buffer. with --single they go through sendto() and
+recvfrom(), otherwise through sendmany() and recvmany(). this reports the
+time per datagram on each side.
+'''
+
+import optparse
+import socket
+import time
+
+import greenhouse
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-s", "--size", type=int, default=100)
+    parser.add_option("-b", "--batch", type=int, default=64)
+    parser.add_option("-n", "--per-round", type=int, default=2048)
+    parser.add_option("-r", "--rounds", type=int, default=100)
+    parser.add_option("--single", action="store_true")
+    options, args = parser.parse_args()
+
+    rsock = greenhouse.Socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rsock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    rsock.bind(("127.0.0.1", 0))
+    ssock = greenhouse.Socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    batch = [("x" * options.size, rsock.getsockname())] * options.batch
+    batches = options.per_round // options.batch
+    total = batches * options.batch
+
+    sending = receiving = 0
+    for i in xrange(options.rounds):
+        start = time.time()
+        for j in xrange(batches):
+            if options.single:
+                for data, address in batch:
+                    ssock.sendto(data, address)
+            else:
+                ssock.sendmany(batch)
+        sending += time.time() - start
+
+        start = time.time()
+        received = 0
+        while received < total:
+            if options.single:
+                rsock.recvfrom(2048)
+                received += 1
+            else:
+                received += len(rsock.recvmany(options.batch, 2048))
+        receiving += time.time() - start
+
+    count = total * options.rounds
+    print "%s: sending %.2fus, receiving %.2fus per datagram" % (
+            "single" if options.single else "batch",
+            sending / count * 1e6, receiving / count * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 from __future__ import absolute_import
 
-import logging
+import logging as _logging
 import sys
 
 from greenhouse.compat import *
@@ -9,8 +9,10 @@ from greenhouse.util import *
 from greenhouse.pool import *
 
 from greenhouse.io import *
+from greenhouse.server import *
 from greenhouse.backdoor import *
 from greenhouse.emulation import *
+from greenhouse import logging
 
 
 VERSION = (2, 1, 11, '')
@@ -31,17 +33,17 @@ del f
 
 
 def configure_logging(filename=None, filemode=None, fmt=None,
-        level=logging.INFO, stream=None, handler=None):
+        level=_logging.INFO, stream=None, handler=None):
     if handler is None:
         if filename is None:
-            handler = logging.StreamHandler(stream or sys.stderr)
+            handler = _logging.StreamHandler(stream or sys.stderr)
         else:
-            handler = logging.FileHandler(filename, filemode or 'a')
+            handler = _logging.FileHandler(filename, filemode or 'a')
 
     if fmt is None:
         fmt = "[%(asctime)s] %(name)s/%(levelname)s | %(message)s"
-    handler.setFormatter(logging.Formatter(fmt))
+    handler.setFormatter(_logging.Formatter(fmt))
 
-    log = logging.getLogger("greenhouse")
+    log = _logging.getLogger("greenhouse")
     log.setLevel(level)
     log.addHandler(handler)
@@ -23,6 +23,8 @@ def nonblocking_fd(fd):
 
 original_os_read = os.read
 original_os_write = os.write
+original_os_fsync = os.fsync
+original_os_fdatasync = os.fdatasync
 original_os_waitpid = os.waitpid
 original_os_wait = os.wait
 original_os_wait3 = os.wait3
@@ -121,6 +123,20 @@ def polling_green_version(func, retry_test, opt_arg_num, arg_count, timeout):
 
     return green_version
 
+@functools.wraps(original_os_fsync)
+def green_fsync(fd):
+    if hasattr(fd, "fileno"):
+        fd = fd.fileno()
+    return io.threadpool.run(original_os_fsync, fd)
+
+
+@functools.wraps(original_os_fdatasync)
+def green_fdatasync(fd):
+    if hasattr(fd, "fileno"):
+        fd = fd.fileno()
+    return io.threadpool.run(original_os_fdatasync, fd)
+
+
 green_waitpid = polling_green_version(
         original_os_waitpid, lambda x: not (x[0] or x[1]), 1, 2, OS_TIMEOUT)
 green_wait3 = polling_green_version(
@@ -216,6 +232,8 @@ patchers = {
     'fdopen': io.File.fromfd,
     'read': is_pypy and blocking_read or green_read,
     'write': is_pypy and blocking_write or green_write,
+    'fsync': green_fsync,
+    'fdatasync': green_fdatasync,
     'waitpid': green_waitpid,
     'wait': green_wait,
     'wait3': green_wait3,
@@ -2,7 +2,7 @@ from __future__ import absolute_import
 
 import select
 
-from .. import io, scheduler, util
+from .. import io, scheduler
 
 
 def green_select(rlist, wlist, xlist, timeout=None):
@@ -74,16 +74,11 @@ else:
 
 class green_epoll(object):
     def __init__(self, sizehint=-1, from_ep=None):
-        self._readable = util.Event()
         if from_ep:
             self._epoll = from_ep
         else:
             self._epoll = original_epoll(sizehint)
 
-    def _on_readable(self):
-        self._readable.set()
-        self._readable.clear()
-
     def close(self):
         self._epoll.close()
 
@@ -103,13 +98,8 @@ class green_epoll(object):
         self._epoll.modify(fd, eventmask)
 
     def poll(self, timeout=None, maxevents=-1):
-        onr = self._on_readable
-        reg = scheduler._register_fd(self._epoll.fileno(), onr, None)
-        try:
-            self._readable.wait(timeout=timeout)
-            return self._epoll.poll(0, maxevents)
-        finally:
-            scheduler._unregister_fd(self._epoll.fileno(), onr, None, reg)
+        scheduler._wait_fd(self._epoll.fileno(), False, timeout)
+        return self._epoll.poll(0, maxevents)
 
     def register(self, fd, eventmask=all_epoll_evs):
         self._epoll.register(fd, eventmask)
@@ -120,21 +110,11 @@ class green_epoll(object):
 
 class green_kqueue(object):
     def __init__(self, from_kq=None):
-        self._readable = util.Event()
-        self._writable = util.Event()
         if from_kq:
             self._kqueue = from_kq
         else:
             self._kqueue = original_kqueue()
 
-    def _on_readable(self):
-        self._readable.set()
-        self._readable.clear()
-
-    def _on_writable(self):
-        self._writable.set()
-        self._writable.clear()
-
     def close(self):
         self._kqueue.close()
 
@@ -147,13 +127,8 @@ class green_kqueue(object):
         if not max_events:
             return self._kqueue.control(events, max_events, 0)
 
-        onr, onw = self._on_readable, self._on_writable
-        reg = scheduler._register_fd(self._kqueue.fileno(), onr, onw)
-        try:
-            self._readable.wait(timeout=timeout)
-            return self._kqueue.control(events, max_events, 0)
-        finally:
-            scheduler._unregister_fd(self._kqueue.fileno(), onr, onw, reg)
+        scheduler._wait_fd(self._kqueue.fileno(), False, timeout)
+        return self._kqueue.control(events, max_events, 0)
 
     def fileno(self):
         return self._kqueue.fileno()
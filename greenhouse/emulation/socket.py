@@ -1,10 +1,7 @@
 from __future__ import absolute_import
 
+import functools
 import socket
-try:
-    from . import dns
-except ImportError:
-    dns = None
 
 from .. import io
 
@@ -14,31 +11,10 @@ def green_socketpair(*args, **kwargs):
     return io.Socket(fromsock=a), io.Socket(fromsock=b)
 
 
+@functools.wraps(socket.create_connection)
 def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
         source_address=None):
-    if dns:
-        getaddrinfo = dns.getaddrinfo
-    else:
-        getaddrinfo = socket.getaddrinfo
-    err = None
-    for res in getaddrinfo(address[0], address[1], 0, socket.SOCK_STREAM):
-        af, socktype, proto, canonname, sa = res
-        sock = None
-        try:
-            sock = io.Socket(af, socktype, proto)
-            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
-                sock.settimeout(timeout)
-            if source_address:
-                sock.bind(source_address)
-            sock.connect(sa)
-            return sock
-        except socket.error, exc:
-            err = exc
-
-    if err is not None:
-        raise err
-    else:
-        raise socket.error("getaddrinfo returns an empty list")
+    return io.sockets.create_connection(address, timeout, source_address)
 
 
 patchers = {
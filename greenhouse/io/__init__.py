@@ -1,10 +1,12 @@
 from __future__ import absolute_import
 
-from . import descriptor, files, ipc, sockets, ssl
+from . import (descriptor, files, ipc, mapped, sockets, ssl, stats,
+        threadpool, watcher, writequeue)
 
 
 __all__ = ["Socket", "File", "pipe", "stdin", "stdout", "stderr", "wait_fds",
-        "SSLSocket", "wrap_socket"]
+        "SSLSocket", "wrap_socket", "proxy", "create_connection", "WriteQueue",
+        "MappedFile", "Watcher", "follow"]
 
 
 File = files.File
@@ -12,9 +14,18 @@ stdin = files.stdin
 stdout = files.stdout
 stderr = files.stderr
 
+MappedFile = mapped.MappedFile
+
 pipe = ipc.pipe
 
 Socket = sockets.Socket
+proxy = sockets.proxy
+create_connection = sockets.create_connection
+
+WriteQueue = writequeue.WriteQueue
+
+Watcher = watcher.Watcher
+follow = watcher.follow
 
 wait_fds = descriptor.wait_fds
 
@@ -0,0 +1,388 @@
+from __future__ import absolute_import
+
+
+def view_from(data, start):
+    """the part of some data from an offset onward, without copying it
+
+    :param data: the original data
+    :type data: str, bytearray, buffer or memoryview
+    :param start: the offset at which the view should begin
+    :type start: int
+
+    :returns:
+        an object supporting the buffer interface, which can be passed to
+        ``send``, ``os.write`` and friends in place of ``data[start:]``
+    """
+    if not start:
+        return data
+    if isinstance(data, unicode):
+        # buffer() would expose the internal representation
+        return data[start:]
+    try:
+        return buffer(data, start)
+    except TypeError:
+        # memoryviews don't do the old buffer interface, but slice cheaply
+        return memoryview(data)[start:]
+
+
+class SlabPool(object):
+    """a free list of equally sized ``bytearray``\ s to receive data into
+
+    connections borrow a slab while they have received data that hasn't
+    been consumed yet, and give it back once they are drained, so memory
+    goes to the connections with something in flight instead of sitting in
+    a buffer on every idle one, and a busy server recycles the same few
+    large arrays rather than allocating fresh ones for every read.
+
+    :param slab_size: the size in bytes of every slab (default 64KB)
+    :type slab_size: int
+    :param max_idle:
+        the most free slabs to hold on to, beyond this returned slabs are
+        just dropped (default 256)
+    :type max_idle: int
+    """
+    def __init__(self, slab_size=65536, max_idle=256):
+        self.slab_size = slab_size
+        self.max_idle = max_idle
+
+        # how many slabs have ever had to be allocated
+        self.created = 0
+
+        self._idle = []
+
+    def acquire(self):
+        "borrow a slab from the pool, allocating one if none are free"
+        if self._idle:
+            return self._idle.pop()
+        self.created += 1
+        return bytearray(self.slab_size)
+
+    def release(self, slab):
+        "give a slab back to the pool"
+        if len(self._idle) < self.max_idle:
+            self._idle.append(slab)
+
+slab_pool = SlabPool()
+"the pool that sockets borrow their receive buffers from"
+
+
+class ReadBuffer(object):
+    """bytes that have been read from a source but not yet consumed
+
+    the data sits in a ``bytearray`` between a start and an end offset.
+    consuming just moves the start, and new data is written into the spare
+    room after the end, so reading a line (or any other piece) costs time
+    proportional to its own length rather than to everything else that is
+    buffered. the live data is only moved down (or into a bigger array) when
+    there is no room left for what's coming in.
+
+    :param pool:
+        a :class:`SlabPool` to borrow the array from, as long as the data
+        fits in one slab. without one each buffer allocates its own
+    :type pool: :class:`SlabPool` or None
+    :param max_size:
+        the most unconsumed bytes to hold, so that a peer that never sends a
+        delimiter or the end of a frame can't grow the buffer without bound.
+        by default there is no limit. it is the :attr:`max_size` attribute,
+        and can be changed at any time
+    :type max_size: int or None
+    """
+    def __init__(self, pool=None, max_size=None):
+        self._pool = pool
+        self.max_size = max_size
+        self._data = bytearray()
+        self._start = self._end = 0
+
+        # whether _data is borrowed from the pool
+        self._slab = False
+
+        # where a search for a delimiter should pick back up, and the
+        # delimiter that was searched for. a different one starts over, as a
+        # longer delimiter could straddle the point a shorter one got to
+        self._scanned = 0
+        self._scan_for = None
+
+    def __len__(self):
+        return self._end - self._start
+
+    def feed(self, data):
+        """add newly read data to the end of the buffer
+
+        :raises:
+            ``ValueError`` if it would take the buffer past :attr:`max_size`
+        """
+        size = len(data)
+        if self.max_size is not None and \
+                self._end - self._start + size > self.max_size:
+            raise self._overflow()
+        self._reserve(size)
+        end = self._end
+        self._data[end:end + size] = data
+        self._end = end + size
+
+    def fill(self, recv_into, size):
+        """read more data directly into the end of the buffer
+
+        :param recv_into:
+            a function like ``socket.recv_into`` which takes a writable buffer
+            and a maximum size, and returns the number of bytes it wrote
+        :type recv_into: function
+        :param size: the most bytes to read
+        :type size: int
+
+        :returns: the number of bytes added, 0 meaning end of file
+
+        :raises:
+            ``ValueError`` if the buffer already holds :attr:`max_size` bytes.
+            short of that, ``size`` is cut down to the room that is left
+        """
+        end, size = self._room(size)
+        got = recv_into(memoryview(self._data)[end:], size)
+        self._end = end + got
+        return got
+
+    def fill_at(self, read_into, size):
+        """read more data directly into the end of the buffer, by offset
+
+        this is :meth:`fill` for functions that need the array itself rather
+        than a view of its end, as those going through ``ctypes`` do (a
+        ``memoryview`` lacks the old buffer interface they use).
+
+        :param read_into:
+            a function taking the writable array, the offset in it to put
+            data at and a maximum size, and returning the number of bytes it
+            wrote, like :func:`greenhouse.syscalls.read_nowait_into`
+        :type read_into: function
+        :param size: the most bytes to read
+        :type size: int
+
+        :returns: the number of bytes added, 0 meaning end of file
+
+        :raises: ``ValueError`` as for :meth:`fill`
+        """
+        end, size = self._room(size)
+        got = read_into(self._data, end, size)
+        self._end = end + got
+        return got
+
+    def _room(self, size):
+        # make room for a read of up to size bytes, returning where it goes
+        # and how much will fit
+        room = self.max_size
+        if room is not None:
+            room -= self._end - self._start
+            if room <= 0:
+                raise self._overflow()
+            size = min(size, room)
+        self._reserve(size)
+
+        # the room is already there, so read as much as will fit
+        end = self._end
+        size = len(self._data) - end
+        if room is not None:
+            size = min(size, room)
+        return end, size
+
+    def read(self, size=-1):
+        """consume data from the front of the buffer
+
+        :param size:
+            the maximum number of bytes to consume, < 0 means all of it
+        :type size: int
+
+        :returns: a string of the consumed data
+        """
+        start = self._start
+        if size < 0 or start + size > self._end:
+            size = self._end - start
+        rc = str(buffer(self._data, start, size))
+        self._consume_to(start + size)
+        return rc
+
+    def peek(self, size=-1):
+        """copy data from the front of the buffer without consuming it
+
+        :param size:
+            the maximum number of bytes to copy, < 0 means all of it
+        :type size: int
+
+        :returns: a string of the data
+        """
+        start = self._start
+        if size < 0 or start + size > self._end:
+            size = self._end - start
+        return str(buffer(self._data, start, size))
+
+    def readview(self, size=-1):
+        """consume data from the front of the buffer without copying it
+
+        :param size:
+            the maximum number of bytes to consume, < 0 means all of it
+        :type size: int
+
+        :returns:
+            a ``memoryview`` of the consumed data. it points into the
+            buffer's own array, so it is only good until the next data goes
+            into the buffer (or the buffer is :meth:`shed`)
+        """
+        start = self._start
+        if size < 0 or start + size > self._end:
+            size = self._end - start
+        view = memoryview(self._data)[start:start + size]
+        self._consume_to(start + size)
+        return view
+
+    def readuntil(self, delimiter, max_len=-1):
+        """consume data up to and including a delimiter, if it is buffered
+
+        the search picks up where the last unsuccessful one for the same
+        delimiter left off, so repeated calls as data trickles in don't
+        rescan what came before.
+
+        :param delimiter: the string that ends the piece to be read
+        :type delimiter: str
+        :param max_len: consume no more than this many bytes
+        :type max_len: int
+
+        :returns:
+            a string of the consumed data, or ``None`` if neither the
+            delimiter nor ``max_len`` bytes are in the buffer yet
+        """
+        data, start, available = self._data, self._start, self._end
+        scanned = self._scanned if delimiter == self._scan_for else start
+        index = data.find(delimiter, scanned, available)
+        if index >= 0:
+            end = index + len(delimiter)
+            if end - start > max_len >= 0:
+                end = start + max_len
+        elif available - start >= max_len >= 0:
+            end = start + max_len
+        else:
+            # the delimiter might straddle this data and the next to arrive
+            self._scanned = max(start, available - len(delimiter) + 1)
+            self._scan_for = delimiter
+            return None
+
+        rc = str(buffer(data, start, end - start))
+        self._consume_to(end)
+        return rc
+
+    def readframe(self, header, max_size=None):
+        """consume a length-prefixed frame, if all of it is buffered
+
+        :param header: the layout of the frame's length prefix
+        :type header: ``struct.Struct``
+        :param max_size: the largest frame to accept
+        :type max_size: int or None
+
+        :returns:
+            a string of the frame's data without its header, or ``None`` if
+            the whole frame isn't in the buffer yet
+
+        :raises:
+            ``ValueError`` as soon as a header announcing a frame larger than
+            ``max_size`` is buffered
+        """
+        data, start, available = self._data, self._start, self._end
+        body = start + header.size
+        if body > available:
+            return None
+        size, = header.unpack_from(data, start)
+        if max_size is not None and size > max_size:
+            raise ValueError("frame of %d bytes exceeds the %d byte limit" %
+                    (size, max_size))
+        end = body + size
+        if end > available:
+            return None
+        rc = str(buffer(data, body, size))
+        if end == available:
+            self._start = self._end = self._scanned = 0
+        else:
+            self._start = self._scanned = end
+        return rc
+
+    def readinto(self, target, size=-1, consume=True):
+        """consume data from the front of the buffer into a writable buffer
+
+        :param target: where to copy the data
+        :type target: bytearray, memoryview or array.array
+        :param size:
+            the maximum number of bytes to copy, defaults to ``len(target)``
+        :type size: int
+        :param consume:
+            whether to consume what is copied, ``False`` leaves it in the
+            buffer to be read again
+        :type consume: bool
+
+        :returns: the number of bytes copied
+        """
+        if size < 0:
+            size = len(target)
+        size = min(size, len(target), self._end - self._start)
+        chunk = buffer(self._data, self._start, size)
+        try:
+            memoryview(target)[:size] = chunk
+        except TypeError:
+            # array.array only does the old buffer interface
+            target[:size] = type(target)(target.typecode, str(chunk))
+        if consume:
+            self._consume_to(self._start + size)
+        return size
+
+    def clear(self):
+        "throw away everything in the buffer"
+        self._drop_array()
+        self._start = self._end = self._scanned = 0
+
+    def shed(self):
+        """give up the buffer's memory if it holds no data
+
+        a pooled slab goes back to the pool, so this is the thing to do
+        before waiting an unknown length of time for more data to arrive
+        """
+        if self._start == self._end:
+            self.clear()
+
+    def _drop_array(self):
+        if self._slab:
+            self._pool.release(self._data)
+            self._slab = False
+        self._data = bytearray()
+
+    def _consume_to(self, end):
+        if end == self._end:
+            # empty, so the next data can go back at the front
+            self._start = self._end = self._scanned = 0
+        else:
+            self._start = self._scanned = end
+
+    def _overflow(self):
+        return ValueError("buffered data exceeds the %d byte limit" %
+                self.max_size)
+
+    def _reserve(self, size):
+        # make room for size more bytes after the end
+        data, start, end = self._data, self._start, self._end
+        if end + size <= len(data):
+            return
+        live = end - start
+        pool = self._pool
+        if live + size <= len(data) // 2 + 1 or (
+                self._slab and live + size <= len(data)):
+            # moving the live data to the front frees up enough. the slice
+            # copy first is deliberate, as the regions can overlap
+            data[:live] = data[start:end]
+        elif pool is not None and not self._slab and \
+                live + size <= pool.slab_size:
+            slab = pool.acquire()
+            slab[:live] = buffer(data, start, live)
+            self._data = slab
+            self._slab = True
+        else:
+            grown = bytearray(max(live + size, len(data) * 2))
+            grown[:live] = buffer(data, start, live)
+            self._drop_array()
+            self._data = grown
+        self._start = 0
+        self._end = live
+        self._scanned -= start
@@ -1,7 +1,6 @@
 from __future__ import absolute_import
 
 import errno
-import functools
 import time
 
 from .. import compat, scheduler
@@ -38,7 +37,6 @@ def wait_fds(fd_events, inmask=1, outmask=2, timeout=None):
     current = compat.getcurrent()
     activated = {}
     poll_regs = {}
-    callback_refs = {}
 
     def activate(fd, event):
         if not activated and timeout != 0:
@@ -55,16 +53,18 @@ def wait_fds(fd_events, inmask=1, outmask=2, timeout=None):
         activated.setdefault(fd, 0)
         activated[fd] |= event
 
-    for fd, events in fd_events:
-        readable = None
-        writable = None
-        if events & inmask:
-            readable = functools.partial(activate, fd, inmask)
-        if events & outmask:
-            writable = functools.partial(activate, fd, outmask)
+    # one pair of callbacks serves every descriptor, they get passed the fd
+    def on_readable(fd):
+        activate(fd, inmask)
+
+    def on_writable(fd):
+        activate(fd, outmask)
 
-        callback_refs[fd] = (readable, writable)
-        poll_regs[fd] = scheduler._register_fd(fd, readable, writable)
+    for fd, events in fd_events:
+        readable = on_readable if events & inmask else None
+        writable = on_writable if events & outmask else None
+        poll_regs[fd] = (scheduler._register_fd(fd, readable, writable),
+                readable, writable)
 
     if timeout:
         # real timeout value, schedule ourself `timeout` seconds in the future
@@ -77,8 +77,7 @@ def wait_fds(fd_events, inmask=1, outmask=2, timeout=None):
         # timeout is None, it's up to _hit_poller->activate to bring us back
         scheduler.state.mainloop.switch()
 
-    for fd, reg in poll_regs.iteritems():
-        readable, writable = callback_refs[fd]
+    for fd, (reg, readable, writable) in poll_regs.iteritems():
         scheduler._unregister_fd(fd, readable, writable, reg)
 
     if scheduler.state.interrupted:
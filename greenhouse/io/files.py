@@ -1,16 +1,13 @@
 from __future__ import absolute_import, with_statement
 
-import contextlib
 import errno
 import fcntl
 import os
+import stat
 import sys
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-
-from .. import scheduler, util
+import time
+from .. import scheduler, syscalls
+from . import buffers, mapped, stats, threadpool
 
 
 __all__ = ["File", "stdin", "stdout", "stderr"]
@@ -19,18 +16,53 @@ _open = open
 _file = file
 _read = os.read
 _write = os.write
-_fdopen = os.fdopen
 _osopen = os.open
 _osclose = os.close
+_fsync = os.fsync
 _fcntl = fcntl.fcntl
 
+# read_nowait() failures meaning the kernel or filesystem can't do it at all
+_NOWAIT_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL)
+
+# reads bigger than this go through the pool even when the data is in memory,
+# because copying that much takes long enough that other greenlets should get
+# to run meanwhile
+_NOWAIT_MAX = 65536
+
+# where pread() takes page cache reads before copying them out, rather than
+# allocating a buffer for every one. they only happen in the hub, and the
+# copy is made before anything else can run
+_scratch = None
+
+
+def _wait_fd(fd, writing):
+    try:
+        scheduler._wait_fd(fd, writing, exclusive=not writing)
+    except EnvironmentError, exc:
+        if (isinstance(exc, IOError) or not exc.args or
+                exc.args[0] not in errno.errorcode):
+            raise
+        raise IOError, IOError(*exc.args), sys.exc_info()[2]
+
 
 class FileBase(object):
     CHUNKSIZE = 8192
     NEWLINE = "\n"
 
+    # whether read(n) may pull a whole CHUNKSIZE off of the descriptor. this
+    # saves system calls, but is off for files where the descriptor's own
+    # position has to line up with what has been read
+    READ_AHEAD = False
+
+    # the thread pool, if the system calls are handed off to one. the cost
+    # is per call there, so a read isn't limited to a CHUNKSIZE at a time
+    _pool = None
+
     def __init__(self):
-        self._rbuf = StringIO()
+        self._rbuf = buffers.ReadBuffer()
+        self._wbuf = []
+        self._wbuf_len = 0
+        self._wbufsize = 0
         self.encoding = None
 
     def __iter__(self):
@@ -45,6 +77,31 @@ class FileBase(object):
     def __exit__(self, type, value, traceback):
         self.close()
 
+    def _set_bufsize(self, bufsize):
+        # bufsize follows the builtin open(): 0 is unbuffered, 1 is line
+        # buffered, and anything larger is the size of the buffers. < 0 (the
+        # default) leaves writes unbuffered, as they always have been here
+        if bufsize > 1:
+            self.CHUNKSIZE = bufsize
+        self._wbufsize = max(bufsize, 0)
+
+    def _fill(self, size=None):
+        # read another chunk into the buffer, returning False at end of file
+        if size is None or self.READ_AHEAD:
+            size = self.CHUNKSIZE
+        elif self._pool is None:
+            # don't pull more than was asked for off of the descriptor
+            size = min(size, self.CHUNKSIZE)
+
+        while 1:
+            chunk = self._read_chunk(size)
+            if chunk is None:
+                continue
+            if not chunk:
+                return False
+            self._rbuf.feed(chunk)
+            return True
+
     def read(self, size=-1):
         """read a number of bytes from the file and return it as a string
 
@@ -57,38 +114,59 @@ class FileBase(object):
 
         :returns: a string of the read file contents
         """
-        chunksize = size < 0 and self.CHUNKSIZE or min(self.CHUNKSIZE, size)
-
         buf = self._rbuf
-        buf.seek(0, os.SEEK_END)
-        collected = buf.tell()
+        if size < 0:
+            while self._fill():
+                pass
+            return buf.read()
 
-        while 1:
-            if size >= 0 and collected >= size:
-                # we have read enough already
-                break
+        while len(buf) < size and self._fill(size - len(buf)):
+            pass
+        return buf.read(size)
 
-            output = self._read_chunk(chunksize)
-            if output is None:
-                continue
+    def readinto(self, target):
+        """read data from the file into a pre-allocated buffer
 
-            if not output:
-                # nothing more to read
-                break
+        .. note:: this method will block if there is no data already available
+
+        :param target:
+            the buffer to fill, this reads until it is full or the file runs
+            out of data
+        :type target: bytearray, memoryview or array.array
+
+        :returns: the number of bytes read into ``target``
+        """
+        buf = self._rbuf
+        size = len(target)
+        while len(buf) < size and self._fill(size - len(buf)):
+            pass
+        return buf.readinto(target)
+
+    def readuntil(self, delimiter, max_len=-1):
+        """read from the file until a delimiter is encountered
+
+        .. note::
 
-            collected += len(output)
-            buf.write(output)
+            this method will block if there isn't already enough data available
+            from the data source
 
-        # get rid of the old buffer
-        rc = buf.getvalue()
-        buf.seek(0)
-        buf.truncate()
+        :param delimiter: the string that ends the piece to be read
+        :type delimiter: str
+        :param max_len: stop reading after this many bytes
+        :type max_len: int
 
-        if size >= 0:
-            # leave the overflow in the buffer
-            buf.write(rc[size:])
-            return rc[:size]
-        return rc
+        :returns:
+            a string of the data it read from the file, including the
+            delimiter at the end (unless ``max_len`` or the end of the file
+            was reached first)
+        """
+        buf = self._rbuf
+        while 1:
+            rc = buf.readuntil(delimiter, max_len)
+            if rc is not None:
+                return rc
+            if not self._fill():
+                return buf.read(max_len)
 
     def readline(self, max_len=-1):
         """read from the file until a newline is encountered
@@ -105,46 +183,7 @@ class FileBase(object):
             a string of the line it read from the file, including the newline
             at the end
         """
-        buf = self._rbuf
-        newline, chunksize = self.NEWLINE, self.CHUNKSIZE
-        buf.seek(0)
-
-        text = buf.read()
-        if len(text) >= max_len >= 0:
-            buf.seek(0)
-            buf.truncate()
-            buf.write(text[max_len:])
-            return text[:max_len]
-
-        while text.find(newline) < 0:
-            text = self._read_chunk(chunksize)
-            if text is None:
-                text = ''
-                continue
-            if buf.tell() + len(text) >= max_len >= 0:
-                text = buf.getvalue() + text
-                buf.seek(0)
-                buf.truncate()
-                buf.write(text[max_len:])
-                return text[:max_len]
-            if not text:
-                break
-            buf.write(text)
-        else:
-            # found a newline
-            rc = buf.getvalue()
-            index = rc.find(newline) + len(newline)
-
-            buf.seek(0)
-            buf.truncate()
-            buf.write(rc[index:])
-            return rc[:index]
-
-        # hit the end of the file, no more newlines
-        rc = buf.getvalue()
-        buf.seek(0)
-        buf.truncate()
-        return rc
+        return self.readuntil(self.NEWLINE, max_len)
 
     def readlines(self, bufsize=-1):
         """reads the entire file, producing the lines one at a time
@@ -161,16 +200,51 @@ class FileBase(object):
     def write(self, data):
         """write data to the file
 
+        .. note::
+
+            if the file was opened with write buffering, the data may sit in
+            the buffer until it fills up (or a newline is written, with line
+            buffering) or until :meth:`flush` or :meth:`close` is called. a
+            :class:`File` that is garbage collected first writes it out then
+
         :param data:
             the data to write into the file, at the descriptor's current
             position
         :type data: str
         """
-        while data:
-            went = self._write_chunk(data)
+        if not self._wbufsize:
+            self._write_all(data)
+            return
+
+        self._wbuf.append(data)
+        self._wbuf_len += len(data)
+        if self._wbufsize == 1:
+            if self.NEWLINE in data:
+                self._flush_wbuf()
+        elif self._wbuf_len >= self._wbufsize:
+            # the caller is still producing, so more is on the way
+            self._flush_wbuf(more=True)
+
+    def flush(self):
+        "send any buffered writes down to the descriptor"
+        self._flush_wbuf()
+
+    def _flush_wbuf(self, more=False):
+        wbuf = self._wbuf
+        if not wbuf:
+            return
+        data = wbuf[0] if len(wbuf) == 1 else "".join(wbuf)
+        self._wbuf = []
+        self._wbuf_len = 0
+        self._write_all(data, more)
+
+    def _write_all(self, data, more=False):
+        written = 0
+        while written < len(data):
+            went = self._write_chunk(buffers.view_from(data, written))
             if went is None:
                 continue
-            data = data[went:]
+            written += went
 
     def writelines(self, lines):
         """write a sequence of strings into the file
@@ -209,10 +283,36 @@ class File(FileBase):
     this class will use non-blocking file descriptors for its IO, so that
     whatever readystate information the OS and filesystem provide will be used
     to block only a single coroutine rather than the whole process.
-    unfortunately filesystems tend to be very unreliable in this regard.
+
+    regular files never report anything but ready though, so their reads,
+    writes and :meth:`fsync` are instead run in the
+    :mod:`thread pool<greenhouse.io.threadpool>`. a regular file opened only
+    for reading also reads ahead: once it has been read sequentially, the
+    next ``READ_AHEAD_SIZE`` bytes are read in the background while the
+    current ones are being used.
     """
-    def __init__(self, name, mode='rb'):
+    # how much to read in the background from a sequentially read regular
+    # file, 0 turns read-ahead off
+    READ_AHEAD_SIZE = 65536
+
+    # the IOStats this file adds to, if it's being tracked
+    _stats = None
+
+    # whether to try reading straight from the page cache first
+    _nowait = True
+
+    # whether the poller can say when the descriptor is ready, otherwise
+    # waiting on it just yields
+    _polled = False
+
+    # a regular file's read-ahead state
+    _read_ahead = False
+    _prefetch = None
+    _sequential = False
+
+    def __init__(self, name, mode='rb', bufsize=-1):
         super(File, self).__init__()
+        self._set_bufsize(bufsize)
         self.mode = mode
         self.name = name
         self._closed = False
@@ -228,52 +328,35 @@ class File(FileBase):
             # raises OSError. pfft, whatever.
             raise IOError(*exc.args)
 
+        # read-ahead moves the descriptor on, so only files that were opened
+        # here for reading alone get it, not descriptors shared with fromfd()
+        self._read_ahead = not flags & (os.O_WRONLY | os.O_RDWR)
+
         # try to drive the asyncronous waiting off of the polling interface,
         # but epoll doesn't seem to support filesystem descriptors, so fall
         # back to waiting with a simple yield
         self._set_up_waiting()
 
-    @contextlib.contextmanager
-    def _registered(self, read=True, write=True):
-        rd = self._on_readable if read else None
-        wr = self._on_writable if write else None
-        try:
-            reg = scheduler._register_fd(self._fileno, rd, wr)
-        except EnvironmentError, exc:
-            if exc.args and exc.args[0] in errno.errorcode:
-                raise IOError, IOError(*exc.args), sys.exc_info()[2]
-            raise
-
-        try:
-            yield
-        finally:
-            try:
-                scheduler._unregister_fd(self._fileno, rd, wr, reg)
-            except EnvironmentError, exc:
-                if exc.args and exc.args[0] in errno.errorcode:
-                    raise IOError, IOError(*exc.args), sys.exc_info()[2]
-                raise
-
     def _set_up_waiting(self):
-        if scheduler.state.poller.supports(self):
-            self._wait = self._wait_event
-            self._readable = util.Event()
-            self._writable = util.Event()
+        if stat.S_ISREG(os.fstat(self._fileno).st_mode):
+            # pollers call these always ready (or refuse them), but the
+            # system calls can still block on the disk
+            self._pool = threadpool.default
+        elif scheduler.state.poller.supports(self):
+            self._polled = True
+
+    def _wait(self, reading):
+        # a flag rather than a bound method stored on the instance, as that
+        # would be a reference cycle, which keeps a file with a __del__ from
+        # ever being collected
+        if self._polled:
+            self._wait_event(reading)
         else:
-            self._wait = self._wait_yield
-
-    def _on_readable(self):
-        self._readable.set()
-        self._readable.clear()
-
-    def _on_writable(self):
-        self._writable.set()
-        self._writable.clear()
+            self._wait_yield(reading)
 
     def _wait_event(self, reading):
-        "wait on our events"
-        with self._registered(reading, not reading):
-            (self._readable if reading else self._writable).wait()
+        "wait for the poller to report the descriptor ready"
+        _wait_fd(self._fileno, not reading)
 
         if scheduler.state.interrupted:
             raise IOError(errno.EINTR, "interrupted system call")
@@ -282,23 +365,277 @@ class File(FileBase):
         "generic busy wait, for when polling won't work"
         scheduler.pause()
 
+    def _timed_wait(self, reading):
+        start = time.time()
+        try:
+            self._wait(reading=reading)
+        except:
+            self._stats.waited(time.time() - start, failed=True)
+            raise
+        self._stats.waited(time.time() - start)
+
     def _read_chunk(self, size):
+        if self._pool is not None:
+            return self._pool_read(size)
         try:
-            return _read(self._fileno, size)
+            data = _read(self._fileno, size)
         except EnvironmentError, err:
             if err.args[0] in (errno.EAGAIN, errno.EINTR):
-                self._wait(reading=True)
+                if self._stats is None:
+                    self._wait(reading=True)
+                else:
+                    self._timed_wait(True)
                 return None
             raise
+        if self._stats is not None:
+            self._stats.read(len(data))
+        return data
+
+    def _fill(self, size=None):
+        # data that is already in the page cache is read right here, as that
+        # doesn't need a trip through the pool, and it goes straight into
+        # the read buffer
+        if self._pool is not None and self._prefetch is None and \
+                self._nowait and syscalls.read_nowait_into is not None:
+            wanted = self.CHUNKSIZE if size is None else size
+            if self._sequential and self._read_ahead:
+                wanted = max(wanted, self.READ_AHEAD_SIZE)
+            if wanted <= _NOWAIT_MAX:
+                try:
+                    got = self._rbuf.fill_at(self._nowait_into, wanted)
+                except OSError, exc:
+                    self._nowait_failed(exc)
+                else:
+                    # the kernel's own read-ahead is keeping up
+                    self._sequential = True
+                    if self._stats is not None:
+                        self._stats.read(got)
+                    return got > 0
+        return super(File, self)._fill(size)
+
+    def _nowait_into(self, target, start, size):
+        return syscalls.read_nowait_into(self._fileno, target, -1, start, size)
+
+    def _nowait_failed(self, exc):
+        # the data wasn't all in memory, or can't be read that way at all
+        if exc.args[0] in _NOWAIT_UNSUPPORTED:
+            self._nowait = False
+        elif exc.args[0] != errno.EAGAIN:
+            raise IOError(*exc.args)
+        sys.exc_clear()
+
+    def _read_cached(self, size, offset):
+        global _scratch
+        if syscalls.read_nowait_into is None or not self._nowait or \
+                size > _NOWAIT_MAX:
+            return None
+        if _scratch is None:
+            _scratch = bytearray(_NOWAIT_MAX)
+        try:
+            count = syscalls.read_nowait_into(
+                    self._fileno, _scratch, offset, 0, size)
+        except OSError, exc:
+            self._nowait_failed(exc)
+            return None
+        return str(buffer(_scratch, 0, count))
+
+    def _pool_read(self, size):
+        if self._prefetch is not None:
+            job, self._prefetch = self._prefetch, None
+            if job.done:
+                # a read-ahead that keeps up would otherwise let a sequential
+                # reader run without ever giving other greenlets a turn
+                scheduler.pause()
+            data = self._pool.wait(job)
+        else:
+            if self._sequential and self._read_ahead:
+                wanted = max(size, self.READ_AHEAD_SIZE)
+            else:
+                wanted = size
+            data = self._pool.run(_read, self._fileno, wanted)
+
+        # reads as big as the read-ahead wouldn't be any quicker for it
+        if data and self._sequential and self._read_ahead and \
+                size < self.READ_AHEAD_SIZE and self._pool.size:
+            self._prefetch = self._pool.submit(
+                    _read, self._fileno, self.READ_AHEAD_SIZE)
+        self._sequential = True
+
+        if self._stats is not None:
+            self._stats.read(len(data))
+        return data
+
+    def _settle(self):
+        # wait out a read-ahead, so the descriptor's position stays put
+        if self._prefetch is not None:
+            job, self._prefetch = self._prefetch, None
+            data = self._pool.wait(job)
+            if data:
+                self._rbuf.feed(data)
 
     def _write_chunk(self, data):
+        if self._pool is not None:
+            written = self._pool.run(_write, self._fileno, data)
+            if self._stats is not None:
+                self._stats.wrote(written)
+            return written
         try:
-            return _write(self._fileno, data)
+            written = _write(self._fileno, data)
         except EnvironmentError, err:
             if err.args[0] in (errno.EAGAIN, errno.EINTR):
-                self._wait(reading=False)
+                if self._stats is None:
+                    self._wait(reading=False)
+                else:
+                    self._timed_wait(False)
                 return None
             raise
+        if self._stats is not None:
+            self._stats.wrote(written)
+        return written
+
+    def track(self, label):
+        """collect I/O statistics for this file
+
+        the bytes moved, the system calls and the time spent blocked on this
+        file are added to the :class:`IOStats<greenhouse.io.stats.IOStats>`
+        for ``label``, readable with :func:`greenhouse.io.stats.get`.
+
+        :param label: the label to add up under, ``None`` stops tracking
+        """
+        self._stats = None if label is None else stats.get(label)
+
+    def _call(self, func, *args):
+        # a system call on the descriptor, run in the pool for regular files
+        try:
+            if self._pool is not None:
+                return self._pool.run(func, self._fileno, *args)
+            return func(self._fileno, *args)
+        except OSError, exc:
+            raise IOError(*exc.args)
+
+    def _emulated(self, func, offset, arg):
+        # without pread() and pwrite() the descriptor's position has to be
+        # borrowed, so this runs right in the hub where nothing else can move
+        # it in the meantime
+        self._settle()
+        fd = self._fileno
+        try:
+            position = os.lseek(fd, 0, os.SEEK_CUR)
+            os.lseek(fd, offset, os.SEEK_SET)
+            try:
+                return func(fd, arg)
+            finally:
+                os.lseek(fd, position, os.SEEK_SET)
+        except OSError, exc:
+            raise IOError(*exc.args)
+
+    def _pread_chunk(self, size, offset):
+        if syscalls.pread is None:
+            return self._emulated(_read, offset, size)
+        if self._pool is not None:
+            data = self._read_cached(size, offset)
+            if data is not None:
+                return data
+        return self._call(syscalls.pread, size, offset)
+
+    def _pwrite_chunk(self, data, offset):
+        if syscalls.pwrite is None:
+            return self._emulated(_write, offset, data)
+        return self._call(syscalls.pwrite, data, offset)
+
+    def pread(self, size, offset):
+        """read from a position in the file, leaving the file's position alone
+
+        the file's position isn't used either, so any number of greenlets can
+        read their own parts of the one file this way without any locking
+        around :meth:`seek` and :meth:`read`.
+
+        .. note:: this method will block the current coroutine
+
+        :param size: the most bytes to read
+        :type size: int
+        :param offset: the position in the file to read from
+        :type offset: int
+
+        :returns:
+            a string of the data read, shorter than ``size`` only if the end
+            of the file was reached
+        """
+        self.flush()
+        chunks = []
+        while size > 0:
+            data = self._pread_chunk(size, offset)
+            if not data:
+                break
+            chunks.append(data)
+            size -= len(data)
+            offset += len(data)
+        data = chunks[0] if len(chunks) == 1 else "".join(chunks)
+
+        if self._stats is not None:
+            self._stats.read(len(data))
+        return data
+
+    def readinto_at(self, target, offset):
+        """read from a position in the file into a pre-allocated buffer
+
+        like :meth:`pread`, this neither uses nor moves the file's position.
+
+        .. note:: this method will block the current coroutine
+
+        :param target:
+            the buffer to fill, this reads until it is full or the end of the
+            file is reached
+        :type target: bytearray, memoryview or array.array
+        :param offset: the position in the file to read from
+        :type offset: int
+
+        :returns: the number of bytes read into ``target``
+        """
+        if syscalls.pread_into is None or isinstance(target, memoryview):
+            # memoryviews don't do the old buffer interface pread_into needs
+            data = self.pread(len(target), offset)
+            try:
+                memoryview(target)[:len(data)] = data
+            except TypeError:
+                target[:len(data)] = type(target)(target.typecode, data)
+            return len(data)
+
+        self.flush()
+        size = len(target) * getattr(target, "itemsize", 1)
+        total = 0
+        while total < size:
+            count = self._call(
+                    syscalls.pread_into, target, offset + total, total)
+            if not count:
+                break
+            total += count
+
+        if self._stats is not None:
+            self._stats.read(total)
+        return total
+
+    def pwrite(self, data, offset):
+        """write to a position in the file, leaving the file's position alone
+
+        the counterpart of :meth:`pread`. a file opened for appending is
+        written at its end on linux, whatever the ``offset``.
+
+        .. note:: this method will block the current coroutine
+
+        :param data: the data to write
+        :type data: str
+        :param offset: the position in the file to write at
+        :type offset: int
+        """
+        self.flush()
+        written = 0
+        while written < len(data):
+            written += self._pwrite_chunk(
+                    buffers.view_from(data, written), offset + written)
+
+        if self._stats is not None:
+            self._stats.wrote(written)
 
     @staticmethod
     def _add_flags(fd, flags):
@@ -315,14 +652,15 @@ class File(FileBase):
         :param mode: the file mode
         :type mode: str
         :param bufsize:
-            the size of read buffer to use. 0 indicates unbuffered, and < 0
-            means use the system default. defaults to -1
+            the size of buffers to use. 0 indicates unbuffered, 1 means line
+            buffered writes, and < 0 means use the system default for reads
+            and leave writes unbuffered. defaults to -1
 
         :returns: a new :class:`File` object connected to the descriptor
         """
         fp = object.__new__(cls)  # bypass __init__
-        fp._rbuf = StringIO()
-        fp.encoding = None
+        FileBase.__init__(fp)
+        fp._set_bufsize(bufsize)
         fp.mode = mode
         fp._fileno = fd
         fp._closed = False
@@ -333,9 +671,70 @@ class File(FileBase):
         return fp
 
     def close(self):
-        "close the file, and its underlying descriptor"
-        self._closed = True
-        _osclose(self._fileno)
+        "flush buffered writes and close the file and its underlying descriptor"
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            if self._prefetch is not None:
+                # the read-ahead is still using the descriptor
+                try:
+                    self._pool.wait(self._prefetch)
+                except EnvironmentError:
+                    pass
+                self._prefetch = None
+            _osclose(self._fileno)
+
+    def __del__(self):
+        # like the built-in file, a buffered file that is dropped without a
+        # close() or flush() still writes out what it has. this can run in
+        # any greenlet, so it writes directly rather than cooperatively. the
+        # descriptor may be shared through fromfd(), so it is left open
+        if self._closed or not self._wbuf:
+            return
+        data = "".join(self._wbuf)
+        self._wbuf = []
+        self._wbuf_len = 0
+        written = 0
+        try:
+            while written < len(data):
+                written += _write(self._fileno,
+                        buffers.view_from(data, written))
+        except EnvironmentError:
+            pass
+
+    def mmap(self, length=0, offset=0, advice=None):
+        """map the file into memory, read-only
+
+        :param length:
+            how many bytes to map, the default of 0 mapping to the end of the
+            file
+        :type length: int
+        :param offset:
+            the position in the file to start the mapping, a multiple of
+            ``mmap.ALLOCATIONGRANULARITY``
+        :type offset: int
+        :param advice:
+            a ``greenhouse.syscalls.MADV_*`` constant to apply to the mapping
+        :type advice: int or None
+
+        :returns: a :class:`MappedFile<greenhouse.io.mapped.MappedFile>`
+        """
+        self.flush()
+        return mapped.MappedFile(self, length, offset, advice)
+
+    def fsync(self):
+        """flush buffered writes and have the OS write the file out to disk
+
+        .. note:: this method will block the current coroutine
+        """
+        self.flush()
+        if self._pool is not None:
+            self._pool.run(_fsync, self._fileno)
+        else:
+            _fsync(self._fileno)
 
     @property
     def closed(self):
@@ -346,14 +745,6 @@ class File(FileBase):
         "get the file descriptor integer"
         return self._fileno
 
-    def flush(self):
-        """flush buffered writes to disk immediately
-
-        this is provided for compatibility -- this class does no write
-        buffering itself, so it is a no-op
-        """
-        return None
-
     def isatty(self):
         "return whether the file is connected to a tty or not"
         try:
@@ -376,41 +767,31 @@ class File(FileBase):
 
             the default is ``os.SEEK_SET``
         """
+        self.flush()
+        self._settle()
+        if modifier == os.SEEK_CUR:
+            # relative to what has been read, not to what is buffered
+            position -= len(self._rbuf)
         os.lseek(self._fileno, position, modifier)
 
         # clear out the buffer
-        buf = self._rbuf
-        buf.seek(0)
-        buf.truncate()
+        self._rbuf.clear()
+        self._sequential = False
 
     def tell(self):
-        "get the file descriptor's position relative to the file's beginning"
-        with _fdopen(os.dup(self._fileno)) as fp:
-            return fp.tell()
+        "get the file's position relative to its beginning"
+        self.flush()
+        self._settle()
+        return os.lseek(self._fileno, 0, os.SEEK_CUR) - len(self._rbuf)
 
 
 class _StdIOFile(FileBase):
     def __init__(self, fd):
         super(_StdIOFile, self).__init__()
         self._fileno = fd
-        self._readable = util.Event()
-        self._writable = util.Event()
-
-    def _on_readable(self):
-        self._readable.set()
-        self._readable.clear()
-
-    def _on_writable(self):
-        self._writable.set()
-        self._writable.clear()
 
     def _read_chunk(self, size):
-        onr = self._on_readable
-        reg = scheduler._register_fd(self._fileno, onr, None)
-        try:
-            self._readable.wait()
-        finally:
-            scheduler._unregister_fd(self._fileno, onr, None, reg)
+        _wait_fd(self._fileno, False)
 
         if scheduler.state.interrupted:
             raise IOError(errno.EINTR, "interrupted system call")
@@ -418,12 +799,7 @@ class _StdIOFile(FileBase):
         return _read(self._fileno, size)
 
     def _write_chunk(self, data):
-        onw = self._on_writable
-        reg = scheduler._register_fd(self._fileno, None, onw)
-        try:
-            self._writable.wait()
-        finally:
-            scheduler._unregister_fd(self._fileno, None, onw, reg)
+        _wait_fd(self._fileno, True)
 
         if scheduler.state.interrupted:
             raise IOError(errno.EINTR, "interrupted system call")
@@ -436,9 +812,6 @@ class _StdIOFile(FileBase):
     def fileno(self):
         return self._fileno
 
-    def flush(self):
-        return None
-
     def isatty(self):
         try:
             return os.isatty(self._fileno)
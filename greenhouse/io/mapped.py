@@ -0,0 +1,215 @@
+from __future__ import absolute_import
+
+import mmap
+import os
+
+from .. import syscalls
+from . import threadpool
+
+
+__all__ = ["MappedFile"]
+
+# prefetch() reads the file through a scratch buffer this size
+_PREFETCH_CHUNK = 1048576
+
+
+def _page_in(fd, offset, length):
+    # runs in a pool thread. reading the range through the descriptor pulls it
+    # into the page cache that the mapping shares, so that touching it from
+    # the hub afterwards costs no more than a minor fault
+    scratch = bytearray(min(length, _PREFETCH_CHUNK))
+    end = offset + length
+    while offset < end:
+        count = syscalls.pread_into(fd, scratch, offset)
+        if not count:
+            break
+        offset += count
+
+
+class MappedFile(object):
+    """a read-only memory mapping of a file
+
+    indexing and slicing read straight out of the mapping, and :meth:`view`
+    gives access without copying at all, so lookups in big index files avoid
+    the system calls and buffering of
+    :meth:`File.read<greenhouse.io.files.File.read>`.
+
+    touching a page that isn't in memory yet stalls the whole process while
+    the disk catches up, though. :meth:`prefetch` pages a range in on the
+    :mod:`thread pool<greenhouse.io.threadpool>` first, and :meth:`madvise`
+    tells the kernel how the mapping will be read.
+
+    :param fileobj:
+        the file to map, opened for reading. the mapping stays valid after the
+        file is closed
+    :type fileobj:
+        :class:`File<greenhouse.io.files.File>`, a standard file or an int
+        descriptor
+    :param length:
+        how many bytes to map, the default of 0 mapping to the end of the file
+    :type length: int
+    :param offset:
+        the position in the file to start the mapping, a multiple of
+        ``mmap.ALLOCATIONGRANULARITY``
+    :type offset: int
+    :param advice:
+        a ``greenhouse.syscalls.MADV_*`` constant to pass to :meth:`madvise`
+        for the whole mapping
+    :type advice: int or None
+    """
+    def __init__(self, fileobj, length=0, offset=0, advice=None):
+        fd = fileobj if isinstance(fileobj, (int, long)) else fileobj.fileno()
+        self._map = mmap.mmap(fd, length, access=mmap.ACCESS_READ,
+                offset=offset)
+        self._offset = offset
+
+        # a descriptor of our own for prefetch(), and the prefetches that
+        # have to be done with it before it can be closed
+        self._fd = os.dup(fd)
+        self._prefetches = []
+        self._closed = False
+
+        if advice is not None:
+            self.madvise(advice)
+
+    def __len__(self):
+        return len(self._map)
+
+    def __getitem__(self, index):
+        return self._map[index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def view(self, start=0, size=-1):
+        """a view of part of the mapping, without copying any of it
+
+        .. note::
+
+            views into the mapping must not be used after it is closed
+
+        :param start: the offset in the mapping where the view begins
+        :type start: int
+        :param size:
+            the length of the view, the default of -1 going to the end of the
+            mapping
+        :type size: int
+
+        :returns: a ``memoryview`` of the mapped memory
+        """
+        if size < 0:
+            return memoryview(buffer(self._map, start))
+        return memoryview(buffer(self._map, start, size))
+
+    def find(self, sub, start=0, end=None):
+        """find the lowest offset of a string in the mapping
+
+        :param sub: the string to look for
+        :type sub: str
+        :param start: the offset to start looking from
+        :type start: int
+        :param end: the offset to stop looking at, by default the end
+        :type end: int or None
+
+        :returns: the offset where ``sub`` was found, or -1
+        """
+        if end is None:
+            end = len(self._map)
+        return self._map.find(sub, start, end)
+
+    def rfind(self, sub, start=0, end=None):
+        """find the highest offset of a string in the mapping
+
+        :param sub: the string to look for
+        :type sub: str
+        :param start: the offset to start looking from
+        :type start: int
+        :param end: the offset to stop looking at, by default the end
+        :type end: int or None
+
+        :returns: the offset where ``sub`` was found, or -1
+        """
+        if end is None:
+            end = len(self._map)
+        return self._map.rfind(sub, start, end)
+
+    def madvise(self, advice, start=0, length=None):
+        """tell the kernel how a range of the mapping is going to be read
+
+        this is only ever a hint, so it does nothing where ``madvise`` isn't
+        available.
+
+        :param advice:
+            a ``greenhouse.syscalls.MADV_*`` constant, such as
+            ``MADV_RANDOM`` to stop the kernel reading ahead of lookups
+        :type advice: int
+        :param start: the offset in the mapping where the range starts
+        :type start: int
+        :param length: the length of the range, by default to the end
+        :type length: int or None
+        """
+        if syscalls.madvise is not None:
+            syscalls.madvise(self._map, advice, start, length)
+
+    def prefetch(self, start=0, length=None, wait=True):
+        """page a range of the mapping into memory ahead of time
+
+        the range is read on the :mod:`thread pool<greenhouse.io.threadpool>`,
+        so it is the pool that waits on the disk rather than the whole
+        process, and later accesses find it already in memory.
+
+        .. note::
+
+            this method will block the current coroutine unless ``wait`` is
+            ``False``
+
+        :param start: the offset in the mapping where the range starts
+        :type start: int
+        :param length: the length of the range, by default to the end
+        :type length: int or None
+        :param wait:
+            whether to wait for the range to be in memory, rather than just
+            starting it off
+        :type wait: bool
+        """
+        if length is None:
+            length = len(self._map) - start
+        if length <= 0:
+            return
+
+        if syscalls.pread_into is None:
+            # the kernel can at least start reading it in the background
+            self.madvise(syscalls.MADV_WILLNEED, start, length)
+            return
+
+        job = threadpool.submit(_page_in, self._fd, self._offset + start,
+                length)
+        if wait:
+            threadpool.default.wait(job)
+        else:
+            self._prefetches = [j for j in self._prefetches if not j.done]
+            self._prefetches.append(job)
+
+    def close(self):
+        "unmap the file"
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            for job in self._prefetches:
+                try:
+                    threadpool.default.wait(job)
+                except EnvironmentError:
+                    pass
+        finally:
+            self._prefetches = []
+            os.close(self._fd)
+            self._map.close()
+
+    @property
+    def closed(self):
+        "whether the mapping has been closed"
+        return self._closed
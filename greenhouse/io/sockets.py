@@ -1,17 +1,19 @@
-from __future__ import absolute_import, with_statement
+from __future__ import absolute_import
 
-import contextlib
 import errno
 import fcntl
 import os
 import socket
+import stat
+import struct
 import sys
+import time
 
-from .. import scheduler, util
-from . import files
+from .. import scheduler, syscalls, util
+from . import buffers, descriptor, files, stats
 
 
-__all__ = ["Socket"]
+__all__ = ["Socket", "proxy", "create_connection"]
 
 _fcntl = fcntl.fcntl
 _socket = socket.socket
@@ -22,6 +24,48 @@ _BLOCKING_OP = frozenset((
         errno.EINPROGRESS, errno.EAGAIN, errno.EWOULDBLOCK, errno.EALREADY))
 _CANT_SEND = frozenset((errno.EWOULDBLOCK, errno.ENOTCONN))
 
+# sendfile(2) failures that mean the file just has to be copied by hand
+_NO_SENDFILE = frozenset((errno.EINVAL, errno.ENOSYS, errno.ESPIPE))
+
+# splice(2) failures that mean the sockets don't support it
+_NO_SPLICE = frozenset((errno.EINVAL, errno.ENOSYS))
+
+# proxy() asks for bigger pipes than the default 64KB, so each splice can
+# move more. the pages are only allocated as the pipe actually fills
+_F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+_SPLICE_PIPE_SIZE = 262144
+
+# the size of reads when sendfile() has to copy through userspace
+_SENDFILE_COPY_CHUNK = 65536
+
+# how long create_connection() gives each attempt before starting the next
+# one alongside it, as recommended by RFC 8305
+CONNECT_DELAY = 0.25
+
+# how much the frame readers try to pull off the socket at a time. big
+# frames go in bigger reads, but only up to a limit so that a peer announcing
+# a huge frame can't have the whole thing allocated before it arrives
+_RECV_CHUNK = 8192
+_RECV_MAX = 262144
+
+_frame_headers = {}
+
+# socket addresses converted to and from their ``struct sockaddr`` layout for
+# the batched datagram calls. a server hears from the same peers over and
+# over, but these are emptied if they grow past a limit
+_sockaddrs = {}
+_packed_addresses = {}
+_ADDRESS_CACHE_MAX = 4096
+
+# the recv flags that still mean something when the data comes from what the
+# frame readers left buffered rather than from the kernel. there is nothing
+# to wait for, so MSG_DONTWAIT is moot, and MSG_PEEK is done by the buffer
+_BUFFERED_RECV_FLAGS = socket.MSG_PEEK | socket.MSG_DONTWAIT
+
+# python 2's socket module doesn't export this one
+_MSG_MORE = getattr(socket, "MSG_MORE",
+        0x8000 if sys.platform.startswith("linux") else 0)
+
 
 class Socket(object):
     """a replacement class for the standard library's ``socket.socket``
@@ -32,8 +76,24 @@ class Socket(object):
 
     They provide a totally matching API, however
     """
+    # data pulled off the socket by the frame readers but not yet consumed.
+    # it is created on first use, and the plain recv methods drain it first
+    _rbuf = None
+
+    # the most bytes the frame readers may hold unconsumed, past which they
+    # raise ValueError. set it on a socket (or a subclass) to bound what a
+    # peer that never finishes a line or a frame can make it buffer
+    read_buffer_limit = None
+
+    # what recvmany() receives into, kept for the next call
+    _mmsg_buffers = None
+
+    # the IOStats this socket adds to, if it's being tracked
+    _stats = None
+
     def __init__(self, *args, **kwargs):
         sock = kwargs.pop('fromsock', None)
+        accepted = kwargs.pop('_accepted', False)
         if sock is None:
             sock = socket._realsocket(*args, **kwargs)
         while hasattr(sock, "_sock"):
@@ -45,47 +105,63 @@ class Socket(object):
         self._timeout = sock.gettimeout()
         self._closed = False
 
-        # make the underlying socket non-blocking
-        fl = _fcntl(self._fileno, fcntl.F_GETFL)
-        if 0 == fl & os.O_NONBLOCK:
-            _fcntl(self._fileno, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        # make the underlying socket non-blocking. a freshly accepted socket
+        # doesn't inherit the listener's status flags, so there is nothing
+        # to preserve and one F_SETFL does it
+        if accepted:
+            _fcntl(self._fileno, fcntl.F_SETFL, os.O_NONBLOCK)
+        else:
+            fl = _fcntl(self._fileno, fcntl.F_GETFL)
+            if 0 == fl & os.O_NONBLOCK:
+                _fcntl(self._fileno, fcntl.F_SETFL, fl | os.O_NONBLOCK)
 
         # but by default, it blocks greenlets
         self._blocking = True
 
-        # create events
-        self._readable = util.Event()
-        self._writable = util.Event()
-
-    def _on_readable(self):
-        self._readable.set()
-        self._readable.clear()
+    def _wait(self, writing=False, exclusive=False):
+        # block this greenlet until the socket is ready (or the timeout hits)
+        stats = self._stats
+        if stats is None:
+            return self._block(writing, exclusive)
 
-    def _on_writable(self):
-        self._writable.set()
-        self._writable.clear()
-
-    @contextlib.contextmanager
-    def _registered(self, events=None):
-        rd = self._on_readable if events and 'r' in events else None
-        wr = self._on_writable if events and 'w' in events else None
+        start = time.time()
         try:
-            reg = scheduler._register_fd(self._fileno, rd, wr)
-        except EnvironmentError, exc:
-            tb = sys.exc_info()[2]
-            if exc.args and exc.args[0] in errno.errorcode:
-                raise socket.error, socket.error(*exc.args), tb
+            self._block(writing, exclusive)
+        except socket.timeout:
+            stats.waited(time.time() - start, timed_out=True)
+            raise
+        except:
+            stats.waited(time.time() - start, failed=True)
             raise
+        stats.waited(time.time() - start)
 
+    def _block(self, writing, exclusive):
         try:
-            yield
-        finally:
-            try:
-                scheduler._unregister_fd(self._fileno, rd, wr, reg)
-            except EnvironmentError, exc:
-                if exc.args and exc.args[0] in errno.errorcode:
-                    raise socket.error(*exc.args)
+            timed_out = scheduler._wait_fd(
+                    self._fileno, writing, self.gettimeout(), exclusive)
+        except EnvironmentError, exc:
+            if (isinstance(exc, socket.error) or not exc.args or
+                    exc.args[0] not in errno.errorcode):
                 raise
+            raise socket.error, socket.error(*exc.args), sys.exc_info()[2]
+
+        if timed_out:
+            raise socket.timeout("timed out")
+        if scheduler.state.interrupted:
+            raise IOError(errno.EINTR, "interrupted system call")
+
+    def track(self, label):
+        """collect I/O statistics for this socket
+
+        the bytes moved, the system calls and the time spent blocked on this
+        socket are added to the :class:`IOStats<greenhouse.io.stats.IOStats>`
+        for ``label``, readable with :func:`greenhouse.io.stats.get`.
+
+        :param label:
+            the label to add up under, the name of the service at the other
+            end perhaps. ``None`` stops tracking
+        """
+        self._stats = None if label is None else stats.get(label)
 
     @property
     def family(self):
@@ -111,21 +187,16 @@ class Socket(object):
             a two-tuple of ``(socket, address)`` where the socket is connected,
             and the address is the ``(ip_address, port)`` of the remote end
         """
-        with self._registered('re'):
-            while 1:
-                try:
-                    client, addr = self._sock.accept()
-                except socket.error, exc:
-                    if not self._blocking or exc[0] not in _BLOCKING_OP:
-                        raise
-                    sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR,
-                                "interrupted system call")
-                    continue
-                return type(self)(fromsock=client), addr
+        while 1:
+            try:
+                client, addr = self._sock.accept()
+            except socket.error, exc:
+                if not self._blocking or exc[0] not in _BLOCKING_OP:
+                    raise
+                sys.exc_clear()
+                self._wait(exclusive=True)
+                continue
+            return type(self)(fromsock=client, _accepted=True), addr
 
     def bind(self, address):
         """set the socket to operate on an address
@@ -146,6 +217,9 @@ class Socket(object):
         """
         self._closed = True
         self._sock = socket._closedsocket()
+        if self._rbuf is not None:
+            self._rbuf.clear()
+        self._mmsg_buffers = None
 
     def connect(self, address):
         """initiate a new connection to a remote socket bound to an address
@@ -158,18 +232,13 @@ class Socket(object):
             ``(host, port``) two-tuple
         """
         address = _dns_resolve(self, address)
-        with self._registered('we'):
-            while 1:
-                err = self._sock.connect_ex(address)
-                if not self._blocking or err not in _BLOCKING_OP:
-                    if err not in (0, errno.EISCONN):
-                        raise socket.error(err, errno.errorcode[err])
-                    return
-                if self._writable.wait(self.gettimeout()):
-                    raise socket.timeout("timed out")
-                if scheduler.state.interrupted:
-                    raise IOError(errno.EINTR,
-                            "interrupted system call")
+        while 1:
+            err = self._sock.connect_ex(address)
+            if not self._blocking or err not in _BLOCKING_OP:
+                if err not in (0, errno.EISCONN):
+                    raise socket.error(err, errno.errorcode[err])
+                return
+            self._wait(writing=True)
 
     def connect_ex(self, address):
         """initiate a connection without blocking
@@ -256,7 +325,7 @@ class Socket(object):
         """
         return self._sock.listen(backlog)
 
-    def makefile(self, mode='r', bufsize=-1):
+    def makefile(self, mode='r', bufsize=-1, cork=False):
         """create a file-like object that wraps the socket
 
         :param mode:
@@ -264,15 +333,22 @@ class Socket(object):
             write ``'w'``, or both ``'r+'`` (default ``'r'``)
         :type mode: str
         :param bufsize:
-            the length of the read buffer to use. 0 means unbuffered, < 0 means
-            use the system default (default -1)
+            the size of the buffers to use. 0 means unbuffered, 1 means line
+            buffered writes, and < 0 means use the system default for reads
+            and leave writes unbuffered (default -1)
         :type bufsize: int
+        :param cork:
+            whether sends triggered by a full write buffer should tell the
+            kernel more data is coming (``MSG_MORE``), so it can hold back a
+            partial packet until the next :meth:`flush <SocketFile.flush>`
+            (default ``False``)
+        :type cork: bool
 
         :returns:
             a file-like object for which reading and writing sends and receives
             data over the socket connection
         """
-        f = SocketFile(self._sock, mode)
+        f = SocketFile(self._sock, mode, bufsize, cork)
         f._sock.settimeout(self.gettimeout())
         return f
 
@@ -293,21 +369,30 @@ class Socket(object):
         :type flags: int
 
         :returns: the data it read from the socket connection
+
+        :raises:
+            ``socket.error`` with ``EOPNOTSUPP`` for flags other than
+            ``MSG_PEEK`` and ``MSG_DONTWAIT`` while there is data left
+            buffered by the frame readers
         """
-        with self._registered('re'):
-            while 1:
-                if self._closed:
-                    raise socket.error(errno.EBADF, "Bad file descriptor")
-                try:
-                    return self._sock.recv(bufsize, flags)
-                except socket.error, exc:
-                    if not self._blocking or exc[0] not in _BLOCKING_OP:
-                        raise
-                    sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+        if self._rbuf:
+            if flags and self._buffered_flags(flags) & socket.MSG_PEEK:
+                return self._rbuf.peek(bufsize)
+            return self._rbuf.read(bufsize)
+        while 1:
+            if self._closed:
+                raise socket.error(errno.EBADF, "Bad file descriptor")
+            try:
+                data = self._sock.recv(bufsize, flags)
+            except socket.error, exc:
+                if not self._blocking or exc[0] not in _BLOCKING_OP:
+                    raise
+                sys.exc_clear()
+                self._wait(exclusive=True)
+                continue
+            if self._stats is not None:
+                self._stats.read(len(data))
+            return data
 
     def recv_into(self, buffer, bufsize=0, flags=0):
         """receive data from the connection and place it into a buffer
@@ -327,21 +412,189 @@ class Socket(object):
         :type flags: int
 
         :returns: the number of bytes received and placed in the buffer
+
+        :raises:
+            ``socket.error`` with ``EOPNOTSUPP`` for flags other than
+            ``MSG_PEEK`` and ``MSG_DONTWAIT`` while there is data left
+            buffered by the frame readers
         """
-        with self._registered('re'):
-            while 1:
-                if self._closed:
-                    raise socket.error(errno.EBADF, "Bad file descriptor")
-                try:
-                    return self._sock.recv_into(buffer, bufsize, flags)
-                except socket.error, exc:
-                    if not self._blocking or exc[0] not in _BLOCKING_OP:
-                        raise
-                    sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+        if self._rbuf:
+            peek = flags and self._buffered_flags(flags) & socket.MSG_PEEK
+            return self._rbuf.readinto(buffer, bufsize or -1, not peek)
+        return self._recv_into(buffer, bufsize, flags)
+
+    def _buffered_flags(self, flags):
+        if flags & ~_BUFFERED_RECV_FLAGS:
+            raise socket.error(errno.EOPNOTSUPP,
+                    "recv flags %#x unsupported with buffered data" % flags)
+        return flags
+
+    def _recv_into(self, buffer, bufsize=0, flags=0):
+        while 1:
+            if self._closed:
+                raise socket.error(errno.EBADF, "Bad file descriptor")
+            try:
+                count = self._sock.recv_into(buffer, bufsize, flags)
+            except socket.error, exc:
+                if not self._blocking or exc[0] not in _BLOCKING_OP:
+                    raise
+                sys.exc_clear()
+                self._wait(exclusive=True)
+                continue
+            if self._stats is not None:
+                self._stats.read(count)
+            return count
+
+    def _read_buffer(self):
+        if self._rbuf is None:
+            self._rbuf = buffers.ReadBuffer(buffers.slab_pool,
+                    self.read_buffer_limit)
+        return self._rbuf
+
+    def _fill_rbuf(self, rbuf, size):
+        # like _recv_into, except that an empty buffer hands its slab back to
+        # the pool while it waits, so idle connections don't hold on to one
+        while 1:
+            if self._closed:
+                raise socket.error(errno.EBADF, "Bad file descriptor")
+            try:
+                count = rbuf.fill(self._sock.recv_into, size)
+            except socket.error, exc:
+                if not self._blocking or exc[0] not in _BLOCKING_OP:
+                    raise
+                sys.exc_clear()
+                rbuf.shed()
+                self._wait(exclusive=True)
+                continue
+            if self._stats is not None:
+                self._stats.read(count)
+            return count
+
+    def recv_buffer(self, size=-1):
+        """receive data into a pooled buffer and return a view of it
+
+        the data is received into a slab borrowed from
+        :data:`greenhouse.io.buffers.slab_pool`, and no string is allocated
+        for it, which makes this the cheapest way to take in bulk data.
+
+        .. note:: this method will block until data is available to be read
+
+        .. warning::
+
+            the returned view points into the socket's receive buffer, so it
+            is only good until the next receiving call on the socket (or until
+            it is closed). copy out anything that needs to last longer.
+
+        :param size:
+            the maximum number of bytes to receive, < 0 means whatever fits
+            in a slab (the default)
+        :type size: int
+
+        :returns:
+            a ``memoryview`` of the data received, empty if the connection
+            has been closed
+        """
+        rbuf = self._read_buffer()
+        if not len(rbuf):
+            self._fill_rbuf(rbuf, _RECV_CHUNK)
+        return rbuf.readview(size)
+
+    def recv_exactly(self, size):
+        """receive a specific number of bytes from the connection
+
+        .. note:: this method will block until that much data has arrived
+
+        :param size: the number of bytes to receive
+        :type size: int
+
+        :returns:
+            a string of ``size`` bytes, or fewer only if the connection was
+            closed first
+        """
+        rbuf = self._read_buffer()
+        while len(rbuf) < size:
+            want = min(max(size - len(rbuf), _RECV_CHUNK), _RECV_MAX)
+            if not self._fill_rbuf(rbuf, want):
+                break
+        return rbuf.read(size)
+
+    def recv_until(self, delimiter, max_len=-1):
+        """receive data from the connection up to and including a delimiter
+
+        .. note:: this method will block until the delimiter has arrived
+
+        :param delimiter: the string that ends the piece to be received
+        :type delimiter: str
+        :param max_len: stop after receiving this many bytes
+        :type max_len: int
+
+        :returns:
+            a string of the data received, ending with the delimiter unless
+            ``max_len`` or the end of the connection was reached first
+        """
+        rbuf = self._read_buffer()
+        while 1:
+            rc = rbuf.readuntil(delimiter, max_len)
+            if rc is not None:
+                return rc
+            if not self._fill_rbuf(rbuf, _RECV_CHUNK):
+                return rbuf.read(max_len)
+
+    def recv_frame(self, header="!I", max_size=None):
+        """receive a length-prefixed frame from the connection
+
+        .. note:: this method will block until the whole frame has arrived
+
+        :param header:
+            a :mod:`struct` format for the single unsigned integer that
+            precedes each frame with its length (default ``"!I"``, four bytes
+            in network byte order)
+        :type header: str
+        :param max_size:
+            the largest frame to accept. by default there is no limit
+        :type max_size: int or None
+
+        :returns:
+            the frame's data, not including the header, or ``None`` if the
+            connection was closed cleanly between frames
+
+        :raises:
+            ``ValueError`` as soon as a header announces a frame larger than
+            ``max_size``, or ``EOFError`` if the connection closes partway
+            through a frame
+        """
+        layout = _frame_headers.get(header) or _frame_header(header)
+        rbuf = self._rbuf
+        if rbuf is None:
+            rbuf = self._read_buffer()
+        while 1:
+            frame = rbuf.readframe(layout, max_size)
+            if frame is not None:
+                return frame
+
+            # a big frame fills the buffer in steadily bigger reads
+            want = min(max(len(rbuf), _RECV_CHUNK), _RECV_MAX)
+            if not self._fill_rbuf(rbuf, want):
+                if not len(rbuf):
+                    return None
+                raise EOFError("connection closed partway through a frame")
+
+    def send_frame(self, data, header="!I"):
+        """send data as a length-prefixed frame
+
+        the header and data go out together in a single ``writev(2)`` where
+        that is available, without first being joined into one string
+
+        .. note:: this method may block if the socket's send buffer is full
+
+        :param data: the frame's contents
+        :type data: str
+        :param header:
+            a :mod:`struct` format for the frame's length, as for
+            :meth:`recv_frame` (default ``"!I"``)
+        :type header: str
+        """
+        self.sendall_many([_frame_header(header).pack(len(data)), data])
 
     def recvfrom(self, bufsize, flags=0):
         """receive data on a socket that isn't necessarily a 1-1 connection
@@ -361,20 +614,20 @@ class Socket(object):
             a two-tuple of ``(data, address)`` -- the string data received and
             the address from which it was received
         """
-        with self._registered('re'):
-            while 1:
-                if self._closed:
-                    raise socket.error(errno.EBADF, "Bad file descriptor")
-                try:
-                    return self._sock.recvfrom(bufsize, flags)
-                except socket.error, exc:
-                    if not self._blocking or exc[0] not in _BLOCKING_OP:
-                        raise
-                    sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+        while 1:
+            if self._closed:
+                raise socket.error(errno.EBADF, "Bad file descriptor")
+            try:
+                data, address = self._sock.recvfrom(bufsize, flags)
+            except socket.error, exc:
+                if not self._blocking or exc[0] not in _BLOCKING_OP:
+                    raise
+                sys.exc_clear()
+                self._wait(exclusive=True)
+                continue
+            if self._stats is not None:
+                self._stats.read(len(data))
+            return data, address
 
     def recvfrom_into(self, buffer, bufsize=0, flags=0):
         """receive data on a non-TCP socket and place it in a buffer
@@ -397,20 +650,136 @@ class Socket(object):
             a two-tuple of ``(bytes, address)`` -- the number of bytes received
             and placed in the buffer, and the address it was received from
         """
-        with self._registered('re'):
-            while 1:
-                if self._closed:
-                    raise socket.error(errno.EBADF, "Bad file descriptor")
-                try:
-                    return self._sock.recvfrom_into(buffer, bufsize, flags=0)
-                except socket.error, exc:
-                    if not self._blocking or exc[0] not in _BLOCKING_OP:
-                        raise
+        while 1:
+            if self._closed:
+                raise socket.error(errno.EBADF, "Bad file descriptor")
+            try:
+                count, address = self._sock.recvfrom_into(
+                        buffer, bufsize, flags=0)
+            except socket.error, exc:
+                if not self._blocking or exc[0] not in _BLOCKING_OP:
+                    raise
+                sys.exc_clear()
+                self._wait(exclusive=True)
+                continue
+            if self._stats is not None:
+                self._stats.read(count)
+            return count, address
+
+    def recvmany(self, max_msgs, bufsize):
+        """receive a batch of datagrams
+
+        where ``recvmmsg(2)`` is available, every datagram already waiting
+        (up to ``max_msgs``) comes off the socket in a single system call.
+
+        .. note::
+            this method will block until at least one datagram is available,
+            but it then returns only those that were already there
+
+        the memory the datagrams are received into is kept with the socket
+        for the next call, so it's worth keeping ``max_msgs * bufsize``
+        modest.
+
+        :param max_msgs: the most datagrams to receive
+        :type max_msgs: int
+        :param bufsize:
+            the most bytes to take from each datagram, the rest of a longer
+            one is discarded
+        :type bufsize: int
+
+        :returns:
+            a list of two-tuples of ``(data, address)`` for each datagram, as
+            :meth:`recvfrom` would return them
+        """
+        if syscalls.recvmmsg is None:
+            return self._recvmany_singly(max_msgs, bufsize)
+
+        batch = self._mmsg_buffers
+        if batch is None or batch.size != bufsize or \
+                batch.count != min(max_msgs, syscalls.MMSG_MAX):
+            batch = self._mmsg_buffers = syscalls.MessageBuffers(
+                    max_msgs, bufsize)
+
+        while 1:
+            if self._closed:
+                raise socket.error(errno.EBADF, "Bad file descriptor")
+            try:
+                count = syscalls.recvmmsg(self._fileno, batch)
+            except OSError, exc:
+                if exc.args[0] == errno.ENOSYS:
                     sys.exc_clear()
-                    if self._readable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+                    return self._recvmany_singly(max_msgs, bufsize)
+                if not self._blocking or exc.args[0] not in _BLOCKING_OP:
+                    raise socket.error, socket.error(*exc.args), \
+                            sys.exc_info()[2]
+                sys.exc_clear()
+                self._wait(exclusive=True)
+                continue
+            break
+
+        if len(_sockaddrs) > _ADDRESS_CACHE_MAX:
+            _sockaddrs.clear()
+        messages = batch.messages(count, _sockaddrs)
+        if self._stats is not None:
+            self._stats.read(sum(len(data) for data, address in messages))
+        return messages
+
+    def _recvmany_singly(self, max_msgs, bufsize):
+        rc = [self.recvfrom(bufsize)]
+        while len(rc) < max_msgs:
+            try:
+                rc.append(self._sock.recvfrom(bufsize))
+            except socket.error, exc:
+                if exc.args[0] not in _BLOCKING_OP:
+                    raise
+                sys.exc_clear()
+                break
+            if self._stats is not None:
+                self._stats.read(len(rc[-1][0]))
+        return rc
+
+    def recv_fds(self, bufsize, maxfds, flags=0):
+        """receive data along with any file descriptors passed with it
+
+        this only works on ``AF_UNIX`` sockets, and the descriptors come from
+        another process's :meth:`send_fds`. the descriptors are new ones in
+        this process, and it is up to the caller to close them (or wrap them,
+        perhaps with ``socket.fromfd``, and close the original).
+
+        .. note:: this method will block until data is available to be read
+
+        :param bufsize: the most bytes of data to receive
+        :type bufsize: int
+        :param maxfds:
+            the most descriptors to receive from one message, any more are
+            lost
+        :type maxfds: int
+        :param flags:
+            flags for the receive call, as for :meth:`recv`
+        :type flags: int
+
+        :returns:
+            a two-tuple of the data received (an empty string at end of
+            file) and a list of the integer descriptors that came with it
+        """
+        if syscalls.recvmsg_fds is None:
+            raise socket.error(errno.ENOSYS, "descriptor passing unavailable")
+        while 1:
+            if self._closed:
+                raise socket.error(errno.EBADF, "Bad file descriptor")
+            try:
+                data, fds, msg_flags = syscalls.recvmsg_fds(
+                        self._fileno, bufsize, maxfds, flags)
+            except OSError, exc:
+                if not self._blocking or exc.args[0] not in _BLOCKING_OP:
+                    raise socket.error, socket.error(*exc.args), \
+                            sys.exc_info()[2]
+                sys.exc_clear()
+                self._wait(exclusive=True)
+                continue
+            if self._stats is not None:
+                self._stats.read(len(data))
+            return data, fds
 
     def send(self, data, flags=0):
         """send data over the socket connection
@@ -428,17 +797,18 @@ class Socket(object):
             the number of bytes successfully sent, which may not necessarily be
             all the provided data
         """
-        with self._registered('we'):
-            while 1:
-                try:
-                    return self._sock.send(data)
-                except socket.error, exc:
-                    if exc[0] not in _CANT_SEND or not self._blocking:
-                        raise
-                    if self._writable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+        while 1:
+            try:
+                sent = self._sock.send(data, flags)
+            except socket.error, exc:
+                if exc[0] not in _CANT_SEND or not self._blocking:
+                    raise
+                sys.exc_clear()
+                self._wait(writing=True)
+                continue
+            if self._stats is not None:
+                self._stats.wrote(sent)
+            return sent
 
     def sendall(self, data, flags=0):
         """send data over the connection, and keep sending until it all goes
@@ -454,7 +824,173 @@ class Socket(object):
         """
         sent = self.send(data, flags)
         while sent < len(data):
-            sent += self.send(data[sent:], flags)
+            sent += self.send(buffers.view_from(data, sent), flags)
+
+    def sendall_many(self, bufs):
+        """send a sequence of buffers, as though they had been joined first
+
+        where ``writev(2)`` is available the buffers are gathered up by the
+        kernel, so headers and bodies (for instance) can go out together
+        without building a single string from them.
+
+        .. note:: this method may block if the socket's send buffer is full
+
+        :param bufs: the pieces of data to send, in order
+        :type bufs: list of strs (or bytearrays or buffers)
+        """
+        if syscalls.writev is None:
+            for buf in bufs:
+                self.sendall(buf)
+            return
+
+        # writev needs the old-style buffer interface, which memoryviews lack
+        bufs = [buf.tobytes() if isinstance(buf, memoryview) else buf
+                for buf in bufs if len(buf)]
+        i = 0
+        while i < len(bufs):
+            try:
+                sent = syscalls.writev(self._fileno, bufs[i:])
+            except OSError, exc:
+                if exc.args[0] not in _CANT_SEND or not self._blocking:
+                    raise socket.error, socket.error(*exc.args), \
+                            sys.exc_info()[2]
+                sys.exc_clear()
+                self._wait(writing=True)
+                continue
+            if self._stats is not None:
+                self._stats.wrote(sent)
+
+            # skip past whatever went out, leaving a view of a partial buffer
+            while sent:
+                size = len(bufs[i])
+                if sent < size:
+                    bufs[i] = buffers.view_from(bufs[i], sent)
+                    break
+                sent -= size
+                i += 1
+
+    def send_fds(self, data, fds, flags=0):
+        """send data along with open file descriptors
+
+        this only works on ``AF_UNIX`` sockets. the process at the other end
+        gets its own copies of the descriptors from :meth:`recv_fds`, and
+        those here stay open. the descriptors go with the first byte of the
+        data, so it isn't split from them if not all of it is sent.
+
+        .. note:: this method may block if the socket's send buffer is full
+
+        :param data:
+            the data to send, there must be at least one byte of it on a
+            stream socket
+        :type data: str
+        :param fds: the integer descriptors to send
+        :type fds: list
+        :param flags:
+            flags for the send call, as for :meth:`recv`
+        :type flags: int
+
+        :returns: the number of bytes of ``data`` that were sent
+        """
+        if syscalls.sendmsg_fds is None:
+            raise socket.error(errno.ENOSYS, "descriptor passing unavailable")
+        while 1:
+            try:
+                sent = syscalls.sendmsg_fds(self._fileno, data, fds, flags)
+            except OSError, exc:
+                if exc.args[0] not in _CANT_SEND or not self._blocking:
+                    raise socket.error, socket.error(*exc.args), \
+                            sys.exc_info()[2]
+                sys.exc_clear()
+                self._wait(writing=True)
+                continue
+            if self._stats is not None:
+                self._stats.wrote(sent)
+            return sent
+
+    def sendfile(self, file, offset=0, count=None):
+        """send the contents of a file over the connection
+
+        where ``sendfile(2)`` is available the data goes straight from the
+        file to the socket inside the kernel. otherwise (or if the file
+        doesn't allow it, like a pipe) the data is read into memory and sent
+        in chunks.
+
+        .. note:: this method may block if the socket's send buffer is full
+
+        :param file:
+            the file to send from. it needs a ``fileno()`` method to be sent
+            with ``sendfile(2)``, and ``read()`` and ``seek()`` for the fallback
+        :type file: file-like object
+        :param offset: the position in the file to start from (default 0)
+        :type offset: int
+        :param count:
+            the most bytes to send, by default everything up to the end of
+            the file
+        :type count: int or None
+
+        :returns:
+            the number of bytes sent. the file's position is left just after
+            the last of them
+        """
+        if syscalls.sendfile is None or not hasattr(file, "fileno"):
+            return self._sendfile_copy(file, offset, count)
+
+        # sendfile(2) reads from the descriptor, so it can't see writes
+        # still sitting in the file object's buffer
+        if hasattr(file, "flush"):
+            file.flush()
+
+        fileno = file.fileno()
+        try:
+            st = os.fstat(fileno)
+        except OSError:
+            return self._sendfile_copy(file, offset, count)
+        if not stat.S_ISREG(st.st_mode):
+            return self._sendfile_copy(file, offset, count)
+        if count is None:
+            count = max(st.st_size - offset, 0)
+
+        sent = 0
+        try:
+            while sent < count:
+                try:
+                    went = syscalls.sendfile(
+                            self._fileno, fileno, offset + sent, count - sent)
+                except OSError, exc:
+                    if not sent and exc.args[0] in _NO_SENDFILE:
+                        sys.exc_clear()
+                        return self._sendfile_copy(file, offset, count)
+                    if exc.args[0] not in _CANT_SEND or not self._blocking:
+                        raise socket.error, socket.error(*exc.args), \
+                                sys.exc_info()[2]
+                    sys.exc_clear()
+                    self._wait(writing=True)
+                    continue
+                if self._stats is not None:
+                    self._stats.wrote(went)
+                if not went:
+                    # the file ended early
+                    break
+                sent += went
+        finally:
+            if sent:
+                file.seek(offset + sent)
+        return sent
+
+    def _sendfile_copy(self, file, offset, count):
+        if offset:
+            file.seek(offset)
+        sent = 0
+        while count is None or sent < count:
+            size = _SENDFILE_COPY_CHUNK
+            if count is not None:
+                size = min(size, count - sent)
+            data = file.read(size)
+            if not data:
+                break
+            self.sendall(data)
+            sent += len(data)
+        return sent
 
     def sendto(self, data, *args):
         """send data to a particular address
@@ -471,17 +1007,93 @@ class Socket(object):
             a representation of the address to which to send the data, the
             format depends on the socket's type
         """
-        with self._registered('we'):
-            while 1:
+        while 1:
+            try:
+                sent = self._sock.sendto(data, *args)
+            except socket.error, exc:
+                if exc[0] not in _CANT_SEND or not self._blocking:
+                    raise
+                sys.exc_clear()
+                self._wait(writing=True)
+                continue
+            if self._stats is not None:
+                self._stats.wrote(sent)
+            return sent
+
+    def sendmany(self, datagrams):
+        """send a batch of datagrams
+
+        where ``sendmmsg(2)`` is available they go out in as few system
+        calls as the send buffer allows. a datagram addressed by host name
+        rather than number is sent on its own with :meth:`sendto`.
+
+        .. note:: this method may block if the socket's send buffer is full
+
+        :param datagrams:
+            two-tuples of ``(data, address)``, where the address is ``None``
+            to send to a connected socket's peer
+        :type datagrams: list
+        """
+        if syscalls.sendmmsg is None:
+            for data, address in datagrams:
+                self._send_one(data, address)
+            return
+
+        family = self._sock.family
+        packed = _packed_addresses
+        if len(packed) > _ADDRESS_CACHE_MAX:
+            packed.clear()
+
+        batch = []
+        for data, address in datagrams:
+            if not isinstance(data, str):
+                data = data.tobytes() if isinstance(data, memoryview) \
+                        else str(data)
+            if address is None:
+                batch.append((data, ""))
+                continue
+            key = (family, address)
+            raw = packed.get(key)
+            if raw is None:
                 try:
-                    return self._sock.sendto(data, *args)
-                except socket.error, exc:
-                    if exc[0] not in _CANT_SEND or not self._blocking:
-                        raise
-                    if self._writable.wait(self.gettimeout()):
-                        raise socket.timeout("timed out")
-                    if scheduler.state.interrupted:
-                        raise IOError(errno.EINTR, "interrupted system call")
+                    raw = packed[key] = syscalls.pack_sockaddr(
+                            family, address)
+                except ValueError:
+                    sys.exc_clear()
+                    self._sendmmsg_all(batch)
+                    batch = []
+                    self._send_one(data, address)
+                    continue
+            batch.append((data, raw))
+        self._sendmmsg_all(batch)
+
+    def _send_one(self, data, address):
+        if address is None:
+            self.send(data)
+        else:
+            self.sendto(data, address)
+
+    def _sendmmsg_all(self, batch):
+        sent = 0
+        while sent < len(batch):
+            try:
+                went = syscalls.sendmmsg(self._fileno, batch[sent:])
+            except OSError, exc:
+                if exc.args[0] == errno.ENOSYS:
+                    sys.exc_clear()
+                    for data, raw in batch[sent:]:
+                        self._send_one(data, syscalls.unpack_sockaddr(raw))
+                    return
+                if exc.args[0] not in _CANT_SEND or not self._blocking:
+                    raise socket.error, socket.error(*exc.args), \
+                            sys.exc_info()[2]
+                sys.exc_clear()
+                self._wait(writing=True)
+                continue
+            if self._stats is not None:
+                self._stats.wrote(sum(len(data) for data, raw in
+                    batch[sent:sent + went]))
+            sent += went
 
     def setblocking(self, flag):
         """modify the behavior of blocking methods on the socket
@@ -544,37 +1156,337 @@ def socket_fromfd(fd, family, type_, *args):
 
 
 class SocketFile(files.FileBase):
-    def __init__(self, sock, mode='b', bufsize=-1):
+    READ_AHEAD = True
+
+    def __init__(self, sock, mode='b', bufsize=-1, cork=False):
         super(SocketFile, self).__init__()
         self._sock = Socket(fromsock=sock)
         self.mode = mode
-        if bufsize > 0:
-            self.CHUNKSIZE = bufsize
+        self._set_bufsize(bufsize)
+        self._more_flag = _MSG_MORE if cork else 0
 
     @property
     def closed(self):
         return isinstance(self._sock._sock, socket._closedsocket)
 
     def close(self):
-        self._sock.close()
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._sock.close()
 
     def fileno(self):
         return self._sock.fileno()
 
-    def flush(self):
-        pass
-
     def _read_chunk(self, size):
         return self._sock.recv(size)
 
-    def _write_chunk(self, data):
-        return self._sock.send(data)
+    def _write_all(self, data, more=False):
+        self._sock.sendall(data, self._more_flag if more else 0)
 
 
-def _dns_resolve(sock, address):
+def proxy(sock_a, sock_b, chunk=65536):
+    """pass data back and forth between two connected sockets
+
+    each direction runs until its source reaches end of file, then shuts
+    down writing on the other socket, so a connection that one side has
+    half-closed keeps working the other way. where ``splice(2)`` is available
+    the data moves through a pipe without ever being copied into python,
+    otherwise (or for SSL sockets) it goes through a buffer with
+    ``recv_into``.
+
+    if either direction fails, both sockets are shut down so that the other
+    direction finishes too, and the error is raised.
+
+    .. note:: this function blocks until both directions are finished
+
+    :param sock_a: one of the sockets
+    :type sock_a: :class:`Socket`
+    :param sock_b: the other socket
+    :type sock_b: :class:`Socket`
+    :param chunk:
+        the most data to move at a time when copying (default 64KB). with
+        ``splice(2)`` this is the size of the pipe instead
+    :type chunk: int
+
+    :returns:
+        a two-tuple of the number of bytes moved from ``sock_a`` to ``sock_b``
+        and from ``sock_b`` to ``sock_a``
+    """
+    counts = [0, 0]
+    errors = []
+    finished = util.Event()
+
+    scheduler.schedule(_proxy_direction,
+            args=(sock_b, sock_a, chunk, counts, 1, errors, finished))
+    _proxy_direction(sock_a, sock_b, chunk, counts, 0, errors, None)
+    finished.wait()
+
+    if errors:
+        klass, exc, tb = errors[0]
+        raise klass, exc, tb
+    return tuple(counts)
+
+
+def _proxy_direction(src, dst, chunk, counts, index, errors, finished):
+    done = False
+    try:
+        # the frame readers may have left some data buffered
+        if src._rbuf:
+            data = src._rbuf.read()
+            dst.sendall(data)
+            counts[index] += len(data)
+
+        if not _splice_pump(src, dst, chunk, counts, index):
+            _copy_pump(src, dst, chunk, counts, index)
+        done = True
+
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except socket.error:
+            # the other end is already gone, nothing to tell it
+            sys.exc_clear()
+    except Exception:
+        errors.append(sys.exc_info())
+    finally:
+        # whether it failed or was killed (GreenletExit isn't an Exception),
+        # tear down both sockets so the other direction isn't left half open
+        if not done:
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    sys.exc_clear()
+        if finished is not None:
+            finished.set()
+
+
+def _splice_pump(src, dst, chunk, counts, index):
+    # returns False without having moved anything if splice won't work here
+    if (syscalls.splice is None or getattr(src, "_sslobj", None) or
+            getattr(dst, "_sslobj", None)):
+        return False
+
+    flags = syscalls.SPLICE_F_MOVE | syscalls.SPLICE_F_NONBLOCK
+    rpipe, wpipe = os.pipe()
     try:
-        from ..ext import dns
-    except ImportError:
+        chunk = _fcntl(wpipe, _F_SETPIPE_SZ, _SPLICE_PIPE_SIZE)
+    except IOError:
+        # too old a kernel, or over the limit in /proc/sys/fs/pipe-max-size
+        sys.exc_clear()
+    moved = False
+    try:
+        while 1:
+            try:
+                got = syscalls.splice(src._fileno, wpipe, chunk, flags)
+            except OSError, exc:
+                if exc.args[0] == errno.EAGAIN:
+                    sys.exc_clear()
+                    src._wait(exclusive=True)
+                    continue
+                if exc.args[0] in _NO_SPLICE and not moved:
+                    return False
+                raise socket.error, socket.error(*exc.args), \
+                        sys.exc_info()[2]
+            if not got:
+                return True
+            moved = True
+
+            # the pipe was empty, so this is all of what's in it
+            while got:
+                try:
+                    went = syscalls.splice(rpipe, dst._fileno, got, flags)
+                except OSError, exc:
+                    if exc.args[0] != errno.EAGAIN:
+                        raise socket.error, socket.error(*exc.args), \
+                                sys.exc_info()[2]
+                    sys.exc_clear()
+                    dst._wait(writing=True)
+                    continue
+                got -= went
+                counts[index] += went
+    finally:
+        os.close(rpipe)
+        os.close(wpipe)
+
+
+def _copy_pump(src, dst, chunk, counts, index):
+    buf = bytearray(chunk)
+    while 1:
+        got = src.recv_into(buf)
+        if not got:
+            return
+        dst.sendall(buffer(buf, 0, got))
+        counts[index] += got
+
+
+def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+        source_address=None, delay=None):
+    """connect to a TCP service, racing connections to its addresses
+
+    this is a replacement for ``socket.create_connection`` in the style of
+    RFC 8305 ("happy eyeballs"). the host name is resolved, and rather than
+    waiting for each address to fail before trying the next, a connection to
+    the next address is started alongside the others every ``delay`` seconds
+    (or right away when one fails). addresses alternate between IPv6 and
+    IPv4 where there are both. the first connection to be made is returned
+    and the rest are closed, so an unreachable address only costs ``delay``.
+
+    .. note:: this function blocks until a connection has been made
+
+    :param address: a ``(host, port)`` two-tuple
+    :type address: tuple
+    :param timeout:
+        the most time in seconds to spend connecting, across all of the
+        attempts, which is also set as the timeout of the socket returned. by
+        default the global default timeout is used for the connecting and the
+        socket is left as it is
+    :type timeout: int, float or None
+    :param source_address:
+        a ``(host, port)`` two-tuple to bind each socket to before connecting
+    :type source_address: tuple or None
+    :param delay:
+        seconds to let each attempt run on its own before starting another
+        (defaults to :data:`CONNECT_DELAY`, a quarter second)
+    :type delay: int, float or None
+
+    :raises:
+        ``socket.timeout`` if ``timeout`` runs out, otherwise the error from
+        the last attempt to fail if they all did
+
+    :returns: a connected :class:`Socket`
+    """
+    if delay is None:
+        delay = CONNECT_DELAY
+    limit = timeout
+    if limit is socket._GLOBAL_DEFAULT_TIMEOUT:
+        limit = socket.getdefaulttimeout()
+    deadline = None if limit is None else time.time() + limit
+
+    host, port = address
+    candidates = _interleave_families(
+            _getaddrinfo()(host, port, 0, socket.SOCK_STREAM))
+
+    pending = {}
+    err = None
+    winner = None
+    next_attempt = 0
+    try:
+        while winner is None and (candidates or pending):
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                raise socket.timeout("timed out")
+
+            if candidates and (not pending or now >= next_attempt):
+                af, socktype, proto, canonname, sa = candidates.pop()
+                sock = None
+                try:
+                    sock = Socket(af, socktype, proto)
+                    if source_address:
+                        sock.bind(source_address)
+                    code = sock._sock.connect_ex(sa)
+                except socket.error, exc:
+                    code = exc.args[0]
+                    del exc
+                    sys.exc_clear()
+                if code == 0:
+                    winner = sock
+                elif code in _BLOCKING_OP:
+                    pending[sock.fileno()] = sock
+                    next_attempt = now + delay
+                else:
+                    err = socket.error(code, os.strerror(code))
+                    if sock is not None:
+                        sock.close()
+                continue
+
+            wait = None
+            if candidates:
+                wait = max(next_attempt - now, 0)
+            if deadline is not None:
+                wait = deadline - now if wait is None else min(
+                        wait, deadline - now)
+            for fd, events in descriptor.wait_fds(
+                    [(fd, 2) for fd in pending], timeout=wait):
+                sock = pending.pop(fd)
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code == 0 and winner is None:
+                    winner = sock
+                    continue
+                if code:
+                    err = socket.error(code, os.strerror(code))
+                sock.close()
+
+                # a failure makes way for the next attempt straight away
+                next_attempt = 0
+    finally:
+        for sock in pending.itervalues():
+            sock.close()
+
+    if winner is None:
+        if err is not None:
+            raise err
+        raise socket.error("getaddrinfo returns an empty list")
+
+    if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+        winner.settimeout(timeout)
+    return winner
+
+
+def _interleave_families(addrinfo):
+    # RFC 8305 section 4: alternate between the families, starting with the
+    # first one given. this returns them reversed, for popping off the end
+    by_family = {}
+    families = []
+    for info in addrinfo:
+        if info[0] not in by_family:
+            families.append(info[0])
+        by_family.setdefault(info[0], []).append(info)
+
+    ordered = []
+    while by_family:
+        for family in families:
+            if family in by_family:
+                ordered.append(by_family[family].pop(0))
+                if not by_family[family]:
+                    del by_family[family]
+    ordered.reverse()
+    return ordered
+
+
+_resolvers = {}
+
+
+def _getaddrinfo():
+    # the greenhouse resolver if dnspython is there, otherwise the standard
+    # library's. like in _dns_resolve, the import is only ever tried once
+    if "getaddrinfo" not in _resolvers:
+        try:
+            from ..emulation import dns
+            _resolvers["getaddrinfo"] = dns.getaddrinfo
+        except ImportError:
+            _resolvers["getaddrinfo"] = None
+    return _resolvers["getaddrinfo"] or socket.getaddrinfo
+
+
+def _frame_header(header):
+    layout = _frame_headers.get(header)
+    if layout is None:
+        layout = _frame_headers[header] = struct.Struct(header)
+    return layout
+
+
+def _dns_resolve(sock, address):
+    if "dns" not in _resolvers:
+        try:
+            from ..ext import dns
+            _resolvers["dns"] = dns
+        except ImportError:
+            _resolvers["dns"] = None
+    dns = _resolvers["dns"]
+    if dns is None:
         return address
 
     if not (sock.proto == socket.IPPROTO_IP and
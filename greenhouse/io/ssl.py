@@ -9,8 +9,8 @@ import ssl
 import sys
 import time
 
-from greenhouse import scheduler, util
-from greenhouse.io import sockets as gsock
+from greenhouse import scheduler
+from greenhouse.io import buffers, sockets as gsock
 
 
 class SSLSocket(gsock.Socket):
@@ -70,8 +70,6 @@ class SSLSocket(gsock.Socket):
             self._blocking = inner._blocking
         else:
             self._blocking = True
-        self._readable = util.Event()
-        self._writable = util.Event()
 
         if do_handshake_on_connect and self._connected:
             self.do_handshake(self._timeout)
@@ -91,8 +89,6 @@ class SSLSocket(gsock.Socket):
         clone._blocking = self._blocking
         clone._connected = self._connected
         clone._sslobj = self._sslobj
-        clone._readable = util.Event()
-        clone._writable = util.Event()
         return clone
 
     def settimeout(self, timeout):
@@ -166,17 +162,32 @@ class SSLSocket(gsock.Socket):
                 raise ValueError(
                     "non-zero flags not allowed in calls to sendall() on %s" %
                     self.__class__)
-            sent = 0
-            sent = self.send(data[sent:])
+            sent = self.send(data)
             while (sent < len(data)):
                 if self._blocking:
                     self._wait_event(tout.now, write=True)
-                sent += self.send(data[sent:])
+                sent += self.send(buffers.view_from(data, sent))
             return sent
         else:
-            return super(SSLSocket, self).sendall(self, data, flags)
+            return super(SSLSocket, self).sendall(data, flags)
+
+    def sendall_many(self, bufs):
+        if self._sslobj:
+            # writev would skip the encryption
+            for buf in bufs:
+                self.sendall(buf)
+            return
+        return super(SSLSocket, self).sendall_many(bufs)
+
+    def sendfile(self, file, offset=0, count=None):
+        if self._sslobj:
+            # sendfile(2) would skip the encryption
+            return self._sendfile_copy(file, offset, count)
+        return super(SSLSocket, self).sendfile(file, offset, count)
 
     def recv(self, buflen=1024, flags=0):
+        if self._rbuf:
+            return self._rbuf.read(buflen)
         if self._sslobj:
             if flags != 0:
                 raise ValueError(
@@ -187,10 +198,14 @@ class SSLSocket(gsock.Socket):
             return self._sock.recv(buflen, flags)
 
     def recv_into(self, buffer, nbytes=None, flags=0):
-        if buffer and (nbytes is None):
-            nbytes = len(buffer)
-        elif nbytes is None:
-            nbytes = 1024
+        return super(SSLSocket, self).recv_into(buffer, nbytes or 0, flags)
+
+    def _fill_rbuf(self, rbuf, size):
+        return rbuf.fill(self._recv_into, size)
+
+    def _recv_into(self, buffer, nbytes=0, flags=0):
+        if not nbytes:
+            nbytes = len(buffer) or 1024
         if self._sslobj:
             if flags != 0:
                 raise ValueError("non-zero flags not allowed in calls to "
@@ -237,6 +252,8 @@ class SSLSocket(gsock.Socket):
     def close(self):
         self._sslobj = None
         self._sock = socket._closedsocket()
+        if self._rbuf is not None:
+            self._rbuf.clear()
 
     def do_handshake(self, timeout):
         'perform a SSL/TLS handshake'
@@ -322,41 +339,19 @@ class SSLSocket(gsock.Socket):
 
     def makefile(self, mode='r', bufsize=-1):
         'return a file-like object that operates on the ssl connection'
-        return gsock.SocketFile(self._clone(), mode)
-
-    def _on_readable(self):
-        self._readable.set()
-        self._readable.clear()
-
-    def _on_writable(self):
-        self._writable.set()
-        self._writable.clear()
+        return gsock.SocketFile(self._clone(), mode, bufsize)
 
     def _wait_event(self, timeout=None, write=False):
-        if write:
-            event = self._writable
-            onr, onw = None, self._on_writable
-        else:
-            event = self._readable
-            onr, onw = self._on_readable, None
-
         try:
-            reg = scheduler._register_fd(self.fileno(), onr, onw)
+            timed_out = scheduler._wait_fd(
+                    self.fileno(), write, timeout, exclusive=not write)
         except EnvironmentError, error:
             if error.args[0] in errno.errorcode:
                 raise socket.error(*error.args)
             raise
 
-        try:
-            if event.wait(timeout):
-                raise socket.timeout("timed out")
-        finally:
-            try:
-                scheduler._unregister_fd(self.fileno(), onr, onw, reg)
-            except EnvironmentError, error:
-                if error.args[0] in errno.errorcode:
-                    raise socket.error(*error.args)
-                raise
+        if timed_out:
+            raise socket.timeout("timed out")
 
     def _with_retry(self, func=None, timeout=None):
         if func is None:
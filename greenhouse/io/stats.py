@@ -0,0 +1,158 @@
+"""I/O statistics for sockets and files, collected under labels
+
+tracking is turned on for each :class:`Socket<greenhouse.io.sockets.Socket>`
+or :class:`File<greenhouse.io.files.File>` with its ``track()`` method, and
+everything tracked under the same label (the name of the service at the
+other end of a connection, say) adds up in the one :class:`IOStats`. an
+untracked socket or file pays nothing more than an ``is None`` check per call.
+"""
+from __future__ import absolute_import
+
+import math
+
+
+__all__ = ["IOStats", "get", "snapshot", "reset"]
+
+# wait times go in power-of-two buckets of microseconds: the first is waits
+# under a microsecond, bucket ``i`` is from 2**(i-1) up to 2**i, and the last
+# takes everything from about 4 seconds up
+HISTOGRAM_BUCKETS = 24
+
+_registry = {}
+
+
+class IOStats(object):
+    """the counters for everything tracked under one label
+
+    .. attribute:: bytes_in
+
+        bytes received or read
+
+    .. attribute:: bytes_out
+
+        bytes sent or written
+
+    .. attribute:: calls
+
+        system calls that moved data, or found there was none to move
+
+    .. attribute:: waits
+
+        times a greenlet blocked waiting for a descriptor to be ready
+
+    .. attribute:: retries
+
+        waits after which the call was retried, rather than the wait timing
+        out or failing
+
+    .. attribute:: timeouts
+
+        waits that ended in a timeout
+
+    .. attribute:: wait_time
+
+        total seconds spent blocked in those waits
+
+    .. attribute:: histogram
+
+        counts of the waits by how long they blocked, see :meth:`buckets`
+    """
+    __slots__ = ["label", "bytes_in", "bytes_out", "calls", "waits",
+            "retries", "timeouts", "wait_time", "histogram"]
+
+    def __init__(self, label):
+        self.label = label
+        self.bytes_in = self.bytes_out = self.calls = 0
+        self.waits = self.retries = self.timeouts = 0
+        self.wait_time = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def read(self, count):
+        "record a call that took in ``count`` bytes"
+        self.calls += 1
+        self.bytes_in += count
+
+    def wrote(self, count):
+        "record a call that put out ``count`` bytes"
+        self.calls += 1
+        self.bytes_out += count
+
+    def waited(self, seconds, timed_out=False, failed=False):
+        """record a wait for readiness
+
+        :param seconds: how long it blocked
+        :type seconds: float
+        :param timed_out: whether it ended because of a timeout
+        :type timed_out: bool
+        :param failed: whether it ended with an exception
+        :type failed: bool
+        """
+        # every wait is for a call that found the descriptor wasn't ready
+        self.calls += 1
+        self.waits += 1
+        self.wait_time += seconds
+        if timed_out:
+            self.timeouts += 1
+        elif not failed:
+            self.retries += 1
+
+        bucket = math.frexp(seconds * 1e6)[1] if seconds >= 1e-6 else 0
+        self.histogram[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+    @staticmethod
+    def buckets():
+        """the upper bounds of the histogram's buckets
+
+        :returns:
+            a list with the number of seconds below which each bucket's waits
+            fell, the last one being ``None`` for unbounded
+        """
+        return [2 ** i / 1e6 for i in xrange(HISTOGRAM_BUCKETS - 1)] + [None]
+
+    def as_dict(self):
+        """a copy of the counters
+
+        :returns: a dictionary of each attribute's name and its value
+        """
+        rc = dict((name, getattr(self, name)) for name in self.__slots__)
+        rc["histogram"] = list(self.histogram)
+        return rc
+
+    def __repr__(self):
+        return "<%s %r: %d in, %d out, %d waits>" % (type(self).__name__,
+                self.label, self.bytes_in, self.bytes_out, self.waits)
+
+
+def get(label):
+    """the statistics for a label, created if there are none yet
+
+    :param label: any hashable label
+    """
+    stats = _registry.get(label)
+    if stats is None:
+        stats = _registry[label] = IOStats(label)
+    return stats
+
+
+def snapshot():
+    """a copy of the statistics for every label
+
+    :returns: a dictionary mapping labels to :meth:`IOStats.as_dict` results
+    """
+    return dict((label, stats.as_dict())
+            for label, stats in _registry.items())
+
+
+def reset(label=None):
+    """zero the statistics for one label, or for every one
+
+    sockets and files that are tracked under a label carry on adding to it.
+
+    :param label: the label to reset, the default of ``None`` resets all
+    """
+    if label is None:
+        targets = _registry.values()
+    else:
+        targets = [_registry[label]] if label in _registry else []
+    for stats in targets:
+        stats.__init__(stats.label)
@@ -0,0 +1,259 @@
+"""run blocking calls on a small pool of OS threads
+
+regular files are always "ready" as far as the pollers are concerned, so a
+read or write that has to go to a slow disk blocks inside the kernel, and
+with it every greenlet in the process. the calls that can do that are instead
+handed to a worker thread here, and the calling greenlet blocks until a byte
+written to a wakeup pipe tells the hub that its call is finished.
+
+the functions run in the pool have to be safe to run outside of the hub's
+thread: plain system calls like ``os.read``, ``os.write`` and ``os.fsync``
+are, but anything touching greenlets or the scheduler is not.
+"""
+from __future__ import absolute_import
+
+import collections
+import errno
+import fcntl
+import os
+import sys
+import thread
+
+from .. import compat, scheduler
+
+
+__all__ = ["ThreadPool", "Job", "run", "submit", "set_size", "default"]
+
+# grab these now, in case greenhouse.emulation replaces them later
+_start_new_thread = thread.start_new_thread
+_allocate_lock = thread.allocate_lock
+_read = os.read
+_write = os.write
+
+
+class Job(object):
+    """a call handed to a :class:`ThreadPool`, as returned by
+    :meth:`ThreadPool.submit`
+    """
+    __slots__ = ["func", "args", "kwargs", "done", "result", "exc_info",
+            "waiter"]
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.done = False
+        self.result = self.exc_info = self.waiter = None
+
+    def _run(self):
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except:
+            self.exc_info = sys.exc_info()
+        self.func = self.args = self.kwargs = None
+        self.done = True
+
+
+class ThreadPool(object):
+    """a pool of OS threads for calls that would otherwise block the hub
+
+    threads are started as they are needed, up to ``size`` of them, and then
+    wait around for more work.
+
+    :param size:
+        the most threads to run at once. a size of 0 runs every call directly
+        in the calling greenlet, blocking the process as it would have without
+        the pool
+    :type size: int
+    """
+    _wake_r = _wake_w = None
+
+    def __init__(self, size=4):
+        self.size = size
+        self._set_up()
+
+    def _set_up(self):
+        self._pid = os.getpid()
+        self._mutex = _allocate_lock()
+        self._queue = collections.deque()
+        self._idle = []
+        self._threads = 0
+
+        # a forked child has the parent's pipe, which is no use to it now
+        if self._wake_r is not None:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+        # the wakeup pipe, non-blocking on both ends. workers ignore a full
+        # pipe since there are already bytes in it to wake the collector
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        # jobs with a greenlet blocked on them, and the greenlet waking those
+        self._waiting = []
+        self._collector = None
+
+    def submit(self, func, *args, **kwargs):
+        """start a call in the pool without waiting for it
+
+        :param func: the function to call in a worker thread
+        :type func: function
+
+        all other arguments are passed along to ``func``
+
+        :returns:
+            a :class:`Job`, to pass to :meth:`wait` for its result
+        """
+        job = Job(func, args, kwargs)
+        if not self.size:
+            job._run()
+            return job
+
+        if self._pid != os.getpid():
+            # the threads didn't come through a fork with us
+            self._set_up()
+
+        with self._mutex:
+            self._queue.append(job)
+            if self._idle:
+                self._idle.pop().release()
+                return job
+            if self._threads >= self.size:
+                return job
+            self._threads += 1
+        _start_new_thread(self._work, ())
+        return job
+
+    def wait(self, job):
+        """block until a job is finished, and get its result
+
+        .. note:: this method will block the current greenlet
+
+        :param job: a job returned by :meth:`submit`
+        :type job: :class:`Job`
+
+        :returns: whatever the job's function returned
+
+        :raises: whatever exception the job's function raised
+        """
+        if not job.done:
+            job.waiter = compat.getcurrent()
+            self._waiting.append(job)
+            try:
+                while not job.done:
+                    # only now, once it's certain this greenlet will be
+                    # woken by the collector, is the collector started
+                    if self._collector is None:
+                        self._collector = scheduler.greenlet(self._collect)
+                        scheduler.schedule(self._collector)
+                    scheduler.state.mainloop.switch()
+            finally:
+                job.waiter = None
+                if job in self._waiting:
+                    self._waiting.remove(job)
+
+        if job.exc_info is not None:
+            exc_info, job.exc_info = job.exc_info, None
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return job.result
+
+    def run(self, func, *args, **kwargs):
+        """call a function in the pool and wait for it to finish
+
+        .. note:: this method will block the current greenlet
+
+        :param func: the function to call in a worker thread
+        :type func: function
+
+        all other arguments are passed along to ``func``
+
+        :returns: whatever ``func`` returned
+
+        :raises: whatever exception ``func`` raised
+        """
+        if not self.size:
+            return func(*args, **kwargs)
+        return self.wait(self.submit(func, *args, **kwargs))
+
+    def _work(self):
+        # runs in a worker thread
+        wakeup = _allocate_lock()
+        wakeup.acquire()
+        while 1:
+            with self._mutex:
+                if self._queue:
+                    job = self._queue.popleft()
+                elif self._threads > self.size:
+                    # the pool was shrunk
+                    self._threads -= 1
+                    return
+                else:
+                    job = None
+                    self._idle.append(wakeup)
+
+            if job is None:
+                wakeup.acquire()
+                continue
+
+            job._run()
+            try:
+                _write(self._wake_w, "\0")
+            except EnvironmentError:
+                pass
+
+    def _collect(self):
+        try:
+            while self._waiting:
+                scheduler._wait_fd(self._wake_r)
+                try:
+                    while _read(self._wake_r, 4096):
+                        pass
+                except EnvironmentError, exc:
+                    if exc.args[0] != errno.EAGAIN:
+                        raise
+
+                for job in [j for j in self._waiting if j.done]:
+                    self._waiting.remove(job)
+                    scheduler.schedule(job.waiter)
+        finally:
+            self._collector = None
+
+    def resize(self, size):
+        """change the number of threads the pool may run
+
+        extra threads exit once they are idle
+
+        :param size: the new size
+        :type size: int
+        """
+        with self._mutex:
+            self.size = size
+            idle, self._idle = self._idle, []
+        for wakeup in idle:
+            wakeup.release()
+
+
+default = ThreadPool()
+"the pool that :class:`File<greenhouse.io.files.File>` I/O runs in"
+
+
+def submit(func, *args, **kwargs):
+    "start a call in the :data:`default` pool, see :meth:`ThreadPool.submit`"
+    return default.submit(func, *args, **kwargs)
+
+
+def run(func, *args, **kwargs):
+    "run a call in the :data:`default` pool, see :meth:`ThreadPool.run`"
+    return default.run(func, *args, **kwargs)
+
+
+def set_size(size):
+    """change how many threads the :data:`default` pool may run
+
+    :param size: the most threads, 0 doing all the work in the hub
+    :type size: int
+    """
+    default.resize(size)
@@ -0,0 +1,358 @@
+from __future__ import absolute_import
+
+import collections
+import errno
+import os
+
+from .. import scheduler, syscalls, util
+from . import files
+
+
+__all__ = ["Watcher", "WatchEvent", "Follower", "follow"]
+
+_read = os.read
+
+# how much to read off of the inotify descriptor each time it is readable.
+# that is room for hundreds of events, the most one can take being 272 bytes
+_READ_SIZE = 65536
+
+# follow() reads what has been appended to the file in chunks this size
+_FOLLOW_CHUNK = 65536
+
+
+class WatchEvent(object):
+    """something that happened to a watched file or directory
+
+    .. attribute:: wd
+
+        the watch descriptor returned by :meth:`Watcher.add`, or -1 for an
+        ``IN_Q_OVERFLOW`` event
+
+    .. attribute:: mask
+
+        the ``greenhouse.syscalls.IN_*`` bits for what happened
+
+    .. attribute:: cookie
+
+        the same number on the ``IN_MOVED_FROM`` and ``IN_MOVED_TO`` halves
+        of a rename, otherwise 0
+
+    .. attribute:: name
+
+        the name of the file it happened to within a watched directory, or
+        an empty string when it happened to the watched path itself
+
+    .. attribute:: path
+
+        the watched path joined with :attr:`name`, or ``None`` when the
+        watch was removed before the event was read
+    """
+    __slots__ = ["wd", "mask", "cookie", "name", "path"]
+
+    def __init__(self, wd, mask, cookie, name, path):
+        self.wd = wd
+        self.mask = mask
+        self.cookie = cookie
+        self.name = name
+        self.path = path
+
+    def __repr__(self):
+        return "<WatchEvent wd=%d mask=%#x cookie=%d path=%r>" % (
+                self.wd, self.mask, self.cookie, self.path)
+
+
+class Watcher(object):
+    """a queue of events for files and directories, delivered by inotify
+
+    the inotify descriptor is registered with the poller once, for as long as
+    the watcher is open. whenever it is readable the events are read off in a
+    batch and decoded in the hub, and greenlets take them from a queue with
+    :meth:`get` or by iterating over the watcher, without any polling of
+    ``os.stat``.
+
+    events queue up until they are taken, so something should be consuming
+    them for as long as the watcher is open.
+
+    :raises:
+        ``OSError`` with ``ENOSYS`` where inotify isn't available
+    """
+    def __init__(self):
+        if syscalls.inotify_init is None:
+            raise OSError(errno.ENOSYS, "inotify unavailable")
+        self._fd = syscalls.inotify_init()
+        self._paths = {}
+        self._events = util.Queue()
+        self._closed = False
+        self._reg = scheduler._register_fd(self._fd, self._readable, None)
+
+    def __iter__(self):
+        while 1:
+            event = self.get()
+            if event is None:
+                return
+            yield event
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def add(self, path, mask=syscalls.IN_ALL_EVENTS):
+        """start watching a file or directory
+
+        watching a directory reports events for the files in it, with their
+        :attr:`WatchEvent.name` set.
+
+        :param path: the file or directory to watch
+        :type path: str
+        :param mask:
+            the ``greenhouse.syscalls.IN_*`` events to watch for, and any
+            ``IN_*`` flags. the default is every event
+        :type mask: int
+
+        :returns:
+            the watch descriptor that the path's events will carry, the same
+            one again if the path was already being watched
+        """
+        wd = syscalls.inotify_add_watch(self._fd, path, mask)
+        self._paths[wd] = path
+        return wd
+
+    def remove(self, wd):
+        """stop watching a file or directory
+
+        an ``IN_IGNORED`` event for the watch descriptor is the last one it
+        gets.
+
+        :param wd: a watch descriptor that :meth:`add` returned
+        :type wd: int
+        """
+        syscalls.inotify_rm_watch(self._fd, wd)
+
+    def get(self, block=True, timeout=None):
+        """take the next event off of the queue
+
+        .. note::
+
+            this method will block the current coroutine if ``block`` is
+            ``True`` and there are no events yet
+
+        :param block: whether to wait for an event if there isn't one queued
+        :type block: bool
+        :param timeout: the most seconds to wait, by default forever
+        :type timeout: int, float or None
+
+        :raises:
+            :class:`Empty<greenhouse.util.Empty>` if there is no event and
+            ``block`` is ``False``, or ``timeout`` expires
+
+        :returns:
+            a :class:`WatchEvent`, or ``None`` once the watcher is closed
+        """
+        event = self._events.get(block, timeout)
+        if event is None:
+            # leave it there for anyone else waiting
+            self._events.put_nowait(None)
+        return event
+
+    def fileno(self):
+        "the inotify file descriptor"
+        return self._fd
+
+    def close(self):
+        """stop watching everything and close the inotify descriptor
+
+        greenlets waiting on :meth:`get` get ``None`` once the events already
+        queued have been taken.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        scheduler._unregister_fd(self._fd, self._readable, None, self._reg)
+        os.close(self._fd)
+        self._paths.clear()
+        self._events.put_nowait(None)
+
+    @property
+    def closed(self):
+        "whether the watcher has been closed"
+        return self._closed
+
+    def _readable(self, fd):
+        # runs in the hub off of the poller, so it must not block. the poller
+        # calls again if there is still more than one read's worth
+        try:
+            data = _read(self._fd, _READ_SIZE)
+        except EnvironmentError, exc:
+            if exc.args[0] != errno.EAGAIN:
+                raise
+            return
+
+        paths = self._paths
+        for wd, mask, cookie, name in syscalls.unpack_inotify_events(data):
+            path = paths.get(wd)
+            if mask & syscalls.IN_IGNORED:
+                paths.pop(wd, None)
+            if name and path is not None:
+                path = os.path.join(path, name)
+            self._events.put_nowait(WatchEvent(wd, mask, cookie, name, path))
+
+
+class Follower(object):
+    """an iterator over the lines written to a file, returned by :func:`follow`
+
+    it is watching the file from when it is created, and it should be closed
+    when it is no longer wanted.
+    """
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self._dir, self._name = os.path.split(os.path.abspath(path))
+        self._watcher = Watcher()
+        self._fp = self._wd = None
+        self._offset = 0
+        self._partial = ""
+        self._lines = collections.deque()
+        self._rotated = False
+
+        try:
+            self._dir_wd = self._watcher.add(self._dir,
+                    syscalls.IN_CREATE | syscalls.IN_MOVED_TO)
+            self._open()
+            if self._fp is not None and not from_start:
+                self._offset = os.fstat(self._fp.fileno()).st_size
+        except:
+            self.close()
+            raise
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def next(self):
+        """the next line written to the file
+
+        .. note::
+
+            this method will block the current coroutine until there is one
+
+        :returns:
+            a line ending in a newline, or without one if it was the last of a
+            file that was rotated away
+
+        :raises: ``StopIteration`` once the follower is closed
+        """
+        while not self._lines:
+            if self._watcher.closed:
+                raise StopIteration()
+            self._advance()
+        return self._lines.popleft()
+
+    def close(self):
+        "stop following the file"
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        self._watcher.close()
+        self._lines.clear()
+
+    @property
+    def closed(self):
+        "whether the follower has been closed"
+        return self._watcher.closed
+
+    def _open(self):
+        try:
+            self._fp = files.File(self.path)
+        except EnvironmentError, exc:
+            if exc.args[0] != errno.ENOENT:
+                raise
+            return
+
+        try:
+            self._wd = self._watcher.add(self.path, syscalls.IN_MODIFY)
+        except EnvironmentError, exc:
+            self._fp.close()
+            self._fp = None
+            if exc.args[0] != errno.ENOENT:
+                raise
+            # already gone again, the directory's watch will say what
+            # replaced it
+
+    def _advance(self):
+        # read whatever has been written since the last look
+        if self._fp is not None:
+            data = self._fp.pread(_FOLLOW_CHUNK, self._offset)
+            if data:
+                self._offset += len(data)
+                lines = (self._partial + data).split("\n")
+                self._partial = lines.pop()
+                self._lines.extend(line + "\n" for line in lines)
+                return
+
+        if self._rotated:
+            # the old file has been read to its end, switch to the new one
+            self._rotated = False
+            if self._fp is not None:
+                if self._partial:
+                    self._lines.append(self._partial)
+                    self._partial = ""
+                self._fp.close()
+                self._fp = None
+                try:
+                    self._watcher.remove(self._wd)
+                except EnvironmentError:
+                    # the watch went with the old file
+                    pass
+            self._open()
+            self._offset = 0
+            return
+
+        # wait for something to happen, then take whatever else has queued up
+        # behind it so that a burst of writes costs a single read
+        events = [self._watcher.get()]
+        while 1:
+            try:
+                events.append(self._watcher.get(block=False))
+            except util.Empty:
+                break
+
+        for event in events:
+            if event is None:
+                return
+            if event.wd == self._dir_wd and event.name == self._name:
+                self._rotated = True
+
+        if (not self._rotated and self._fp is not None and
+                os.fstat(self._fp.fileno()).st_size < self._offset):
+            # truncated in place
+            self._offset = 0
+            self._partial = ""
+
+
+def follow(path, from_start=False):
+    """follow the lines written to a file, the way ``tail -F`` does
+
+    the file is read as it grows, waking on inotify events rather than
+    polling. when it is rotated (a new file created or renamed to ``path``)
+    what was left in the old one is read out and the new one is followed from
+    its start, and when it is truncated in place it is read again from the
+    start. a file that doesn't exist yet is waited for.
+
+    :param path: the file to follow
+    :type path: str
+    :param from_start:
+        whether to begin with the lines already in the file, rather than just
+        those written from now on
+    :type from_start: bool
+
+    :returns:
+        a :class:`Follower`, an iterator over the lines that blocks until the
+        next one is written
+    """
+    return Follower(path, from_start)
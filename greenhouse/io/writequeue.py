@@ -0,0 +1,302 @@
+from __future__ import absolute_import
+
+import collections
+import errno
+import socket
+import sys
+import time
+
+from .. import compat, scheduler
+from . import buffers
+
+
+__all__ = ["WriteQueue", "disconnect", "drop"]
+
+# queued pieces are joined into sends of up to this many bytes, so a burst
+# of small writes doesn't cost a system call each
+_COALESCE = 65536
+
+
+def disconnect(queue):
+    """stall policy that gives up on the connection
+
+    the socket is shut down, which fails the send in progress, and the
+    queue's pending and later writes raise ``socket.error``.
+    """
+    try:
+        queue.socket.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        sys.exc_clear()
+
+
+def drop(queue):
+    """stall policy that throws away whatever is still queued
+
+    the piece already being sent carries on, so the connection isn't left
+    part way through a write, but nothing after it is kept. blocked
+    producers carry on, and the discarded bytes are counted in
+    :attr:`WriteQueue.dropped`.
+    """
+    queue.discard()
+
+
+class WriteQueue(object):
+    """an outbound queue for a socket, sent by its own greenlet
+
+    :meth:`write` hands data to the queue and returns straight away, while a
+    writer greenlet sends it in the background. that keeps one slow reader
+    from holding up a greenlet writing to many sockets, and the watermarks
+    keep it from buffering without bound: once ``high_water`` bytes are
+    queued :meth:`write` blocks until the queue has drained to
+    ``low_water``.
+
+    a consumer that takes nothing at all for ``stall_timeout`` seconds has
+    the ``on_stall`` policy applied. that is :func:`disconnect` by default,
+    or it can be :func:`drop` or any function taking the queue.
+
+    :param sock: the socket to write to
+    :type sock: :class:`Socket<greenhouse.io.sockets.Socket>`
+    :param high_water:
+        the number of queued bytes at which :meth:`write` starts to block
+        (default 1MB)
+    :type high_water: int
+    :param low_water:
+        the number of queued bytes that blocked writers wait for the queue to
+        get down to (default a quarter of ``high_water``)
+    :type low_water: int or None
+    :param stall_timeout:
+        seconds without any progress after which the consumer counts as
+        stalled. the default of ``None`` waits on it indefinitely
+    :type stall_timeout: int, float or None
+    :param on_stall:
+        the policy function, called with the queue each time the consumer
+        has been stalled for ``stall_timeout`` (default :func:`disconnect`)
+    :type on_stall: function
+    """
+    def __init__(self, sock, high_water=1048576, low_water=None,
+            stall_timeout=None, on_stall=disconnect):
+        if low_water is None:
+            low_water = high_water // 4
+        if not 0 <= low_water <= high_water:
+            raise ValueError("low_water must be between 0 and high_water")
+
+        self.socket = sock
+        self.high_water = high_water
+        self.low_water = low_water
+        self.stall_timeout = stall_timeout
+        self.on_stall = on_stall
+
+        self._queue = collections.deque()
+
+        # bytes queued, including what's left of the piece being sent
+        self._size = 0
+
+        # bytes thrown away by discard()
+        self.dropped = 0
+
+        # the exception that stopped the writer, raised from write()
+        self.error = None
+
+        self._closed = False
+        self._writer = None
+        self._writer_idle = False
+        self._progress = 0
+        self._watchdog = None
+
+        # producers blocked above high_water, and flush() callers
+        self._blocked = []
+        self._flushers = []
+
+    @property
+    def size(self):
+        "the number of bytes waiting to be sent"
+        return self._size
+
+    def write(self, data):
+        """queue data to be sent
+
+        .. note::
+
+            this method blocks the current greenlet if the queue is above
+            ``high_water``, until it drains to ``low_water``
+
+        :param data: the data to send
+        :type data: str
+
+        :raises:
+            ``socket.error`` if the writer has failed, including being
+            disconnected for stalling, or the queue has been closed
+        """
+        self._check()
+        if not isinstance(data, str):
+            data = data.tobytes() if isinstance(data, memoryview) \
+                    else str(data)
+        if not data:
+            return
+
+        self._queue.append(data)
+        self._size += len(data)
+
+        if self._writer is None:
+            self._writer = scheduler.greenlet(self._write_loop)
+            scheduler.schedule(self._writer)
+        elif self._writer_idle:
+            self._writer_idle = False
+            scheduler.schedule(self._writer)
+
+        if self._size >= self.high_water:
+            self._wait_below(self.low_water, self._blocked)
+            self._check()
+
+    def flush(self, timeout=None):
+        """wait for everything queued so far to be sent
+
+        .. note:: this method can block the current greenlet
+
+        :param timeout:
+            the most seconds to wait, by default as long as it takes
+        :type timeout: int, float or None
+
+        :returns:
+            ``True`` if the queue emptied, ``False`` if the timeout ran out or
+            the writer failed first
+        """
+        if self._size and self.error is None:
+            self._wait_below(0, self._flushers, timeout)
+        return not self._size and self.error is None
+
+    def discard(self):
+        """throw away everything queued and not yet being sent
+
+        :returns: the number of bytes discarded
+        """
+        count = sum(len(data) for data in self._queue)
+        self._queue.clear()
+        self._size -= count
+        self.dropped += count
+
+        # what is left is already being sent, so blocked producers may as
+        # well carry on even if that is still above low_water
+        self._wake(self._blocked)
+        if self._flushers:
+            self._wake(self._flushers, self._size)
+        return count
+
+    def close(self):
+        """discard the queue and stop the writer greenlet
+
+        a piece already being sent is finished, but the socket itself is left
+        open. :meth:`flush` first to make sure everything queued has gone.
+        """
+        self._closed = True
+        self.discard()
+        if self._writer_idle:
+            self._writer_idle = False
+            scheduler.schedule(self._writer)
+
+    def _check(self):
+        if self.error is not None:
+            raise socket.error(*self.error.args)
+        if self._closed:
+            raise socket.error(errno.EPIPE, "the write queue is closed")
+
+    def _wait_below(self, size, waiters, timeout=None):
+        current = compat.getcurrent()
+        waketime = None if timeout is None else time.time() + timeout
+        if waketime is not None:
+            scheduler.schedule_at(waketime, current)
+        waiters.append((current, size))
+
+        scheduler.state.mainloop.switch()
+
+        if waketime is not None and \
+                not scheduler._remove_timer(waketime, current):
+            if (current, size) in waiters:
+                waiters.remove((current, size))
+
+    def _wake(self, waiters, size=None):
+        # wake every waiter for a size the queue has got down to, or all of
+        # them if size is None
+        for waiter in list(waiters):
+            if size is None or size <= waiter[1]:
+                waiters.remove(waiter)
+                scheduler.schedule(waiter[0])
+
+    def _drained(self):
+        if self._blocked:
+            self._wake(self._blocked, self._size)
+        if self._flushers:
+            self._wake(self._flushers, self._size)
+
+    def _write_loop(self):
+        finished = False
+        try:
+            while not self._closed:
+                if not self._queue:
+                    self._writer_idle = True
+                    scheduler.state.mainloop.switch()
+                    continue
+
+                data = self._queue.popleft()
+                if self._queue and len(data) < _COALESCE:
+                    pieces = [data]
+                    size = len(data)
+                    while self._queue and \
+                            size + len(self._queue[0]) <= _COALESCE:
+                        pieces.append(self._queue.popleft())
+                        size += len(pieces[-1])
+                    data = "".join(pieces)
+
+                self._send(data)
+            finished = True
+        except socket.error, exc:
+            self.error = exc
+        except:
+            # anything else (an interrupted send, the writer being killed)
+            # fails the queue all the same, but is left to propagate
+            self.error = socket.error(errno.EPIPE,
+                    "the writer stopped: %r" % (sys.exc_info()[1],))
+            raise
+        finally:
+            self._writer = None
+            self._writer_idle = False
+            if not finished:
+                self._queue.clear()
+                self._size = 0
+                self._wake(self._blocked)
+                self._wake(self._flushers)
+
+    def _send(self, data):
+        self._progress = time.time()
+        if self.stall_timeout is not None and self._watchdog is None:
+            self._watchdog = scheduler.greenlet(self._watch)
+            scheduler.schedule(self._watchdog)
+
+        sent = 0
+        try:
+            while sent < len(data):
+                went = self.socket.send(
+                        buffers.view_from(data, sent) if sent else data)
+                sent += went
+                self._size -= went
+                self._progress = time.time()
+                self._drained()
+        except:
+            # whatever is left of it doesn't count as queued any more
+            self._size -= len(data) - sent
+            raise
+
+    def _watch(self):
+        try:
+            while self._writer is not None and self.error is None and \
+                    not self._writer_idle and not self._closed:
+                deadline = self._progress + self.stall_timeout
+                if time.time() < deadline:
+                    scheduler.pause_until(deadline)
+                    continue
+                self.on_stall(self)
+
+                # a policy that let things carry on gets a fresh deadline
+                self._progress = time.time()
+        finally:
+            self._watchdog = None
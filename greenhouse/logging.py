@@ -0,0 +1,186 @@
+"""logging without blocking on the writes
+
+the standard library's handlers write each record out as it is logged, which
+under greenhouse means a system call (or a trip through the thread pool) for
+every line. :class:`AsyncHandler` just queues the formatted records, and a
+background greenlet writes them out a batch at a time.
+"""
+from __future__ import absolute_import
+
+import logging
+import sys
+import time
+
+from . import io, scheduler, util
+
+
+__all__ = ["AsyncHandler"]
+
+
+class AsyncHandler(logging.Handler):
+    """a logging handler that writes records out in batches from a greenlet
+
+    logging a record only formats it and adds it to a queue. a writer
+    greenlet then writes everything queued in a single write once any of
+    these is true:
+
+    - ``flush_size`` bytes are waiting
+    - the oldest waiting record was logged ``flush_interval`` seconds ago
+    - a record of ``flush_level`` or above was logged
+
+    when a slow target lets ``max_size`` bytes pile up, further records are
+    dropped rather than blocking anything or growing without bound. they are
+    counted in :attr:`dropped`, and a line saying how many were lost goes out
+    with the next batch.
+
+    :param target:
+        where to write, a file-like object with a ``write`` method or the name
+        of a file to append to. the default is greenhouse's cooperative
+        :data:`stderr<greenhouse.io.files.stderr>`
+    :type target: file-like object, str or None
+    :param flush_size: the number of queued bytes that triggers a write
+    :type flush_size: int
+    :param flush_interval: the most seconds a record waits to be written
+    :type flush_interval: int or float
+    :param flush_level: the level at and above which records go out at once
+    :type flush_level: int
+    :param max_size: the most bytes to queue before dropping records
+    :type max_size: int
+    :param level: the handler's level, as for any ``logging.Handler``
+    :type level: int
+    """
+    def __init__(self, target=None, flush_size=65536, flush_interval=1.0,
+            flush_level=logging.ERROR, max_size=1048576,
+            level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        if target is None:
+            target = io.files.stderr
+        if isinstance(target, basestring):
+            target = io.File(target, 'a')
+            self._owns_target = True
+        else:
+            self._owns_target = False
+        self.target = target
+
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.max_size = max_size
+
+        # records dropped for a full queue, in all and since the last note
+        self.dropped = 0
+        self._lost = 0
+
+        self._queue = []
+        self._size = 0
+        self._first = None
+        self._urgent = False
+        self._closed = False
+
+        self._writer = None
+        self._wakeup = util.Event()
+        self._drained = util.Event()
+        self._drained.set()
+
+    def emit(self, record):
+        "queue a record to be written"
+        try:
+            line = self.format(record) + "\n"
+        except Exception:
+            self.handleError(record)
+            return
+        if isinstance(line, unicode):
+            line = line.encode("utf8")
+
+        if self._closed or self._size + len(line) > self.max_size:
+            self.dropped += 1
+            self._lost += 1
+            return
+
+        queue = self._queue
+        queue.append(line)
+        self._size += len(line)
+        self._drained.clear()
+
+        if record.levelno >= self.flush_level:
+            self._urgent = True
+        if len(queue) == 1:
+            # the writer starts timing flush_interval from the first record
+            self._first = time.time()
+        elif not self._urgent and self._size < self.flush_size:
+            return
+
+        if self._writer is None:
+            self._writer = scheduler.greenlet(self._write_loop)
+            scheduler.schedule(self._writer)
+        self._wakeup.set()
+
+    def flush(self):
+        """write out everything queued so far
+
+        .. note:: this method will block the current coroutine
+        """
+        if self._writer is None or self._drained.is_set():
+            return
+        self._urgent = True
+        self._wakeup.set()
+        self._drained.wait()
+
+    def close(self):
+        """flush the queue and stop the writer greenlet
+
+        the target is closed too if the handler opened it from a file name.
+
+        .. note:: this method will block the current coroutine
+        """
+        self.flush()
+        self._closed = True
+        self._wakeup.set()
+        if self._owns_target:
+            self.target.close()
+        logging.Handler.close(self)
+
+    @property
+    def size(self):
+        "the number of bytes queued to be written"
+        return self._size
+
+    def _due(self):
+        return (self._urgent or self._closed or
+                self._size >= self.flush_size or
+                time.time() >= self._first + self.flush_interval)
+
+    def _write_loop(self):
+        try:
+            while 1:
+                self._wakeup.clear()
+                if self._queue and self._due():
+                    self._write_batch()
+                elif self._closed:
+                    break
+                elif self._queue:
+                    self._wakeup.wait(
+                            self._first + self.flush_interval - time.time())
+                else:
+                    self._wakeup.wait()
+        finally:
+            self._writer = None
+
+    def _write_batch(self):
+        batch, self._queue = self._queue, []
+        self._size = 0
+        self._urgent = False
+        if self._lost:
+            batch.append("%d log records dropped\n" % self._lost)
+            self._lost = 0
+
+        try:
+            self.target.write("".join(batch))
+            flush = getattr(self.target, "flush", None)
+            if flush is not None:
+                flush()
+        except Exception:
+            scheduler.handle_exception(*sys.exc_info())
+
+        if not self._queue:
+            self._drained.set()
@@ -1,12 +1,15 @@
+from __future__ import absolute_import
+
 import bisect
 import collections
 import errno
 import logging
+import os
 import sys
 import time
 import weakref
 
-from greenhouse import compat, poller
+from greenhouse import compat, poller, syscalls
 
 
 __all__ = ["pause", "pause_until", "pause_for", "schedule", "schedule_at",
@@ -17,10 +20,15 @@ __all__ = ["pause", "pause_until", "pause_for", "schedule", "schedule_at",
         "handle_exception", "greenlet", "global_hook", "remove_global_hook",
         "local_incoming_hook", "remove_local_incoming_hook",
         "local_outgoing_hook", "remove_local_outgoing_hook",
-        "set_ignore_interrupts", "reset_poller"]
+        "set_ignore_interrupts", "set_timer_slack", "poll_wakeup_rate",
+        "set_high_resolution_timers", "set_direct_handoff", "reset_poller"]
 
 BTREE_ORDER = 64
 
+# how many greenlets may be handed off in a row before one
+# has to wait for a poll, so that I/O isn't starved
+HANDOFF_LIMIT = 64
+
 
 log = logging.getLogger("greenhouse.scheduler")
 
@@ -38,22 +46,91 @@ state.descriptormap = {}
 # lined up to run right away
 state.to_run = collections.deque()
 
-# exceptions queued up for scheduled coros
-state.to_raise = weakref.WeakKeyDictionary()
-
-# exception handlers, global and local
+# global exception handlers (local ones live in the greenlet's _Control)
 state.global_exception_handlers = []
-state.local_exception_handlers = weakref.WeakKeyDictionary()
 
-# trace hook callbacks
+# global trace hook callbacks (local ones live in the greenlet's _Control)
 state.global_hooks = []
-state.local_to_hooks = weakref.WeakKeyDictionary()
-state.local_from_hooks = weakref.WeakKeyDictionary()
 
 # tracks interrupts
 state.interrupted = False
 state.ignore_interrupts = False
 
+# how late (in seconds) a timer may fire by default, so
+# that timers falling due close together share a wakeup
+state.timer_slack = 0.0
+
+# run greenlets woken by locks, queues and semaphores ahead of to_run. they
+# wait in a queue of their own, so several woken in a row keep their order
+state.direct_handoff = False
+state.handoff_streak = 0
+state.handoffs = collections.deque()
+
+
+class _Control(object):
+    """per-greenlet scheduler bookkeeping
+
+    this is only attached (in the greenlet's ``__dict__``) to greenlets that
+    have something unusual going on: a pending exception, local hooks or
+    exception handlers, or a timer. a plain greenlet has none, so the
+    mainloop can switch to it after a single dict lookup.
+    """
+    __slots__ = ["to_raise", "to_hooks", "from_hooks", "exception_handlers",
+            "timer"]
+
+    def __init__(self):
+        self.to_raise = None
+        self.to_hooks = None
+        self.from_hooks = None
+        self.exception_handlers = None
+        self.timer = None
+
+    def pop_exception(self):
+        exc, self.to_raise = self.to_raise, None
+        return exc
+
+_CONTROL = "_greenhouse_control"
+
+
+def _control(glet):
+    "get a greenlet's control block, creating it if necessary"
+    ctl = glet.__dict__.get(_CONTROL)
+    if ctl is None:
+        ctl = glet.__dict__[_CONTROL] = _Control()
+    return ctl
+
+
+class WakeupCounter(object):
+    "counts returns from blocking polls, tracking a per-second rate"
+    def __init__(self):
+        self.total = 0
+        self._count = 0
+        self._started = time.time()
+        self._rate = 0.0
+
+    def tick(self):
+        self.total += 1
+        self._count += 1
+        self._roll(time.time())
+
+    def _roll(self, now):
+        elapsed = now - self._started
+        if elapsed >= 1:
+            self._rate = self._count / elapsed
+            self._count = 0
+            self._started = now
+
+    @property
+    def rate(self):
+        self._roll(time.time())
+        return self._rate
+
+state.poll_wakeups = WakeupCounter()
+
+# kernel timer armed for the next deadline, when
+# high-resolution timers have been turned on
+state.timerfd = None
+
 
 class TimeoutManager(object):
     def __nonzero__(self):
@@ -64,31 +141,63 @@ class TimeoutManager(object):
             return iter(self.data).next()
         return None
 
+    def wakeup(self):
+        """the latest time by which the poller has to return
+
+        that is the earliest deadline plus its slack, pulled in by any other
+        timer falling due inside that window with less slack of its own.
+        """
+        if not (self.slacks or state.timer_slack):
+            return self.first()[0]
+
+        limit = None
+        for pair in self.data:
+            if limit is not None and pair[0] >= limit:
+                break
+            latest = pair[0] + self.slacks.get(pair, state.timer_slack)
+            if limit is None or latest < limit:
+                limit = latest
+        return limit
+
+    def _forget_slacks(self, fired):
+        for pair in fired:
+            self.slacks.pop(pair, None)
+
     @classmethod
     def install(cls):
-        state.timed_paused = cls(state.timed_paused.dump())
+        old = state.timed_paused
+        state.timed_paused = cls(old.dump())
+        state.timed_paused.slacks = old.slacks
 
 
 class BisectingTimeoutManager(TimeoutManager):
     def __init__(self, data=None):
         self.data = data or []
+        self.slacks = {}
 
     def clear(self):
         del self.data[:]
+        self.slacks.clear()
 
-    def insert(self, unixtime, glet):
+    def insert(self, unixtime, glet, slack=None):
         bisect.insort(self.data, (unixtime, glet))
+        if slack is not None:
+            self.slacks[(unixtime, glet)] = slack
 
     def check(self):
         index = bisect.bisect(self.data, (time.time(), None))
-        state.to_run.extend(pair[1] for pair in self.data[:index])
+        fired = self.data[:index]
+        state.to_run.extend(pair[1] for pair in fired)
         self.data = self.data[index:]
+        if self.slacks:
+            self._forget_slacks(fired)
 
     def remove(self, unixtime, glet):
         index = bisect.bisect(self.data, (unixtime, None))
         while index < len(self.data) and self.data[index][0] == unixtime:
             if self.data[index][1] is glet:
                 del self.data[index:index + 1]
+                self.slacks.pop((unixtime, glet), None)
                 return True
             index += 1
         return False
@@ -100,23 +209,30 @@ class BisectingTimeoutManager(TimeoutManager):
 class BTreeTimeoutManager(TimeoutManager):
     def __init__(self, data=None, order=BTREE_ORDER):
         self.data = btree.sorted_btree.bulkload(data or [], order)
+        self.slacks = {}
 
     def clear(self):
         self.data = btree.sorted_btree(self.data.order)
+        self.slacks.clear()
 
-    def insert(self, unixtime, glet):
+    def insert(self, unixtime, glet, slack=None):
         self.data.insert((unixtime, glet))
+        if slack is not None:
+            self.slacks[(unixtime, glet)] = slack
 
     def check(self):
         left, right = self.data.split((time.time(), None))
         state.to_run.extend(pair[1] for pair in left)
         self.data = right
+        if self.slacks:
+            self._forget_slacks(left)
 
     def remove(self, unixtime, glet):
         try:
             self.data.remove((unixtime, glet))
         except ValueError:
             return False
+        self.slacks.pop((unixtime, glet), None)
         return True
 
     def dump(self):
@@ -131,11 +247,18 @@ except ImportError:
 
 
 def _hit_poller(timeout):
+    state.handoff_streak = 0
+    if timeout is not None and timeout < 0:
+        # a deadline that slipped by before we got here. epoll and poll take
+        # any negative timeout to mean forever, and select rejects it
+        timeout = 0
     try:
         events = state.poller.poll(timeout)
+        if timeout != 0:
+            state.poll_wakeups.tick()
     except KeyboardInterrupt, exc:
         # on Ctrl-C, wake up the main without killing the mainloop
-        state.to_raise[compat.main_greenlet] = exc
+        _control(compat.main_greenlet).to_raise = exc
         state.to_run.append(compat.main_greenlet)
         return
     except EnvironmentError, exc:
@@ -150,16 +273,38 @@ def _hit_poller(timeout):
             events = [(fd, state.poller.ERRMASK)
                     for fd in state.poller._registry.iterkeys()]
 
+    errmask = state.poller.ERRMASK
+    inmask = state.poller.INMASK | errmask
+    outmask = state.poller.OUTMASK | errmask
+    descriptormap = state.descriptormap
+    to_run = state.to_run
+
     for fd, eventmap in events:
-        readables, writables = state.descriptormap.get(fd, ([], []))
+        waiters = descriptormap.get(fd)
+        if waiters is None:
+            continue
 
-        if eventmap & (state.poller.INMASK | state.poller.ERRMASK):
-            for readable in readables:
-                readable()
+        if eventmap & inmask:
+            if waiters.readers:
+                to_run.extend(waiters.readers)
+                del waiters.readers[:]
+            if waiters.exclusive_readers:
+                # one exclusive reader per readiness, unless it's an error
+                # condition that every one of them needs to see
+                if eventmap & errmask:
+                    to_run.extend(waiters.exclusive_readers)
+                    waiters.exclusive_readers.clear()
+                else:
+                    to_run.append(waiters.exclusive_readers.popleft())
+            for readable in waiters.readables:
+                readable(fd)
 
-        if eventmap & (state.poller.OUTMASK | state.poller.ERRMASK):
-            for writable in writables:
-                writable()
+        if eventmap & outmask:
+            if waiters.writers:
+                to_run.extend(waiters.writers)
+                del waiters.writers[:]
+            for writable in waiters.writables:
+                writable(fd)
 
     state.to_run.extend(state.awoken_from_events)
     state.awoken_from_events.clear()
@@ -170,6 +315,119 @@ def _hit_poller(timeout):
     state.paused = []
 
 
+class TimerFD(object):
+    "a single timerfd, kept armed for the scheduler's earliest deadline"
+    def __init__(self):
+        self._fd = syscalls.timerfd_create()
+        self._armed = None
+        self._reg = _register_fd(self._fd, self._fired, None)
+
+    def fileno(self):
+        return self._fd
+
+    def arm(self, unixtime):
+        if unixtime != self._armed:
+            syscalls.timerfd_settime(self._fd, unixtime)
+            self._armed = unixtime
+
+    def _fired(self, fd):
+        self._armed = None
+        try:
+            os.read(self._fd, 8)
+        except EnvironmentError, exc:
+            if exc.args[0] != errno.EAGAIN:
+                raise
+
+    def close(self):
+        _unregister_fd(self._fd, self._fired, None, self._reg)
+        os.close(self._fd)
+
+
+class FDWaiters(object):
+    "the greenlets and callbacks waiting on a single file descriptor"
+    __slots__ = ["readers", "exclusive_readers", "writers", "readables",
+            "writables"]
+
+    def __init__(self):
+        # greenlets blocked until the descriptor is readable or writable
+        self.readers = []
+        self.writers = []
+
+        # readers that consume what they wake up for (accept, recv), so that
+        # a readiness event only wakes the longest-waiting one of them
+        self.exclusive_readers = collections.deque()
+
+        # callbacks taking the descriptor, for waiting on many at once
+        self.readables = set()
+        self.writables = set()
+
+    def __nonzero__(self):
+        return bool(self.readers or self.exclusive_readers or self.writers or
+                self.readables or self.writables)
+
+
+def _fd_waiters(fd):
+    waiters = state.descriptormap.get(fd)
+    if waiters is None:
+        waiters = state.descriptormap[fd] = FDWaiters()
+    return waiters
+
+
+def _drop_fd_waiters(fd, waiters):
+    if not waiters and state.descriptormap.get(fd) is waiters:
+        del state.descriptormap[fd]
+
+
+def _wait_fd(fd, writing=False, timeout=None, exclusive=False):
+    """block the current greenlet until a descriptor is readable or writable
+
+    the greenlet is parked directly on the descriptor, and _hit_poller moves
+    it straight into to_run when the poller reports the descriptor ready.
+
+    an ``exclusive`` reader is queued FIFO with the other exclusive readers of
+    the descriptor, and only the first of them is woken for each readiness
+    event (errors still wake everyone). use it when the woken greenlet will
+    consume the readiness, as ``accept()`` and ``recv()`` do, so that a crowd
+    of waiters isn't stampeded awake just for all but one to retry.
+
+    :returns: ``True`` if the timeout expired first, otherwise ``False``
+    """
+    poller = state.poller
+    current = compat.getcurrent()
+
+    reg = poller.register(fd, poller.ERRMASK |
+            (poller.OUTMASK if writing else poller.INMASK))
+    waiters = _fd_waiters(fd)
+    if writing:
+        queue = waiters.writers
+    elif exclusive:
+        queue = waiters.exclusive_readers
+    else:
+        queue = waiters.readers
+    queue.append(current)
+
+    if timeout is not None:
+        waketime = time.time() + timeout
+        state.timed_paused.insert(waketime, current)
+        _control(current).timer = waketime
+
+    timed_out = False
+    try:
+        state.mainloop.switch()
+    finally:
+        if timeout is not None:
+            _control(current).timer = None
+            timed_out = not _remove_timer(waketime, current)
+
+        # still queued if the timer or an exception woke us instead
+        if current in queue:
+            queue.remove(current)
+        _drop_fd_waiters(fd, waiters)
+        poller.unregister(fd, reg)
+
+    return timed_out
+
+
 def _register_fd(fd, readable, writable):
     poller = state.poller
     mask = poller.ERRMASK
@@ -179,27 +437,22 @@ def _register_fd(fd, readable, writable):
         mask |= poller.OUTMASK
     reg = state.poller.register(fd, mask)
 
-    if fd not in state.descriptormap:
-        state.descriptormap[fd] = (set(), set())
-    readables, writables = state.descriptormap[fd]
-
+    waiters = _fd_waiters(fd)
     if readable:
-        readables.add(readable)
+        waiters.readables.add(readable)
     if writable:
-        writables.add(writable)
+        waiters.writables.add(writable)
 
     return reg
 
 def _unregister_fd(fd, readable, writable, reg):
-    if fd not in state.descriptormap:
+    waiters = state.descriptormap.get(fd)
+    if waiters is None:
         return
-    readables, writables = state.descriptormap[fd]
-
-    readables.discard(readable)
-    writables.discard(writable)
 
-    if not (readables or writables):
-        state.descriptormap.pop(fd)
+    waiters.readables.discard(readable)
+    waiters.writables.discard(writable)
+    _drop_fd_waiters(fd, waiters)
 
     state.poller.unregister(fd, reg)
 
@@ -236,27 +489,44 @@ def pause():
     state.mainloop.switch()
 
 
-def pause_until(unixtime):
+def pause_until(unixtime, slack=None):
     """pause and reschedule the current greenlet until a set time
 
     .. note:: this method will block the current greenlet
 
     :param unixtime: the unix timestamp of when to bring this greenlet back
     :type unixtime: int or float
+    :param slack:
+        how many seconds late the greenlet may be brought back, so that its
+        wakeup can be shared with other timers (defaults to the global value
+        set with :func:`set_timer_slack`)
+    :type slack: int, float or None
+
+    :raises: ``ValueError`` if ``slack`` is negative
     """
-    schedule_at(unixtime, compat.getcurrent())
-    state.mainloop.switch()
+    current = compat.getcurrent()
+    ctl = _control(current)
+    schedule_at(unixtime, current, slack=slack)
+    ctl.timer = unixtime
+    try:
+        state.mainloop.switch()
+    finally:
+        ctl.timer = None
 
 
-def pause_for(secs):
+def pause_for(secs, slack=None):
     """pause and reschedule the current greenlet for a set number of seconds
 
     .. note:: this method will block the current greenlet
 
     :param secs: number of seconds to pause
     :type secs: int or float
+    :param slack:
+        how many seconds late the greenlet may be brought back (defaults to
+        the global value set with :func:`set_timer_slack`)
+    :type slack: int, float or None
     """
-    pause_until(time.time() + secs)
+    pause_until(time.time() + secs, slack)
 
 
 def schedule(target=None, args=(), kwargs=None):
@@ -299,7 +569,7 @@ def schedule(target=None, args=(), kwargs=None):
     return target
 
 
-def schedule_at(unixtime, target=None, args=(), kwargs=None):
+def schedule_at(unixtime, target=None, args=(), kwargs=None, slack=None):
     """insert a greenlet into the scheduler to be run at a set time
 
     If provided a function, it is wrapped in a new greenlet
@@ -316,9 +586,16 @@ def schedule_at(unixtime, target=None, args=(), kwargs=None):
         keyword arguments for the function (only used if ``target`` is a
         function)
     :type kwargs: dict or None
+    :param slack:
+        how many seconds late the greenlet may be started, so that it can
+        share a wakeup with other timers (defaults to the global value set
+        with :func:`set_timer_slack`)
+    :type slack: int, float or None
 
     :returns: the ``target`` argument
 
+    :raises: ``ValueError`` if ``slack`` is negative
+
     This function can also be used as a decorator:
 
     >>> @schedule_at(1296423834)
@@ -331,19 +608,24 @@ def schedule_at(unixtime, target=None, args=(), kwargs=None):
     >>> def f(name):
     ...     print 'hello %s' % name
     """
+    if slack is not None and slack < 0:
+        # it would put the wakeup before the deadline, and the poller would
+        # keep returning with nothing due
+        raise ValueError("timer slack can't be negative")
     if target is None:
         def decorator(target):
-            return schedule_at(unixtime, target, args=args, kwargs=kwargs)
+            return schedule_at(unixtime, target, args=args, kwargs=kwargs,
+                    slack=slack)
         return decorator
     if isinstance(target, compat.greenlet) or target is compat.main_greenlet:
         glet = target
     else:
         glet = greenlet(target, args, kwargs)
-    state.timed_paused.insert(unixtime, glet)
+    state.timed_paused.insert(unixtime, glet, slack)
     return target
 
 
-def schedule_in(secs, target=None, args=(), kwargs=None):
+def schedule_in(secs, target=None, args=(), kwargs=None, slack=None):
     """insert a greenlet into the scheduler to run after a set time
 
     If provided a function, it is wrapped in a new greenlet
@@ -359,6 +641,10 @@ def schedule_in(secs, target=None, args=(), kwargs=None):
         keyword arguments for the function (only used if ``target`` is a
         function)
     :type kwargs: dict or None
+    :param slack:
+        how many seconds late the target may be run (defaults to the global
+        value set with :func:`set_timer_slack`)
+    :type slack: int, float or None
 
     :returns: the ``target`` argument
 
@@ -374,7 +660,7 @@ def schedule_in(secs, target=None, args=(), kwargs=None):
     >>> def f(name):
     ...     print 'hello %s' % name
     """
-    return schedule_at(time.time() + secs, target, args, kwargs)
+    return schedule_at(time.time() + secs, target, args, kwargs, slack)
 
 
 def schedule_recurring(interval, target=None, maxtimes=0, starting_at=0,
@@ -453,8 +739,9 @@ def schedule_exception(exception, target):
         raise TypeError("can only schedule exceptions for greenlets")
     if target.dead:
         raise ValueError("can't send exceptions to a dead greenlet")
+    _cancel_timer(target)
     schedule(target)
-    state.to_raise[target] = exception
+    _control(target).to_raise = exception
 
 
 def schedule_exception_at(unixtime, exception, target):
@@ -471,8 +758,9 @@ def schedule_exception_at(unixtime, exception, target):
         raise TypeError("can only schedule exceptions for greenlets")
     if target.dead:
         raise ValueError("can't send exceptions to a dead greenlet")
+    _cancel_timer(target)
     schedule_at(unixtime, target)
-    state.to_raise[target] = exception
+    _control(target).to_raise = exception
 
 
 def schedule_exception_in(secs, exception, target):
@@ -497,19 +785,44 @@ def end(target):
     if not isinstance(target, compat.greenlet):
         raise TypeError("argument must be a greenlet")
     if not target.dead:
+        _cancel_timer(target)
         schedule(target)
-        state.to_raise[target] = compat.GreenletExit()
+        _control(target).to_raise = compat.GreenletExit()
+
+
+def _cancel_timer(glet):
+    # a greenlet getting an exception thrown in shouldn't also be woken later
+    # by the timer it was paused on
+    ctl = glet.__dict__.get(_CONTROL)
+    if ctl is not None and ctl.timer is not None:
+        state.timed_paused.remove(ctl.timer, glet)
+        ctl.timer = None
+
+
+def _hand_off(glet):
+    # with direct handoff on, queue a greenlet that a lock/queue/etc has just
+    # woken to run ahead of to_run. it then runs as soon as the waker blocks,
+    # rather than after the next trip through the poller.
+    #
+    # returns False if the caller should wake it the usual way instead.
+    if not state.direct_handoff or state.handoff_streak >= HANDOFF_LIMIT:
+        return False
+    state.handoff_streak += 1
+    state.handoffs.append(glet)
+    return True
 
 
 def _remove_timer(waketime, glet):
     if state.timed_paused.remove(waketime, glet):
         return True
 
-    try:
-        state.to_run.remove(glet)
-    except ValueError:
-        return False
-    return True
+    for queue in (state.to_run, state.handoffs):
+        try:
+            queue.remove(glet)
+        except ValueError:
+            continue
+        return True
+    return False
 
 
 @compat.greenlet
@@ -522,35 +835,47 @@ def mainloop():
 
         state.interrupted = False
 
-        if not state.to_run:
+        if not (state.to_run or state.handoffs):
             _hit_poller(0)
             while not state.to_run:
                 # if there are timed-paused greenlets, we can
                 # just wait until the first of them wakes up
-                if state.timed_paused:
-                    until = state.timed_paused.first()[0] + 0.001
+                if state.timerfd is not None:
+                    # the kernel timer wakes the poller, no timeout needed
+                    if state.timed_paused:
+                        state.timerfd.arm(state.timed_paused.wakeup())
+                    _hit_poller(None)
+                elif state.timed_paused:
+                    until = state.timed_paused.wakeup() + 0.001
                     _hit_poller(until - time.time())
                 else:
                     _hit_poller(None)
 
         prev = target
-        target = state.to_run.popleft()
+        if state.handoffs:
+            target = state.handoffs.popleft()
+        else:
+            target = state.to_run.popleft()
 
         # global trace hooks
         if state.global_hooks:
             _run_global_hooks(prev, target)
 
-        # local trace incoming hooks
-        if target in state.local_to_hooks:
-            _run_local_hooks(
-                    target, state.local_to_hooks[target], True)
+        ctl = target.__dict__.get(_CONTROL)
 
         try:
-            # pick up any exception we are supposed to throw in
-            if target in state.to_raise:
-                target.throw(state.to_raise.pop(target))
-            else:
+            if ctl is None:
                 target.switch()
+            else:
+                # local trace incoming hooks
+                if ctl.to_hooks:
+                    _run_local_hooks(target, ctl.to_hooks, True)
+
+                # pick up any exception we are supposed to throw in
+                if ctl.to_raise is not None:
+                    target.throw(ctl.pop_exception())
+                else:
+                    target.switch()
         except Exception:
             # python shutdown
             if not (sys and state):
@@ -559,10 +884,10 @@ def mainloop():
             handle_exception(klass, exc, tb, coro=target)
             del klass, exc, tb
 
-        # local trace outgoing hooks
-        if target in state.local_from_hooks:
-            _run_local_hooks(
-                    target, state.local_from_hooks[target], False)
+        # local trace outgoing hooks (possibly added during this run)
+        ctl = target.__dict__.get(_CONTROL)
+        if ctl is not None and ctl.from_hooks:
+            _run_local_hooks(target, ctl.from_hooks, False)
 
 state.mainloop = mainloop
 
@@ -626,8 +951,11 @@ def handle_exception(klass, exc, tb, coro=None):
     if coro is None:
         coro = compat.getcurrent()
 
+    ctl = coro.__dict__.get(_CONTROL)
+    handlers = ctl.exception_handlers if ctl is not None else None
+
     replacement = []
-    for weak in state.local_exception_handlers.get(coro, ()):
+    for weak in handlers or ():
         func = weak()
         if func is None:
             continue
@@ -640,7 +968,7 @@ def handle_exception(klass, exc, tb, coro=None):
         replacement.append(weak)
 
     if replacement:
-        state.local_exception_handlers[coro][:] = replacement
+        handlers[:] = replacement
 
     replacement = []
     for weak in state.global_exception_handlers:
@@ -726,8 +1054,10 @@ def local_exception_handler(handler=None, coro=None):
 
     log.info("setting a new coroutine local exception handler")
 
-    state.local_exception_handlers.setdefault(coro, []).append(
-            weakref.ref(handler))
+    ctl = _control(coro)
+    if ctl.exception_handlers is None:
+        ctl.exception_handlers = []
+    ctl.exception_handlers.append(weakref.ref(handler))
 
     return handler
 
@@ -745,10 +1075,12 @@ def remove_local_exception_handler(handler, coro=None):
     if coro is None:
         coro = compat.getcurrent()
 
-    for i, cb in enumerate(state.local_exception_handlers.get(coro, [])):
+    ctl = coro.__dict__.get(_CONTROL)
+    callbacks = (ctl.exception_handlers if ctl is not None else None) or []
+    for i, cb in enumerate(callbacks):
         cb = cb()
         if cb is not None and cb is handler:
-            state.local_exception_handlers[coro].pop(i)
+            callbacks.pop(i)
             log.info("removing a coroutine local exception handler")
             return True
     return False
@@ -823,8 +1155,10 @@ def local_incoming_hook(handler=None, coro=None):
 
     log.info("setting a coroutine incoming local hook callback")
 
-    state.local_to_hooks.setdefault(coro, []).append(
-            weakref.ref(handler))
+    ctl = _control(coro)
+    if ctl.to_hooks is None:
+        ctl.to_hooks = []
+    ctl.to_hooks.append(weakref.ref(handler))
 
     return handler
 
@@ -842,11 +1176,13 @@ def remove_local_incoming_hook(handler, coro=None):
     if coro is None:
         coro = compat.getcurrent()
 
-    for i, cb in enumerate(state.local_to_hooks.get(coro, [])):
+    ctl = coro.__dict__.get(_CONTROL)
+    callbacks = (ctl.to_hooks if ctl is not None else None) or []
+    for i, cb in enumerate(callbacks):
         cb = cb()
         if cb is not None and cb is handler:
             log.info("removing a coroutine incoming local hook callback")
-            state.local_to_hooks[coro].pop(i)
+            callbacks.pop(i)
             return True
     return False
 
@@ -879,8 +1215,10 @@ def local_outgoing_hook(handler=None, coro=None):
 
     log.info("setting a coroutine local outgoing hook callback")
 
-    state.local_from_hooks.setdefault(coro, []).append(
-            weakref.ref(handler))
+    ctl = _control(coro)
+    if ctl.from_hooks is None:
+        ctl.from_hooks = []
+    ctl.from_hooks.append(weakref.ref(handler))
 
     return handler
 
@@ -898,11 +1236,13 @@ def remove_local_outgoing_hook(handler, coro=None):
     if coro is None:
         coro = compat.getcurrent()
 
-    for i, cb in enumerate(state.local_from_hooks.get(coro, [])):
+    ctl = coro.__dict__.get(_CONTROL)
+    callbacks = (ctl.from_hooks if ctl is not None else None) or []
+    for i, cb in enumerate(callbacks):
         cb = cb()
         if cb is not None and cb is handler:
             log.info("removing a coroutine outgoing local hook callback")
-            state.local_from_hooks[coro].pop(i)
+            callbacks.pop(i)
             return True
     return False
 
@@ -923,6 +1263,85 @@ def set_ignore_interrupts(flag=True):
     state.ignore_interrupts = bool(flag)
 
 
+def set_timer_slack(secs):
+    """set the default tolerance for how late timers may fire
+
+    with a non-zero slack, timers whose deadlines fall close together are all
+    fired from a single return from the poller, rather than each waking the
+    process separately. this cuts down on wakeups (and so idle CPU) in servers
+    holding many slightly staggered timeouts.
+
+    individual timers can override this with the ``slack`` argument to
+    :func:`schedule_at`, :func:`schedule_in`, :func:`pause_until` and
+    :func:`pause_for`.
+
+    :param secs: the number of seconds a timer may be delayed (default 0)
+    :type secs: int or float
+    """
+    if secs < 0:
+        raise ValueError("timer slack can't be negative")
+    log.info("setting default timer slack to %r" % secs)
+    state.timer_slack = secs
+
+
+def poll_wakeup_rate():
+    """the rate at which the scheduler has been returning from blocking polls
+
+    :returns:
+        a float, the number of poller wakeups per second over the most recent
+        full second measured. the running total is kept as
+        ``state.poll_wakeups.total``
+    """
+    return state.poll_wakeups.rate
+
+
+def set_direct_handoff(flag=True):
+    """run greenlets woken by locks and queues ahead of everything else
+
+    normally a greenlet woken by :meth:`Lock.release <greenhouse.util.Lock>`,
+    :meth:`Queue.put <greenhouse.util.Queue.put>` and friends is only made
+    runnable on the scheduler's next trip through the poller. with direct
+    handoff it goes to the front of the run queue instead, so it runs as soon
+    as the waking greenlet blocks or yields. this shortens producer/consumer
+    round trips considerably.
+
+    to keep I/O from being starved, only a limited number of greenlets
+    (``HANDOFF_LIMIT``) are handed off between polls.
+
+    :param flag: whether to turn direct handoff on (default ``True``) or off
+    :type flag: bool
+    """
+    state.direct_handoff = bool(flag)
+
+
+def set_high_resolution_timers(flag=True):
+    """drive timeouts from a kernel timer rather than the poll timeout
+
+    ``epoll_wait`` and friends only take timeouts in milliseconds, so normally
+    a timer can fire up to a millisecond late. with this turned on, a single
+    ``timerfd`` is armed for the earliest deadline and waited on alongside
+    every other descriptor, which makes sub-millisecond sleeps accurate.
+
+    this needs linux's ``timerfd_create(2)``, reached through ctypes.
+
+    :param flag:
+        whether to use the timerfd (``True``) or go back to poll timeouts
+        (``False``)
+    :type flag: bool
+
+    :raises: ``RuntimeError`` if timerfds aren't available
+    """
+    if flag and syscalls.timerfd_create is None:
+        raise RuntimeError("timerfd is not available on this platform")
+    log.info("setting high resolution timers to %r" % flag)
+
+    if state.timerfd is not None:
+        state.timerfd.close()
+        state.timerfd = None
+    if flag:
+        state.timerfd = TimerFD()
+
+
 def reset_poller(poll=None):
     """replace the scheduler's poller, throwing away any pre-existing state
 
@@ -930,3 +1349,9 @@ def reset_poller(poll=None):
     """
     state.poller = poll or poller.best()
     log.info("resetting fd poller, using %s" % type(state.poller).__name__)
+
+    # a fresh timerfd, since after a fork the old one is shared with the parent
+    if state.timerfd is not None:
+        state.descriptormap.pop(state.timerfd.fileno(), None)
+        os.close(state.timerfd.fileno())
+        state.timerfd = TimerFD()
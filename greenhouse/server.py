@@ -0,0 +1,639 @@
+from __future__ import absolute_import
+
+import collections
+import errno
+import logging
+import os
+import socket
+import struct
+import sys
+
+from greenhouse import compat, scheduler, util
+from greenhouse.io import sockets
+
+
+__all__ = ["StreamServer", "DatagramServer", "Dispatcher", "HandoffListener"]
+
+log = logging.getLogger("greenhouse.server")
+
+# accept() failures that mean the process or system is out of some resource
+# for the moment, rather than that the listener is broken
+_OUT_OF_RESOURCES = frozenset([errno.EMFILE, errno.ENFILE, errno.ENOBUFS,
+    errno.ENOMEM])
+
+# the connection was torn down while still in the backlog
+_ACCEPT_ABORTED = frozenset([errno.ECONNABORTED, errno.EPROTO])
+
+# send failures that mean a worker's end of its channel is gone for good
+_CHANNEL_GONE = frozenset([errno.EPIPE, errno.ECONNRESET, errno.ENOTCONN])
+
+# a connection passed to a worker goes with its family and type, so that the
+# worker can build a socket object around the descriptor
+_HANDOFF = struct.Struct("!HH")
+
+# a worker's load, and how many connections it had been passed when it
+# measured it
+_LOAD_REPORT = struct.Struct("!II")
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _Server(object):
+    def serve_forever(self):
+        """start the server, and block until it is :meth:`stopped<stop>`
+
+        .. note:: this method blocks until another greenlet calls :meth:`stop`
+        """
+        self.start()
+        self._stopped.wait()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, klass, value, tb):
+        self.stop()
+
+
+class StreamServer(_Server):
+    """a server for stream sockets that runs a handler for every connection
+
+    the listener is drained of every queued connection each time it becomes
+    readable, and handlers run on a set of worker greenlets that are reused
+    from one connection to the next instead of starting a new greenlet each.
+
+    no more than ``max_connections`` connections are handled at once. when
+    that many are open the server stops accepting until one finishes, so
+    further connection attempts wait in the kernel's listen backlog (and
+    are eventually refused) instead of piling up in the process.
+
+    :param listener:
+        the socket to accept connections on, already bound and listening, or
+        a :class:`HandoffListener`. or an address, in which case a listening
+        socket is made for it: a ``(host, port)`` tuple for TCP (IPv6 if the
+        host has a ``:`` in it), or a string path for a unix domain socket
+    :type listener:
+        :class:`Socket<greenhouse.io.sockets.Socket>`,
+        :class:`HandoffListener`, tuple or str
+    :param handler:
+        the function to run for each connection, it is called with the
+        connected :class:`Socket<greenhouse.io.sockets.Socket>` and the remote
+        address. the socket is closed when it returns
+    :type handler: function
+    :param max_connections:
+        the most connections to handle at the same time (default 1024)
+    :type max_connections: int
+    :param idle_timeout:
+        the timeout in seconds set on every connection, so that a handler
+        blocked that long on a client that has gone quiet gets a
+        ``socket.timeout``, after which the connection is closed. the default
+        of ``None`` allows connections to idle indefinitely
+    :type idle_timeout: int, float or None
+    :param backlog:
+        the listen backlog, only used when ``listener`` is an address
+        (default 128)
+    :type backlog: int
+
+    this class can be used as a context manager, in which case :meth:`start`
+    is called at entry and :meth:`stop` is called on exit from the context.
+    """
+    def __init__(self, listener, handler, max_connections=1024,
+            idle_timeout=None, backlog=128):
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+        if not hasattr(listener, "accept"):
+            listener = _bind(listener, socket.SOCK_STREAM)
+            listener.listen(backlog)
+        elif not isinstance(listener, (sockets.Socket, HandoffListener)):
+            listener = sockets.Socket(fromsock=listener)
+
+        self.listener = listener
+        self.handler = handler
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+
+        self._acceptor = None
+        self._stopping = False
+        self._stopped = util.Event()
+
+        # set while the acceptor is held back by max_connections
+        self._room = util.Event()
+
+        # connections accepted but not yet picked up by a worker
+        self._pending = collections.deque()
+
+        # every connection accepted and not yet finished
+        self._connections = set()
+        self._finished = util.Event()
+
+        # parked workers, the most recently used one is woken first
+        self._idle = []
+        self._workers = 0
+
+    @property
+    def address(self):
+        "the address the server is listening on"
+        return self.listener.getsockname()
+
+    @property
+    def connections(self):
+        "the number of connections currently open"
+        return len(self._connections)
+
+    def start(self):
+        "start accepting connections"
+        if self._acceptor is not None:
+            return
+        self._stopping = False
+        self._stopped.clear()
+        self._acceptor = scheduler.greenlet(self._accept_loop)
+        scheduler.schedule(self._acceptor)
+
+    def stop(self, timeout=None):
+        """stop accepting, and wait for the open connections to finish
+
+        the listening socket is closed, and then connections that are still
+        open once the timeout runs out are shut down, which wakes their
+        handlers with end of file or a broken connection.
+
+        :param timeout:
+            the most time in seconds to wait for the handlers to finish on
+            their own. the default of ``None`` waits as long as it takes
+        :type timeout: int, float or None
+
+        :returns:
+            ``True`` if every connection finished before the timeout,
+            ``False`` if some had to be shut down
+        """
+        if self._acceptor is None:
+            if self._stopping and not self._stopped.is_set():
+                # the acceptor died and is already winding the server down
+                return not self._stopped.wait(timeout)
+            return True
+        self._stopping = True
+
+        # a running acceptor closes the listener itself on the way out, so
+        # that it is never closed under the acceptor's wait on it
+        acceptor, self._acceptor = self._acceptor, None
+        if acceptor:
+            scheduler.schedule_exception(_Stopped(), acceptor)
+        else:
+            self.listener.close()
+
+        return self._wind_down(timeout)
+
+    def _wind_down(self, timeout=None):
+        # let parked workers see that it is time to go
+        idle, self._idle = self._idle, []
+        for worker in idle:
+            scheduler.schedule(worker)
+
+        graceful = True
+        if self._connections:
+            self._finished.clear()
+            if self._finished.wait(timeout):
+                graceful = False
+                for sock in list(self._connections):
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except socket.error:
+                        pass
+
+        self._stopped.set()
+        return graceful
+
+    def _accept_loop(self):
+        try:
+            while not self._stopping:
+                if len(self._connections) >= self.max_connections:
+                    self._room.clear()
+                    self._room.wait()
+                    continue
+
+                # this only blocks once the backlog has been drained
+                try:
+                    client, address = self.listener.accept()
+                except socket.timeout:
+                    # the listener has a timeout of its own, just wait again
+                    sys.exc_clear()
+                    continue
+                except socket.error, exc:
+                    if exc.args[0] in _ACCEPT_ABORTED:
+                        continue
+                    if exc.args[0] not in _OUT_OF_RESOURCES:
+                        raise
+                    log.warning("accept failed (%s), backing off" % exc)
+                    del exc
+                    sys.exc_clear()
+                    scheduler.pause_for(0.1)
+                    continue
+
+                self._dispatch(client, address)
+        except (_Stopped, EOFError):
+            # stop(), or a listener that will have no more connections
+            pass
+        except Exception:
+            log.exception("accept failed, stopping the server")
+        finally:
+            self.listener.close()
+
+            # without a stop() nothing else would finish the shutdown, and
+            # serve_forever() would wait on it forever
+            if self._acceptor is compat.getcurrent():
+                self._acceptor = None
+                self._stopping = True
+                scheduler.schedule(self._wind_down)
+
+    def _dispatch(self, client, address):
+        if self.idle_timeout is not None:
+            client.settimeout(self.idle_timeout)
+        self._connections.add(client)
+        self._pending.append((client, address))
+
+        # wake a worker without switching to it, so the acceptor can carry
+        # on draining the backlog first
+        if self._idle:
+            scheduler.schedule(self._idle.pop())
+        elif self._workers < self.max_connections:
+            self._workers += 1
+            scheduler.schedule(self._worker)
+
+    def _worker(self):
+        current = compat.getcurrent()
+        try:
+            while 1:
+                while self._pending:
+                    self._handle(*self._pending.popleft())
+                if self._stopping:
+                    break
+                self._idle.append(current)
+                scheduler.state.mainloop.switch()
+        finally:
+            self._workers -= 1
+
+    def _handle(self, sock, address):
+        try:
+            self.handler(sock, address)
+        except socket.timeout:
+            # the connection sat idle too long, it just gets closed
+            sys.exc_clear()
+        except Exception:
+            scheduler.handle_exception(*sys.exc_info())
+        finally:
+            sock.close()
+            self._connections.discard(sock)
+            if not self._connections:
+                self._finished.set()
+            if len(self._connections) < self.max_connections:
+                self._room.set()
+
+
+class DatagramServer(_Server):
+    """a server for datagram sockets that hands datagrams over in batches
+
+    each worker greenlet takes every datagram waiting on the socket at once
+    (see :meth:`Socket.recvmany<greenhouse.io.sockets.Socket.recvmany>`) and
+    passes the whole batch to the handler, so a busy server makes a system
+    call and a handler call per batch rather than per datagram.
+
+    :param sock:
+        the socket to receive on, already bound. or an address to bind a new
+        one to: a ``(host, port)`` tuple for UDP (IPv6 if the host has a
+        ``:`` in it), or a string path for a unix domain socket
+    :type sock: :class:`Socket<greenhouse.io.sockets.Socket>`, tuple or str
+    :param handler:
+        the function to run for each batch, it is called with the socket
+        (for sending replies, perhaps with
+        :meth:`sendmany<greenhouse.io.sockets.Socket.sendmany>`) and a list
+        of ``(data, address)`` two-tuples
+    :type handler: function
+    :param batch_size: the most datagrams to pass in one batch (default 64)
+    :type batch_size: int
+    :param bufsize:
+        the most bytes to take from each datagram, any more is discarded
+        (default 8192)
+    :type bufsize: int
+    :param workers:
+        the number of greenlets receiving and running the handler. more than
+        one lets the socket keep being read while a handler is blocked
+        (default 1)
+    :type workers: int
+
+    this class can be used as a context manager, in which case :meth:`start`
+    is called at entry and :meth:`stop` is called on exit from the context.
+    """
+    def __init__(self, sock, handler, batch_size=64, bufsize=8192,
+            workers=1):
+        if not hasattr(sock, "recvfrom"):
+            sock = _bind(sock, socket.SOCK_DGRAM)
+        elif not isinstance(sock, sockets.Socket):
+            sock = sockets.Socket(fromsock=sock)
+
+        self.socket = sock
+        self.handler = handler
+        self.batch_size = batch_size
+        self.bufsize = bufsize
+        self.workers = workers
+
+        self._running = 0
+        self._stopping = False
+        self._stopped = util.Event()
+        self._finished = util.Event()
+
+        # workers waiting on the socket rather than in the handler
+        self._receiving = set()
+
+    @property
+    def address(self):
+        "the address the server is receiving on"
+        return self.socket.getsockname()
+
+    def start(self):
+        "start receiving datagrams"
+        if self._running:
+            return
+        self._stopping = False
+        self._stopped.clear()
+        self._finished.clear()
+        for i in xrange(self.workers):
+            self._running += 1
+            scheduler.schedule(self._worker)
+
+    def stop(self, timeout=None):
+        """stop receiving, and wait for running handlers to finish
+
+        the socket is closed once they have.
+
+        :param timeout:
+            the most time in seconds to wait for the handlers. the default of
+            ``None`` waits as long as it takes
+        :type timeout: int, float or None
+
+        :returns:
+            ``True`` if every handler finished before the timeout, otherwise
+            ``False``
+        """
+        if not self._running:
+            return True
+        self._stopping = True
+
+        for worker in list(self._receiving):
+            scheduler.schedule_exception(_Stopped(), worker)
+        self._receiving.clear()
+
+        graceful = not self._finished.wait(timeout)
+        self._stopped.set()
+        return graceful
+
+    def _worker(self):
+        current = compat.getcurrent()
+        sock = self.socket
+        try:
+            while not self._stopping:
+                self._receiving.add(current)
+                try:
+                    batch = sock.recvmany(self.batch_size, self.bufsize)
+                except _Stopped:
+                    break
+                finally:
+                    self._receiving.discard(current)
+
+                try:
+                    self.handler(sock, batch)
+                except Exception:
+                    scheduler.handle_exception(*sys.exc_info())
+        finally:
+            self._running -= 1
+            if not self._running:
+                sock.close()
+                self._finished.set()
+
+
+class Dispatcher(object):
+    """hands connections to whichever of a set of worker processes is least
+    loaded
+
+    each worker is at the other end of an ``AF_UNIX`` stream socket (made
+    with ``socket.socketpair`` before forking, say), where it takes the
+    connections with a :class:`HandoffListener` and reports its load back
+    with :meth:`HandoffListener.report`. a connection goes to the worker
+    with the lowest estimated load: the last load it reported, plus the
+    connections passed to it since that report. so a burst of connections
+    is spread out over the workers even before any of them report again.
+
+    :meth:`dispatch` fits the handler signature of :class:`StreamServer`, so
+    an acceptor process can be just
+    ``StreamServer(address, dispatcher.dispatch)``.
+
+    :param channels: the connections to each of the workers
+    :type channels: list of :class:`Socket<greenhouse.io.sockets.Socket>`
+
+    this class can be used as a context manager, in which case :meth:`start`
+    is called at entry and :meth:`close` is called on exit from the context.
+    """
+    def __init__(self, channels):
+        if not channels:
+            raise ValueError("a Dispatcher needs at least one worker")
+        self.channels = [c if isinstance(c, sockets.Socket)
+                else sockets.Socket(fromsock=c) for c in channels]
+        self._sent = [0] * len(self.channels)
+        self._reports = [(0, 0)] * len(self.channels)
+        self._live = set(xrange(len(self.channels)))
+        self._readers = []
+
+    def load(self, worker):
+        """the estimated load on a worker
+
+        :param worker: the worker's index in ``channels``
+        :type worker: int
+
+        :returns:
+            the load it last reported, plus the connections passed to it
+            since then
+        """
+        load, received = self._reports[worker]
+        return load + self._sent[worker] - received
+
+    def start(self):
+        "start reading the workers' load reports"
+        if self._readers:
+            return
+        for i in xrange(len(self.channels)):
+            reader = scheduler.greenlet(self._read_reports, args=(i,))
+            self._readers.append(reader)
+            scheduler.schedule(reader)
+
+    def close(self):
+        "stop reading load reports, and close the connections to the workers"
+        readers, self._readers = self._readers, []
+        for reader in readers:
+            if reader:
+                scheduler.schedule_exception(_Stopped(), reader)
+        self._live.clear()
+        for channel in self.channels:
+            channel.close()
+
+    def dispatch(self, sock, address=None):
+        """pass a connection on to the least loaded worker
+
+        the socket is closed here once it has been sent, the worker has its
+        own copy.
+
+        .. note:: this method may block if the worker's channel is full
+
+        :param sock: the connection to pass on
+        :type sock: :class:`Socket<greenhouse.io.sockets.Socket>`
+        :param address: unused, it's accepted to fit :class:`StreamServer`
+
+        :raises:
+            ``socket.error`` if every worker's channel has failed, or with
+            whatever other error sending failed with
+
+        :returns: the index of the worker it went to
+        """
+        message = _HANDOFF.pack(sock.family, sock.type)
+        while 1:
+            if not self._live:
+                raise socket.error(errno.EPIPE, "no workers left")
+            worker = min(self._live, key=self.load)
+            try:
+                self.channels[worker].send_fds(message, [sock.fileno()])
+            except socket.error, exc:
+                if exc.args[0] not in _CHANNEL_GONE:
+                    raise
+                log.warning("dropping worker %d (%s)" % (worker, exc))
+                del exc
+                sys.exc_clear()
+                self._live.discard(worker)
+                continue
+            break
+
+        self._sent[worker] += 1
+        sock.close()
+        return worker
+
+    def _read_reports(self, worker):
+        channel = self.channels[worker]
+        try:
+            while 1:
+                report = channel.recv_exactly(_LOAD_REPORT.size)
+                if len(report) < _LOAD_REPORT.size:
+                    break
+                self._reports[worker] = _LOAD_REPORT.unpack(report)
+        except (_Stopped, socket.error):
+            sys.exc_clear()
+        else:
+            # the worker has gone away
+            self._live.discard(worker)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, klass, value, tb):
+        self.close()
+
+
+class HandoffListener(object):
+    """the worker's end of a :class:`Dispatcher`'s channel
+
+    it accepts the connections the dispatcher passes over, and has enough of
+    a listening socket's methods to be the listener of a
+    :class:`StreamServer`, so a worker process can serve them with
+    ``StreamServer(HandoffListener(channel), handler)``.
+
+    :param channel: the ``AF_UNIX`` stream socket connected to the dispatcher
+    :type channel: :class:`Socket<greenhouse.io.sockets.Socket>`
+    """
+    def __init__(self, channel):
+        if not isinstance(channel, sockets.Socket):
+            channel = sockets.Socket(fromsock=channel)
+        self.channel = channel
+
+        # connections accepted so far, reported along with the load
+        self.received = 0
+
+    def accept(self):
+        """take the next connection passed over from the dispatcher
+
+        .. note:: this method will block until one arrives
+
+        :raises:
+            ``EOFError`` once the dispatcher's end has been closed, which a
+            :class:`StreamServer` takes as the signal to stop
+
+        :returns:
+            a two-tuple of the new :class:`Socket<greenhouse.io.sockets.Socket>`
+            and its remote address (``None`` if it can't be found)
+        """
+        while 1:
+            try:
+                data, fds = self.channel.recv_fds(_HANDOFF.size, 1)
+            except socket.error, exc:
+                if exc.args[0] not in _CHANNEL_GONE:
+                    raise
+                data, fds = "", []
+                del exc
+                sys.exc_clear()
+            if not data:
+                for fd in fds:
+                    os.close(fd)
+                raise EOFError("the dispatcher has gone")
+            if len(data) == _HANDOFF.size and len(fds) == 1:
+                break
+            for fd in fds:
+                os.close(fd)
+
+        family, type_ = _HANDOFF.unpack(data)
+        try:
+            client = sockets.Socket(
+                    fromsock=socket.fromfd(fds[0], family, type_))
+        finally:
+            os.close(fds[0])
+        self.received += 1
+
+        try:
+            address = client.getpeername()
+        except socket.error:
+            sys.exc_clear()
+            address = None
+        return client, address
+
+    def report(self, load):
+        """tell the dispatcher how loaded this worker is
+
+        .. note:: this method may block if the channel is full
+
+        :param load:
+            any measure of load that is comparable between the workers, the
+            number of open connections (``StreamServer.connections``) is the
+            obvious one
+        :type load: int
+        """
+        self.channel.sendall(_LOAD_REPORT.pack(load, self.received))
+
+    def getsockname(self):
+        return self.channel.getsockname()
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def close(self):
+        self.channel.close()
+
+
+def _bind(address, type_):
+    if isinstance(address, basestring):
+        family = socket.AF_UNIX
+    elif ':' in address[0]:
+        family = socket.AF_INET6
+    else:
+        family = socket.AF_INET
+
+    sock = sockets.Socket(family, type_)
+    if family != socket.AF_UNIX:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    return sock
@@ -0,0 +1,997 @@
+"""ctypes bindings for system calls the standard library doesn't expose
+
+every wrapper here is optional. the function names are bound to ``None`` when
+libc doesn't provide the call (or ctypes isn't available at all), so callers
+check for that and fall back to something portable.
+
+failing calls raise ``OSError`` with the errno set, like the ``os`` module.
+"""
+from __future__ import absolute_import
+
+import mmap
+import operator
+import os
+import socket
+import struct
+import sys
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+
+__all__ = ["timerfd_create", "timerfd_settime", "writev", "pread", "pread_into",
+        "pwrite", "read_nowait", "read_nowait_into", "madvise", "sendfile",
+        "splice", "recvmmsg", "sendmmsg", "sendmsg_fds", "recvmsg_fds",
+        "inotify_init", "inotify_add_watch", "inotify_rm_watch"]
+
+
+def _load_libc():
+    if ctypes is None:
+        return None
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                use_errno=True)
+    except (OSError, TypeError):
+        return None
+
+libc = _load_libc()
+
+
+def _function(name, restype, *argtypes):
+    func = getattr(libc, name, None)
+    if func is not None:
+        func.restype = restype
+        func.argtypes = argtypes
+    return func
+
+
+def _check(result):
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+
+##
+## timerfd
+##
+
+CLOCK_REALTIME = 0
+TFD_NONBLOCK = os.O_NONBLOCK
+TFD_CLOEXEC = 02000000
+TFD_TIMER_ABSTIME = 1
+
+timerfd_create = timerfd_settime = None
+
+if libc is not None:
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    class itimerspec(ctypes.Structure):
+        _fields_ = [("it_interval", timespec), ("it_value", timespec)]
+
+    _timerfd_create = _function("timerfd_create",
+            ctypes.c_int, ctypes.c_int, ctypes.c_int)
+    _timerfd_settime = _function("timerfd_settime",
+            ctypes.c_int, ctypes.c_int, ctypes.c_int,
+            ctypes.POINTER(itimerspec), ctypes.POINTER(itimerspec))
+
+    if _timerfd_create and _timerfd_settime:
+        def timerfd_create(flags=TFD_NONBLOCK | TFD_CLOEXEC):
+            """create a timer that delivers expirations through a descriptor
+
+            :param flags: ``TFD_*`` flags (default non-blocking and cloexec)
+            :type flags: int
+
+            :returns: the integer file descriptor
+            """
+            return _check(_timerfd_create(CLOCK_REALTIME, flags))
+
+        def timerfd_settime(fd, unixtime):
+            """arm a timerfd to expire once at an absolute time
+
+            :param fd: the timer's file descriptor
+            :type fd: int
+            :param unixtime:
+                the unix timestamp at which the timer should expire, or
+                ``None`` to disarm it
+            :type unixtime: int, float or None
+            """
+            spec = itimerspec()
+            if unixtime is not None:
+                secs = int(unixtime)
+                # an all-zero it_value would disarm rather than fire
+                spec.it_value.tv_sec = secs
+                spec.it_value.tv_nsec = max(
+                        int((unixtime - secs) * 1e9), int(not secs))
+            _check(_timerfd_settime(fd, TFD_TIMER_ABSTIME,
+                ctypes.byref(spec), None))
+
+
+##
+## scatter/gather I/O
+##
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (ValueError, OSError, AttributeError):
+    IOV_MAX = 16
+if IOV_MAX <= 0:
+    IOV_MAX = 16
+
+writev = None
+
+if libc is not None:
+    class iovec(ctypes.Structure):
+        _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+    _writev = _function("writev",
+            ctypes.c_ssize_t, ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_int)
+
+    try:
+        _as_read_buffer = ctypes.pythonapi.PyObject_AsReadBuffer
+    except AttributeError:
+        _as_read_buffer = None
+    else:
+        _as_read_buffer.restype = ctypes.c_int
+        _as_read_buffer.argtypes = [ctypes.py_object,
+                ctypes.POINTER(ctypes.c_void_p),
+                ctypes.POINTER(ctypes.c_ssize_t)]
+
+    def _iovecs(buffers):
+        # point straight at each object's memory, there's no copying here.
+        # the caller has to keep the objects alive until the call is done
+        count = min(len(buffers), IOV_MAX)
+        iov = (iovec * count)()
+        ptr = ctypes.c_void_p()
+        size = ctypes.c_ssize_t()
+        for i in xrange(count):
+            _as_read_buffer(buffers[i], ctypes.byref(ptr), ctypes.byref(size))
+            iov[i].iov_base = ptr
+            iov[i].iov_len = size.value
+        return iov, count
+
+    if _writev and _as_read_buffer:
+        def writev(fd, buffers):
+            """write a sequence of buffers to a descriptor in one system call
+
+            only the first ``IOV_MAX`` buffers are used.
+
+            :param fd: the file descriptor to write to
+            :type fd: int
+            :param buffers:
+                the data to write, objects supporting the buffer interface
+                (strings, ``bytearray``\ s, ``buffer``\ s, mmaps)
+            :type buffers: list
+
+            :returns: the number of bytes written
+            """
+            iov, count = _iovecs(buffers)
+            return _check(_writev(fd, iov, count))
+
+
+##
+## positioned reads and writes
+##
+
+pread = pread_into = pwrite = None
+
+if libc is not None:
+    # the BSDs have 64-bit offsets in plain pread and pwrite
+    _pread = _function("pread64", ctypes.c_ssize_t, ctypes.c_int,
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64) or \
+        _function("pread", ctypes.c_ssize_t, ctypes.c_int,
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64)
+    _pwrite = _function("pwrite64", ctypes.c_ssize_t, ctypes.c_int,
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64) or \
+        _function("pwrite", ctypes.c_ssize_t, ctypes.c_int,
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64)
+
+    try:
+        _as_write_buffer = ctypes.pythonapi.PyObject_AsWriteBuffer
+    except AttributeError:
+        _as_write_buffer = None
+    else:
+        _as_write_buffer.restype = ctypes.c_int
+        _as_write_buffer.argtypes = [ctypes.py_object,
+                ctypes.POINTER(ctypes.c_void_p),
+                ctypes.POINTER(ctypes.c_ssize_t)]
+
+    if _pread:
+        def pread(fd, size, offset):
+            """read from a position in a file, without moving its position
+
+            :param fd: the file descriptor to read from
+            :type fd: int
+            :param size: the most bytes to read
+            :type size: int
+            :param offset: the position in the file to read from
+            :type offset: int
+
+            :returns: the data read, an empty string at the end of the file
+            """
+            buf = ctypes.create_string_buffer(size)
+            return ctypes.string_at(buf, _check(_pread(fd, buf, size, offset)))
+
+    if _pread and _as_write_buffer:
+        def pread_into(fd, target, offset, start=0):
+            """read from a position in a file straight into a buffer
+
+            the file's own position is neither used nor changed.
+
+            :param fd: the file descriptor to read from
+            :type fd: int
+            :param target:
+                where to put the data, an object supporting the old writable
+                buffer interface (a ``bytearray``, ``array.array`` or mmap)
+            :param offset: the position in the file to read from
+            :type offset: int
+            :param start:
+                the byte offset in ``target`` to start putting data, the rest
+                of ``target`` after it being filled as far as possible
+            :type start: int
+
+            :returns: the number of bytes read, 0 at the end of the file
+            """
+            ptr = ctypes.c_void_p()
+            size = ctypes.c_ssize_t()
+            _as_write_buffer(target, ctypes.byref(ptr), ctypes.byref(size))
+            if not 0 <= start <= size.value:
+                raise ValueError("start is outside of the target buffer")
+            return _check(_pread(fd, ptr.value + start, size.value - start,
+                offset))
+
+    if _pwrite and _as_read_buffer:
+        def pwrite(fd, data, offset):
+            """write to a position in a file, without moving its position
+
+            on linux a file opened for appending is written at its end
+            regardless of ``offset``.
+
+            :param fd: the file descriptor to write to
+            :type fd: int
+            :param data:
+                the data to write, an object supporting the buffer interface
+            :param offset: the position in the file to write at
+            :type offset: int
+
+            :returns: the number of bytes written
+            """
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            ptr = ctypes.c_void_p()
+            size = ctypes.c_ssize_t()
+            _as_read_buffer(data, ctypes.byref(ptr), ctypes.byref(size))
+            return _check(_pwrite(fd, ptr, size.value, offset))
+
+
+##
+## reads from the page cache only
+##
+
+RWF_NOWAIT = 8
+
+read_nowait = read_nowait_into = None
+
+if libc is not None and sys.platform.startswith("linux"):
+    _preadv2 = _function("preadv2", ctypes.c_ssize_t, ctypes.c_int,
+            ctypes.POINTER(iovec), ctypes.c_int, ctypes.c_int64, ctypes.c_int)
+    _addressof = ctypes.addressof
+    _char_at = ctypes.c_char.from_buffer
+
+    if _preadv2:
+        def read_nowait(fd, size, offset=-1):
+            """read from a file only if the data is already in memory
+
+            this is ``preadv2()`` with ``RWF_NOWAIT``, which fails with
+            ``EAGAIN`` rather than wait for the disk. kernels before 4.14, and
+            some filesystems, don't support it and fail with ``EOPNOTSUPP``,
+            ``ENOSYS`` or ``EINVAL``.
+
+            :param fd: the file descriptor to read from
+            :type fd: int
+            :param size: the most bytes to read
+            :type size: int
+            :param offset:
+                the position in the file to read from. the default of -1 reads
+                from the file's own position, and moves it on
+            :type offset: int
+
+            :returns:
+                the data read, which may be short if only some of it was in
+                memory, and empty at the end of the file
+            """
+            if size <= 0:
+                return ""
+            buf = bytearray(size)
+            return str(buffer(buf, 0, read_nowait_into(fd, buf, offset)))
+
+        def read_nowait_into(fd, target, offset=-1, start=0, size=-1):
+            """:func:`read_nowait` straight into a buffer
+
+            there is no allocation and no copy beyond the kernel's own, which
+            is what keeps this quicker than a plain ``read()`` handed to the
+            thread pool.
+
+            :param fd: the file descriptor to read from
+            :type fd: int
+            :param target:
+                where to put the data, an object supporting the old writable
+                buffer interface (a ``bytearray``, ``array.array`` or mmap)
+            :param offset:
+                the position in the file to read from, or -1 for the file's
+                own position as with :func:`read_nowait`
+            :type offset: int
+            :param start: the byte offset in ``target`` to start putting data
+            :type start: int
+            :param size:
+                the most bytes to read, < 0 means the rest of ``target`` after
+                ``start``
+            :type size: int
+
+            :returns:
+                the number of bytes read, 0 at the end of the file
+
+            :raises:
+                ``ValueError`` if ``start`` and ``size`` go past the end of
+                ``target``
+            """
+            if type(target) is bytearray:
+                room = len(target) - start
+            else:
+                # the length in bytes, whatever the item size
+                room = len(buffer(target)) - start
+            if size < 0:
+                size = room
+            if start < 0 or size > room:
+                raise ValueError("start and size go past the target buffer")
+            if not size:
+                return 0
+
+            # from_buffer() gets at the address without the two out-parameters
+            # that PyObject_AsWriteBuffer would take. this is the hot path for
+            # cached file reads, and each ctypes step costs
+            iov = iovec(_addressof(_char_at(target, start)), size)
+            return _check(_preadv2(fd, iov, 1, offset, RWF_NOWAIT))
+
+
+##
+## madvise
+##
+
+MADV_NORMAL = 0
+MADV_RANDOM = 1
+MADV_SEQUENTIAL = 2
+MADV_WILLNEED = 3
+MADV_DONTNEED = 4
+
+madvise = None
+
+if libc is not None:
+    _madvise = _function("madvise",
+            ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+
+    if _madvise and _as_read_buffer:
+        def madvise(mapping, advice, start=0, length=None):
+            """tell the kernel how a memory mapping is going to be used
+
+            :param mapping: the memory mapping
+            :type mapping: ``mmap.mmap``
+            :param advice: one of the ``MADV_*`` constants
+            :type advice: int
+            :param start:
+                the offset in the mapping where the advice starts applying,
+                which is rounded down to a page boundary
+            :type start: int
+            :param length:
+                the length of the range the advice is for, the default of
+                ``None`` being the rest of the mapping
+            :type length: int or None
+            """
+            ptr = ctypes.c_void_p()
+            size = ctypes.c_ssize_t()
+            _as_read_buffer(mapping, ctypes.byref(ptr), ctypes.byref(size))
+            if length is None:
+                length = size.value - start
+            if not 0 <= start <= start + length <= size.value:
+                raise ValueError("range is outside of the mapping")
+
+            # the mapping itself always starts on a page boundary
+            pad = start % mmap.PAGESIZE
+            _check(_madvise(ptr.value + start - pad, length + pad, advice))
+
+
+##
+## sendfile
+##
+
+sendfile = None
+
+# other systems have a sendfile with a different signature entirely
+if libc is not None and sys.platform.startswith("linux"):
+    _sendfile = _function("sendfile64", ctypes.c_ssize_t, ctypes.c_int,
+            ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t)
+
+    if _sendfile:
+        def sendfile(out_fd, in_fd, offset, count):
+            """copy data from a file to a descriptor without it leaving the kernel
+
+            :param out_fd: the descriptor to write to, typically a socket
+            :type out_fd: int
+            :param in_fd:
+                the descriptor to read from, which has to support mmap-like
+                operations (so a regular file, rather than a pipe or socket)
+            :type in_fd: int
+            :param offset:
+                the position in ``in_fd`` to start reading from. the file's
+                own position is neither used nor changed
+            :type offset: int
+            :param count: the most bytes to copy
+            :type count: int
+
+            :returns: the number of bytes copied, 0 at the end of the file
+            """
+            pos = ctypes.c_int64(offset)
+            return _check(_sendfile(out_fd, in_fd, ctypes.byref(pos), count))
+
+
+##
+## splice
+##
+
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+SPLICE_F_MORE = 4
+
+splice = None
+
+if libc is not None:
+    _splice = _function("splice", ctypes.c_ssize_t,
+            ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+            ctypes.c_size_t, ctypes.c_uint)
+
+    if _splice:
+        def splice(fd_in, fd_out, count,
+                flags=SPLICE_F_MOVE | SPLICE_F_NONBLOCK):
+            """move data between two descriptors, one of them a pipe
+
+            the data stays in the kernel, the pipe just holds references to
+            the pages in between.
+
+            :param fd_in: the descriptor to read from
+            :type fd_in: int
+            :param fd_out: the descriptor to write to
+            :type fd_out: int
+            :param count: the most bytes to move
+            :type count: int
+            :param flags:
+                ``SPLICE_F_*`` flags (default ``SPLICE_F_MOVE`` and
+                ``SPLICE_F_NONBLOCK``)
+            :type flags: int
+
+            :returns: the number of bytes moved, 0 at the end of the input
+            """
+            return _check(_splice(fd_in, None, fd_out, None, count, flags))
+
+
+##
+## batched datagrams
+##
+
+# the most messages recvmmsg or sendmmsg take in one call (UIO_MAXIOV)
+MMSG_MAX = 1024
+
+# enough room for any kind of socket address
+SOCKADDR_MAX = 128
+
+recvmmsg = sendmmsg = MessageBuffers = None
+
+_FAMILY = struct.Struct("=H")
+_INET = struct.Struct("!H4s")
+_INET6 = struct.Struct("!HI16s")
+_SCOPE = struct.Struct("=I")
+
+
+def pack_sockaddr(family, address):
+    """lay out a socket address as the ``struct sockaddr`` for its family
+
+    :param family: the ``AF_*`` address family
+    :type family: int
+    :param address:
+        the address, as the ``socket`` module takes it. hosts have to be
+        numeric, names aren't resolved
+    :type address: tuple or str
+
+    :returns: the ``struct sockaddr`` as a string
+
+    :raises: ``ValueError`` for an address this can't lay out
+    """
+    try:
+        if family == socket.AF_INET:
+            host, port = address
+            return (_FAMILY.pack(family) +
+                    _INET.pack(port, socket.inet_pton(family, host)) +
+                    "\0" * 8)
+        if family == socket.AF_INET6:
+            host, port = address[:2]
+            flowinfo, scope_id = (tuple(address[2:]) + (0, 0))[:2]
+            return (_FAMILY.pack(family) +
+                    _INET6.pack(port, flowinfo, socket.inet_pton(family, host)) +
+                    _SCOPE.pack(scope_id))
+        if family == getattr(socket, "AF_UNIX", None) and \
+                isinstance(address, str):
+            if not address.startswith("\0"):
+                address += "\0"
+            return _FAMILY.pack(family) + address
+    except (socket.error, struct.error, TypeError, ValueError):
+        pass
+    raise ValueError("can't lay out address %r" % (address,))
+
+
+def unpack_sockaddr(raw):
+    """the socket address in a ``struct sockaddr``, as ``socket`` gives it
+
+    :param raw: the ``struct sockaddr``
+    :type raw: str
+
+    :returns:
+        the address, as a ``(host, port)`` tuple for IPv4, a
+        ``(host, port, flowinfo, scope_id)`` tuple for IPv6, a string for
+        unix domain sockets, or ``None`` for an unbound sender
+    """
+    if not raw:
+        return None
+    family, = _FAMILY.unpack_from(raw)
+    if family == socket.AF_INET:
+        port, host = _INET.unpack_from(raw, 2)
+        return socket.inet_ntop(family, host), port
+    if family == socket.AF_INET6:
+        port, flowinfo, host = _INET6.unpack_from(raw, 2)
+        scope_id, = _SCOPE.unpack_from(raw, 24)
+        return socket.inet_ntop(family, host), port, flowinfo, scope_id
+    path = raw[2:]
+    if path.startswith("\0"):
+        # abstract namespace
+        return path
+    return path.split("\0", 1)[0]
+
+if libc is not None:
+    class msghdr(ctypes.Structure):
+        _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.c_void_p),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+    class mmsghdr(ctypes.Structure):
+        _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+    _recvmmsg = _function("recvmmsg", ctypes.c_int, ctypes.c_int,
+            ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p)
+    _sendmmsg = _function("sendmmsg", ctypes.c_int, ctypes.c_int,
+            ctypes.c_void_p, ctypes.c_uint, ctypes.c_int)
+
+    # the headers live in bytearrays and are filled in and read back with
+    # struct, which is a good deal quicker than ctypes attribute access.
+    # native alignment makes these line up with the C structures
+    _MMSG_SIZE = ctypes.sizeof(mmsghdr)
+    _NAMELEN_OFFSET = msghdr.msg_namelen.offset
+    _LEN_OFFSET = mmsghdr.msg_len.offset
+    _HEADER = struct.Struct("PIPL")
+    _IOVEC = struct.Struct("PL")
+
+    # whole batches of headers are packed or unpacked in one go, with the
+    # layout for one repeated for every datagram
+
+    # the address length and the datagram length
+    _LENGTHS_LAYOUT = "=" + "%dxI%dxI%dx" % (_NAMELEN_OFFSET,
+        _LEN_OFFSET - _NAMELEN_OFFSET - 4, _MMSG_SIZE - _LEN_OFFSET - 4)
+
+    # the address, its length, the iovec and the iovec count
+    _HEADER_LAYOUT = "@" + "PIPL%dx" % (_MMSG_SIZE - _HEADER.size)
+
+    _IOVEC_LAYOUT = "@PL"
+
+    _layouts = {}
+
+    def _layout(layout, count):
+        key = (layout, count)
+        rc = _layouts.get(key)
+        if rc is None:
+            rc = _layouts[key] = struct.Struct(
+                    layout[0] + layout[1:] * count)
+        return rc
+
+    _JUST_STR = set([str])
+
+    def _address_of(data):
+        # the address of a bytearray's memory, which stays put for as long
+        # as the returned ctypes object holds it exported
+        holder = (ctypes.c_char * len(data)).from_buffer(data)
+        return ctypes.addressof(holder), holder
+
+    def _str_addresses(strings):
+        # the addresses of some strs' bytes, read back out of an array of
+        # pointers to them all at once. the array has to be kept alive for
+        # as long as the addresses are used
+        holder = (ctypes.c_char_p * len(strings))(*strings)
+        return _layout("@P", len(strings)).unpack_from(holder), holder
+
+    class _MessageBuffers(object):
+        """memory for :func:`recvmmsg` to receive a batch of datagrams into
+
+        :param count: the most datagrams to receive at once
+        :type count: int
+        :param size: the most bytes to take from each datagram
+        :type size: int
+        """
+        def __init__(self, count, size):
+            count = min(count, MMSG_MAX)
+            self.count = count
+            self.size = size
+
+            self.data = bytearray(count * size)
+            self.names = bytearray(count * SOCKADDR_MAX)
+            self.headers = bytearray(count * _MMSG_SIZE)
+            self._iovecs = bytearray(count * _IOVEC.size)
+
+            data, self._data_ref = _address_of(self.data)
+            names, self._names_ref = _address_of(self.names)
+            iovecs, self._iovecs_ref = _address_of(self._iovecs)
+            self.address, self._headers_ref = _address_of(self.headers)
+
+            for i in xrange(count):
+                _IOVEC.pack_into(self._iovecs, i * _IOVEC.size,
+                        data + i * size, size)
+                _HEADER.pack_into(self.headers, i * _MMSG_SIZE,
+                        names + i * SOCKADDR_MAX, SOCKADDR_MAX,
+                        iovecs + i * _IOVEC.size, 1)
+
+            # the kernel writes the address lengths, so they get put back
+            # from this copy before every call
+            self._pristine = bytes(self.headers)
+
+            # how many headers the last call had the kernel write into
+            self.used = 0
+
+        def messages(self, count, addresses):
+            """the datagrams received by the last call
+
+            :param count: how many there were
+            :type count: int
+            :param addresses:
+                a cache of addresses already seen, mapping each ``struct
+                sockaddr`` string to the address as the ``socket`` module
+                gives it. new ones are added to it
+            :type addresses: dict
+
+            :returns:
+                a list of two-tuples of each datagram's data and its sender's
+                address
+            """
+            lengths = _layout(_LENGTHS_LAYOUT, count).unpack_from(
+                    self.headers)
+            size = self.size
+
+            starts = xrange(0, count * size, size)
+            data = map(str, map(self.data.__getitem__, map(slice,
+                starts, map(operator.add, starts, lengths[1::2]))))
+
+            names = str(buffer(self.names, 0, count * SOCKADDR_MAX))
+            starts = xrange(0, count * SOCKADDR_MAX, SOCKADDR_MAX)
+            names = map(names.__getitem__, map(slice,
+                starts, map(operator.add, starts, lengths[::2])))
+            senders = map(addresses.get, names)
+            if None in senders:
+                for i, address in enumerate(senders):
+                    if address is None:
+                        senders[i] = addresses[names[i]] = unpack_sockaddr(
+                                names[i])
+
+            return zip(data, senders)
+
+    if _recvmmsg and _sendmmsg:
+        MessageBuffers = _MessageBuffers
+
+        def recvmmsg(fd, buffers, flags=0):
+            """receive several datagrams in one system call
+
+            :param fd: the descriptor of a datagram socket
+            :type fd: int
+            :param buffers: where to receive the datagrams
+            :type buffers: :class:`MessageBuffers`
+            :param flags: ``MSG_*`` flags for the call
+            :type flags: int
+
+            :returns:
+                the number of datagrams received, which can then be read with
+                ``buffers.messages()``
+            """
+            # the kernel overwrote the address lengths last time
+            used = buffers.used * _MMSG_SIZE
+            if used:
+                buffers.headers[:used] = buffer(buffers._pristine, 0, used)
+                buffers.used = 0
+            count = _check(_recvmmsg(fd, buffers.address, buffers.count,
+                flags, None))
+            buffers.used = count
+            return count
+
+        def sendmmsg(fd, datagrams, flags=0):
+            """send several datagrams in one system call
+
+            only the first ``MMSG_MAX`` datagrams are used.
+
+            :param fd: the descriptor of a datagram socket
+            :type fd: int
+            :param datagrams:
+                two-tuples of the data for each datagram and its destination
+                as a string holding a ``struct sockaddr``, or an empty string
+                for a connected socket. both have to be ``str``\ s
+            :type datagrams: list
+
+            :returns: the number of datagrams sent
+            """
+            count = min(len(datagrams), MMSG_MAX)
+            datas, names = zip(*datagrams[:count])
+            if set(map(type, datas + names)) != _JUST_STR:
+                raise TypeError("sendmmsg takes str data and addresses")
+
+            iovecs = bytearray(count * _IOVEC.size)
+            iovecs_ptr, iovecs_ref = _address_of(iovecs)
+            datas_ptrs, datas_ref = _str_addresses(datas)
+            fields = [0] * (2 * count)
+            fields[::2] = datas_ptrs
+            fields[1::2] = map(len, datas)
+            _layout(_IOVEC_LAYOUT, count).pack_into(iovecs, 0, *fields)
+
+            headers = bytearray(count * _MMSG_SIZE)
+            headers_ptr, headers_ref = _address_of(headers)
+            names_ptrs, names_ref = _str_addresses(names)
+            fields = [1] * (4 * count)
+            fields[::4] = names_ptrs
+            fields[1::4] = map(len, names)
+            fields[2::4] = xrange(iovecs_ptr,
+                    iovecs_ptr + count * _IOVEC.size, _IOVEC.size)
+            _layout(_HEADER_LAYOUT, count).pack_into(headers, 0, *fields)
+
+            return _check(_sendmmsg(fd, headers_ptr, count, flags))
+
+
+##
+## passing descriptors over unix sockets
+##
+
+SCM_RIGHTS = 1
+MSG_CTRUNC = 8
+MSG_CMSG_CLOEXEC = 0x40000000
+
+# the most descriptors the kernel takes in one message (SCM_MAX_FD)
+SCM_MAX_FD = 253
+
+sendmsg_fds = recvmsg_fds = None
+
+if libc is not None and sys.platform.startswith("linux"):
+    class cmsghdr(ctypes.Structure):
+        _fields_ = [("cmsg_len", ctypes.c_size_t),
+                ("cmsg_level", ctypes.c_int),
+                ("cmsg_type", ctypes.c_int)]
+
+    _sendmsg = _function("sendmsg", ctypes.c_ssize_t, ctypes.c_int,
+            ctypes.POINTER(msghdr), ctypes.c_int)
+    _recvmsg = _function("recvmsg", ctypes.c_ssize_t, ctypes.c_int,
+            ctypes.POINTER(msghdr), ctypes.c_int)
+
+    _CMSG_HEADER = struct.Struct("@" + "Lii%dx" % (
+        ctypes.sizeof(cmsghdr) - struct.calcsize("@Lii")))
+    _ALIGN = ctypes.sizeof(ctypes.c_size_t)
+
+    def _cmsg_space(length):
+        # CMSG_SPACE, the room one control message takes with its padding
+        return _CMSG_HEADER.size + (length + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    if _sendmsg and _recvmsg:
+        def sendmsg_fds(fd, data, fds, flags=0):
+            """send data along with open file descriptors over a unix socket
+
+            the receiving process gets its own duplicates of the descriptors,
+            as with ``dup(2)``.
+
+            :param fd: the descriptor of an ``AF_UNIX`` socket
+            :type fd: int
+            :param data:
+                the data to send with them, which has to be at least a byte
+                for a stream socket
+            :type data: str
+            :param fds: the descriptors to pass, at most ``SCM_MAX_FD``
+            :type fds: list of ints
+            :param flags: ``MSG_*`` flags for the call
+            :type flags: int
+
+            :returns: the number of bytes of ``data`` sent
+            """
+            fds = list(fds)
+            size = 4 * len(fds)
+            control = bytearray(_cmsg_space(size))
+            _CMSG_HEADER.pack_into(control, 0, _CMSG_HEADER.size + size,
+                    socket.SOL_SOCKET, SCM_RIGHTS)
+            struct.pack_into("@%di" % len(fds), control, _CMSG_HEADER.size,
+                    *fds)
+            control_ptr, control_ref = _address_of(control)
+
+            iov = iovec(ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p),
+                    len(data))
+            msg = msghdr(None, 0, ctypes.addressof(iov), 1,
+                    control_ptr if fds else None, len(control) if fds else 0,
+                    0)
+            return _check(_sendmsg(fd, ctypes.byref(msg), flags))
+
+        def recvmsg_fds(fd, bufsize, maxfds, flags=0):
+            """receive data and any file descriptors sent along with it
+
+            the descriptors are created close-on-exec.
+
+            :param fd: the descriptor of an ``AF_UNIX`` socket
+            :type fd: int
+            :param bufsize: the most bytes of data to receive
+            :type bufsize: int
+            :param maxfds:
+                the most descriptors to make room for (a few more may fit in
+                the padding). any more sent with the same message are closed
+                by the kernel, and ``MSG_CTRUNC`` is set in the flags returned
+            :type maxfds: int
+            :param flags: ``MSG_*`` flags for the call
+            :type flags: int
+
+            :returns:
+                a three-tuple of the data, a list of the descriptors received
+                and the ``MSG_*`` flags the kernel set on the message
+            """
+            data = bytearray(bufsize)
+            data_ptr, data_ref = _address_of(data)
+            control = bytearray(_cmsg_space(4 * maxfds))
+            control_ptr, control_ref = _address_of(control)
+
+            iov = iovec(data_ptr, bufsize)
+            msg = msghdr(None, 0, ctypes.addressof(iov), 1, control_ptr,
+                    len(control), 0)
+            received = _check(_recvmsg(fd, ctypes.byref(msg),
+                flags | MSG_CMSG_CLOEXEC))
+
+            fds = []
+            offset = 0
+            while offset + _CMSG_HEADER.size <= msg.msg_controllen:
+                length, level, type_ = _CMSG_HEADER.unpack_from(
+                        control, offset)
+                if length < _CMSG_HEADER.size:
+                    break
+                if level == socket.SOL_SOCKET and type_ == SCM_RIGHTS:
+                    count = (length - _CMSG_HEADER.size) // 4
+                    fds.extend(struct.unpack_from("@%di" % count, control,
+                        offset + _CMSG_HEADER.size))
+                offset += _cmsg_space(length - _CMSG_HEADER.size)
+
+            return (str(data[:received]), fds,
+                    msg.msg_flags & ~MSG_CMSG_CLOEXEC)
+
+
+##
+## inotify
+##
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_CLOSE = IN_CLOSE_WRITE | IN_CLOSE_NOWRITE
+IN_MOVE = IN_MOVED_FROM | IN_MOVED_TO
+IN_ALL_EVENTS = 0x00000fff
+
+# only ever set in the mask of an event
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# only for inotify_add_watch
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_MASK_ADD = 0x20000000
+IN_ONESHOT = 0x80000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 02000000
+
+# struct inotify_event, up to the name that follows it
+_INOTIFY_EVENT = struct.Struct("@iIII")
+
+inotify_init = inotify_add_watch = inotify_rm_watch = None
+
+if libc is not None and sys.platform.startswith("linux"):
+    _inotify_init1 = _function("inotify_init1", ctypes.c_int, ctypes.c_int)
+    _inotify_add_watch = _function("inotify_add_watch", ctypes.c_int,
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    _inotify_rm_watch = _function("inotify_rm_watch", ctypes.c_int,
+            ctypes.c_int, ctypes.c_int)
+
+    if _inotify_init1 and _inotify_add_watch and _inotify_rm_watch:
+        def inotify_init(flags=IN_NONBLOCK | IN_CLOEXEC):
+            """create an inotify instance
+
+            :param flags: ``IN_*`` flags (default non-blocking and cloexec)
+            :type flags: int
+
+            :returns:
+                the integer file descriptor, which becomes readable when there
+                are events to read
+            """
+            return _check(_inotify_init1(flags))
+
+        def inotify_add_watch(fd, path, mask):
+            """watch a file or directory for events
+
+            :param fd: the inotify descriptor
+            :type fd: int
+            :param path: the file or directory to watch
+            :type path: str
+            :param mask: ``IN_*`` events to watch for, and any ``IN_*`` flags
+            :type mask: int
+
+            :returns:
+                the watch descriptor, which events for the path will carry. a
+                path that is already watched gets its existing one back
+            """
+            if isinstance(path, unicode):
+                path = path.encode(sys.getfilesystemencoding() or "utf8")
+            return _check(_inotify_add_watch(fd, path, mask))
+
+        def inotify_rm_watch(fd, wd):
+            """stop watching a file or directory
+
+            an ``IN_IGNORED`` event for the watch descriptor follows.
+
+            :param fd: the inotify descriptor
+            :type fd: int
+            :param wd: the watch descriptor
+            :type wd: int
+            """
+            _check(_inotify_rm_watch(fd, wd))
+
+
+def unpack_inotify_events(data):
+    """decode the events in data read from an inotify descriptor
+
+    :param data: the result of one or more reads, which end on whole events
+    :type data: str
+
+    :returns:
+        a list of four-tuples of the watch descriptor, the mask, the cookie
+        linking the two halves of a rename, and the name of the file in a
+        watched directory it happened to (or an empty string)
+    """
+    events = []
+    offset = 0
+    end = len(data)
+    header = _INOTIFY_EVENT.size
+    while offset + header <= end:
+        wd, mask, cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+        offset += header
+        name = data[offset:offset + length].rstrip("\0")
+        offset += length
+        events.append((wd, mask, cookie, name))
+    return events
@@ -1,7 +1,9 @@
 import collections
+import contextlib
 import functools
 import heapq
 from Queue import Empty, Full
+import sys
 import time
 import weakref
 
@@ -10,7 +12,7 @@ from greenhouse import compat, scheduler
 
 __all__ = ["Event", "Lock", "RLock", "Condition", "Semaphore",
            "BoundedSemaphore", "Timer", "Local", "Thread", "Queue",
-           "LifoQueue", "PriorityQueue", "Counter"]
+           "LifoQueue", "PriorityQueue", "Counter", "ResourcePool"]
 
 
 def _debugger(cls):
@@ -182,7 +184,8 @@ class Lock(object):
             waiter = self._waiters.popleft()
             self._locked = True
             self._owner = waiter
-            scheduler.state.awoken_from_events.add(waiter)
+            if not scheduler._hand_off(waiter):
+                scheduler.state.awoken_from_events.add(waiter)
         else:
             self._locked = False
             self._owner = None
@@ -261,7 +264,8 @@ class RLock(Lock):
                 waiter = self._waiters.popleft()
                 self._locked = True
                 self._owner = waiter
-                scheduler.state.awoken_from_events.add(waiter)
+                if not scheduler._hand_off(waiter):
+                    scheduler.state.awoken_from_events.add(waiter)
             else:
                 self._locked = False
                 self._owner = None
@@ -400,7 +404,9 @@ class Semaphore(object):
     def release(self):
         "increment the counter, waking up a waiter if there was any"
         if self._waiters:
-            scheduler.state.awoken_from_events.add(self._waiters.popleft())
+            waiter = self._waiters.popleft()
+            if not scheduler._hand_off(waiter):
+                scheduler.state.awoken_from_events.add(waiter)
         else:
             self._value += 1
 
@@ -807,7 +813,9 @@ class Queue(object):
                     raise Empty()
 
         if self.full() and self._waiters:
-            scheduler.schedule(self._waiters.popleft()[0])
+            waiter = self._waiters.popleft()[0]
+            if not scheduler._hand_off(waiter):
+                scheduler.schedule(waiter)
 
         return self._get()
 
@@ -866,7 +874,9 @@ class Queue(object):
                     raise Full()
 
         if self._waiters and not self.full():
-            scheduler.schedule(self._waiters.popleft()[0])
+            waiter = self._waiters.popleft()[0]
+            if not scheduler._hand_off(waiter):
+                scheduler.schedule(waiter)
 
         if not self._open_tasks:
             self._jobs_done.clear()
@@ -1008,3 +1018,417 @@ class Counter(object):
         if self._count != until:
             self._waiters.setdefault(until, []).append(compat.getcurrent())
             scheduler.state.mainloop.switch()
+
+
+# sentinels handed to greenlets waiting on a ResourcePool in place of a
+# resource: there is room to create a new one, or the pool has been closed
+_RETRY = object()
+_CLOSED = object()
+
+
+class ResourcePool(object):
+    """a pool of reusable resources such as database connections
+
+    greenlets :meth:`get` a resource and :meth:`put` it back when they are
+    done with it. new ones are made with ``factory`` as they are needed, up
+    to ``max_size`` of them at once, after which :meth:`get` blocks until one
+    is returned (or :meth:`discarded<discard>`, making room for a new one).
+
+    resources which go unused for ``idle_timeout`` seconds, or which have
+    been around longer than ``max_lifetime``, are closed by a single
+    background greenlet that sleeps until the next of them is due. resources
+    that expire while they are checked out are closed when they come back.
+
+    :param factory:
+        function called with no arguments to make a new resource. it may
+        block, and an exception from it propagates out of :meth:`get`
+    :type factory: function
+    :param min_size:
+        the number of resources to keep around even when they are idle. the
+        pool is filled up to this size in the background once it is created,
+        and again after resources are closed (default 0)
+    :type min_size: int
+    :param max_size: the most resources to have at any one time (default 10)
+    :type max_size: int
+    :param idle_timeout:
+        seconds a resource may sit unused in the pool before it is closed,
+        except when that would take the pool below ``min_size``. the default
+        of ``None`` keeps idle resources indefinitely
+    :type idle_timeout: int, float or None
+    :param max_lifetime:
+        seconds after its creation that a resource is replaced. the default
+        of ``None`` allows resources to live indefinitely
+    :type max_lifetime: int, float or None
+    :param check:
+        function run with a resource just before it is handed out of
+        :meth:`get`. if it returns false or raises, the resource is closed
+        and another one is tried. the default of ``None`` skips the check
+    :type check: function or None
+    :param close:
+        function called with a resource to dispose of it. the default calls
+        the resource's own ``close()`` method, if it has one
+    :type close: function or None
+
+    :meth:`checkout` provides a context manager around :meth:`get` and
+    :meth:`put`.
+    """
+    def __init__(self, factory, min_size=0, max_size=10, idle_timeout=None,
+            max_lifetime=None, check=None, close=None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if not 0 <= min_size <= max_size:
+            raise ValueError("min_size must be between 0 and max_size")
+
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.check = check
+        self._close = close
+
+        # (resource, returned at) pairs, the most recently returned last
+        self._idle = collections.deque()
+        self._created = {}
+        self._waiters = collections.deque()
+
+        # resources in existence or being created, and those checked out
+        self._size = 0
+        self._in_use = 0
+
+        self._closed = False
+        self._reaper = None
+        self._filling = False
+
+        self._checkouts = 0
+        self._waited = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._made = 0
+        self._destroyed = 0
+        self._failed_checks = 0
+
+        self._refill()
+
+    @property
+    def size(self):
+        "the number of resources in the pool, checked out or not"
+        return self._size
+
+    @property
+    def in_use(self):
+        "the number of resources currently checked out"
+        return self._in_use
+
+    def get(self, block=True, timeout=None):
+        """check a resource out of the pool
+
+        an idle resource is used if there is one, the most recently returned
+        first. otherwise a new one is created if the pool is below
+        ``max_size``, or else this waits for another greenlet to return one.
+
+        .. note::
+
+            this method can block the current greenlet, waiting on other
+            greenlets or on ``factory`` and ``check``
+
+        :param block:
+            whether to wait if the pool is exhausted (default ``True``)
+        :type block: bool
+        :param timeout:
+            the maximum time in seconds to wait for a resource. with the
+            default of ``None``, it can wait indefinitely. this is unused if
+            `block` is ``False``
+        :type timeout: int, float or None
+
+        :raises:
+            :class:`Empty` if the pool is exhausted and `block` is ``False``,
+            or `timeout` expires. ``RuntimeError`` if the pool is
+            :meth:`closed<close>`
+
+        :returns: a resource, which must be given back with :meth:`put` or
+            :meth:`discard`
+        """
+        start = time.time()
+        deadline = None if timeout is None else start + timeout
+        waited = False
+
+        while 1:
+            if self._closed:
+                raise RuntimeError("the pool is closed")
+
+            resource = self._take(start)
+            if resource is _RETRY:
+                if self._size < self.max_size:
+                    resource = self._create()
+                elif not block:
+                    raise Empty()
+                else:
+                    waited = True
+                    resource = self._wait(deadline)
+                    if resource is _RETRY:
+                        continue
+                    if resource is _CLOSED:
+                        raise RuntimeError("the pool is closed")
+
+                    # handed straight over, so it was never put back in
+                    self._in_use -= 1
+
+            self._in_use += 1
+            if self.check is not None and not self._healthy(resource):
+                continue
+            break
+
+        self._checkouts += 1
+        if waited:
+            elapsed = time.time() - start
+            self._waited += 1
+            self._wait_time += elapsed
+            self._max_wait = max(self._max_wait, elapsed)
+
+        return resource
+
+    def put(self, resource):
+        """return a checked out resource to the pool
+
+        if another greenlet is waiting in :meth:`get` the resource goes
+        straight to it. a resource past its ``max_lifetime``, or returned to a
+        closed pool, is closed instead.
+
+        :param resource: a resource that came out of :meth:`get`
+        """
+        now = time.time()
+        if self._closed or self._expired(resource, now):
+            self._in_use -= 1
+            self._destroy(resource)
+            self._make_room()
+            return
+
+        if self._waiters:
+            # it stays checked out, the waiter takes over the count
+            self._wake(resource)
+            return
+
+        self._in_use -= 1
+        self._idle.append((resource, now))
+        if self._reaper is None and (self.idle_timeout is not None or
+                self.max_lifetime is not None):
+            self._reaper = scheduler.greenlet(self._reap)
+            scheduler.schedule(self._reaper)
+
+    def discard(self, resource):
+        """close a checked out resource instead of returning it to the pool
+
+        this makes room for a new one, so use it for resources that have
+        broken while in use.
+
+        :param resource: a resource that came out of :meth:`get`
+        """
+        self._in_use -= 1
+        self._destroy(resource)
+        self._make_room()
+
+    @contextlib.contextmanager
+    def checkout(self, timeout=None):
+        """a context manager that checks a resource out for its duration
+
+        the resource is :meth:`put` back on exit, or :meth:`discarded
+        <discard>` if the block raised an exception.
+
+        .. note:: this method can block the current greenlet
+
+        :param timeout:
+            the maximum time in seconds to wait for a resource, see
+            :meth:`get`
+        :type timeout: int, float or None
+        """
+        resource = self.get(timeout=timeout)
+        try:
+            yield resource
+        except:
+            self.discard(resource)
+            raise
+        else:
+            self.put(resource)
+
+    def close(self):
+        """close the pool and every idle resource in it
+
+        checked out resources are closed as they are returned, and greenlets
+        blocked in :meth:`get` get a ``RuntimeError``.
+        """
+        self._closed = True
+        idle, self._idle = self._idle, collections.deque()
+        for resource, returned in idle:
+            self._destroy(resource)
+        while self._waiters:
+            self._wake(_CLOSED)
+
+    def stats(self):
+        """counters describing how the pool has been used
+
+        :returns:
+            a dictionary with the keys:
+
+            - ``size``: resources in the pool, checked out or not
+            - ``idle``: resources waiting in the pool
+            - ``in_use``: resources checked out
+            - ``waiting``: greenlets blocked in :meth:`get`
+            - ``utilization``: ``in_use`` as a fraction of ``max_size``
+            - ``checkouts``: successful calls to :meth:`get`
+            - ``waits``: checkouts that had to wait for a resource
+            - ``wait_time``: total seconds spent in those waits
+            - ``max_wait``: the longest of them, in seconds
+            - ``created``: resources made by ``factory``
+            - ``closed``: resources disposed of, for whatever reason
+            - ``failed_checks``: resources rejected by ``check``
+        """
+        return {
+            'size': self._size,
+            'idle': len(self._idle),
+            'in_use': self._in_use,
+            'waiting': len(self._waiters),
+            'utilization': float(self._in_use) / self.max_size,
+            'checkouts': self._checkouts,
+            'waits': self._waited,
+            'wait_time': self._wait_time,
+            'max_wait': self._max_wait,
+            'created': self._made,
+            'closed': self._destroyed,
+            'failed_checks': self._failed_checks,
+        }
+
+    def _take(self, now):
+        while self._idle:
+            resource, returned = self._idle.pop()
+            if not self._expired(resource, now):
+                return resource
+            self._destroy(resource)
+        return _RETRY
+
+    def _create(self):
+        # count it right away, factory() may block and others may come along
+        self._size += 1
+        try:
+            resource = self.factory()
+        except:
+            self._size -= 1
+            if self._waiters:
+                self._wake(_RETRY)
+            raise
+        self._made += 1
+        self._created[id(resource)] = time.time()
+        return resource
+
+    def _destroy(self, resource):
+        self._size -= 1
+        self._destroyed += 1
+        self._created.pop(id(resource), None)
+        try:
+            if self._close is not None:
+                self._close(resource)
+            elif hasattr(resource, "close"):
+                resource.close()
+        except Exception:
+            scheduler.handle_exception(*sys.exc_info())
+
+    def _healthy(self, resource):
+        try:
+            healthy = self.check(resource)
+        except Exception:
+            healthy = False
+            sys.exc_clear()
+        if not healthy:
+            self._failed_checks += 1
+            self.discard(resource)
+        return healthy
+
+    def _expired(self, resource, now):
+        return self.max_lifetime is not None and (
+                now - self._created.get(id(resource), now) >= self.max_lifetime)
+
+    def _wait(self, deadline):
+        current = compat.getcurrent()
+        waiter = [current, _RETRY, False]
+        if deadline is not None:
+            scheduler.schedule_at(deadline, current)
+        self._waiters.append(waiter)
+
+        scheduler.state.mainloop.switch()
+
+        if deadline is not None:
+            if not scheduler._remove_timer(deadline, current) and \
+                    not waiter[2]:
+                self._waiters.remove(waiter)
+                raise Empty()
+        return waiter[1]
+
+    def _wake(self, item):
+        waiter = self._waiters.popleft()
+        waiter[1] = item
+        waiter[2] = True
+        if not scheduler._hand_off(waiter[0]):
+            scheduler.schedule(waiter[0])
+
+    def _make_room(self):
+        # a resource is gone, so a waiter may now create a new one
+        if self._waiters:
+            self._wake(_RETRY)
+        else:
+            self._refill()
+
+    def _refill(self):
+        if not self._filling and not self._closed and \
+                self._size < self.min_size:
+            self._filling = True
+            scheduler.schedule(self._fill)
+
+    def _fill(self):
+        try:
+            while not self._closed and self._size < self.min_size:
+                try:
+                    resource = self._create()
+                except Exception:
+                    scheduler.handle_exception(*sys.exc_info())
+                    break
+                self._in_use += 1
+                self.put(resource)
+        finally:
+            self._filling = False
+
+    def _reap(self):
+        try:
+            while self._idle and not self._closed:
+                wakeup = self._evict(time.time())
+
+                # replace what was closed now, rather than once there is
+                # nothing idle left
+                self._refill()
+                if wakeup is None:
+                    break
+                scheduler.pause_until(wakeup)
+        finally:
+            self._reaper = None
+        self._refill()
+
+    def _evict(self, now):
+        # closes whatever is due and finds when the next one will be. the
+        # least recently returned resources are at the front of the deque
+        wakeup = None
+        keep = collections.deque()
+        while self._idle:
+            resource, returned = self._idle.popleft()
+            due = []
+            if self.max_lifetime is not None:
+                due.append(self._created.get(id(resource), now) +
+                        self.max_lifetime)
+            if self.idle_timeout is not None and self._size > self.min_size:
+                due.append(returned + self.idle_timeout)
+            if due and min(due) <= now:
+                self._destroy(resource)
+                continue
+            keep.append((resource, returned))
+            if due:
+                wakeup = min(due) if wakeup is None else min(wakeup, *due)
+        self._idle = keep
+        return wakeup
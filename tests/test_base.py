@@ -31,12 +31,13 @@ class StateClearingTestCase(unittest.TestCase):
         state.paused[:] = []
         state.descriptormap.clear()
         state.to_run.clear()
+        state.handoffs.clear()
         del state.global_exception_handlers[:]
-        state.local_exception_handlers.clear()
         del state.global_hooks[:]
-        state.local_to_hooks.clear()
-        state.local_from_hooks.clear()
+        greenhouse.compat.main_greenlet.__dict__.pop(
+                greenhouse.scheduler._CONTROL, None)
         state.raise_in_main = None
+        state.direct_handoff = False
 
         greenhouse.reset_poller()
 
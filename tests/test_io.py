@@ -1,8 +1,12 @@
 from __future__ import with_statement
 
 import array
+import errno
 import gc
+import itertools
+import mmap
 import os
+import shutil
 import socket
 import stat
 import sys
@@ -86,6 +90,45 @@ class SocketPollerMixin(object):
             handler.sendall("hello, world")
             assert client.recv(12) == "hello, world"
 
+    def test_sendall_large(self):
+        data = "".join(chr(i % 256) for i in xrange(256)) * 8192
+        with self.socketpair() as (client, handler):
+            received = []
+
+            @greenhouse.schedule
+            def reader():
+                got = 0
+                while got < len(data):
+                    chunk = handler.recv(65536)
+                    received.append(chunk)
+                    got += len(chunk)
+
+            client.sendall(data)
+            while sum(map(len, received)) < len(data):
+                greenhouse.pause()
+            assert "".join(received) == data
+
+    def test_sendall_many(self):
+        body = "x" * (1024 * 1024)
+        pieces = ["HEADER\r\n", bytearray("more\r\n"), "", buffer(body),
+                memoryview("trailer")]
+        expected = "HEADER\r\nmore\r\n" + body + "trailer"
+        with self.socketpair() as (client, handler):
+            received = []
+
+            @greenhouse.schedule
+            def reader():
+                got = 0
+                while got < len(expected):
+                    chunk = handler.recv(65536)
+                    received.append(chunk)
+                    got += len(chunk)
+
+            client.sendall_many(pieces)
+            while sum(map(len, received)) < len(expected):
+                greenhouse.pause()
+            assert "".join(received) == expected
+
     def test_sendto(self):
         with self.socketpair() as (client, handler):
             client.sendto("howdy", ("", port()))
@@ -156,12 +199,585 @@ class SocketPollerMixin(object):
             greenhouse.pause()
             assert results and results[0] == "this is a test", results
 
+    def test_socketfile_buffered_write(self):
+        with self.socketpair() as (client, handler):
+            writer = handler.makefile('w', 16)
+            client.setblocking(0)
+
+            writer.write("small")
+            writer.write(" writes")
+            self.assertRaises(socket.error, client.recv, 64)
+
+            writer.write(" fill it up")
+            assert client.recv(64) == "small writes fill it up"
+
+            writer.write("and the rest")
+            self.assertRaises(socket.error, client.recv, 64)
+            writer.flush()
+            assert client.recv(64) == "and the rest"
+
+    def test_socketfile_line_buffered(self):
+        with self.socketpair() as (client, handler):
+            writer = handler.makefile('w', 1)
+            client.setblocking(0)
+
+            writer.write("a partial")
+            self.assertRaises(socket.error, client.recv, 64)
+
+            writer.write(" line\nand ")
+            assert client.recv(64) == "a partial line\nand "
+
+    def test_socketfile_close_flushes(self):
+        with self.socketpair() as (client, handler):
+            writer = handler.makefile('w', 8192, cork=True)
+            writer.write("x" * 10000)
+            writer.write("tail")
+            writer.close()
+            handler.shutdown(socket.SHUT_WR)
+
+            received = []
+            data = client.recv(8192)
+            while data:
+                received.append(data)
+                data = client.recv(8192)
+            assert "".join(received) == "x" * 10000 + "tail"
+
+    def test_recv_exactly(self):
+        with self.socketpair() as (client, handler):
+            results = []
+
+            @greenhouse.schedule
+            def f():
+                results.append(client.recv_exactly(10))
+                results.append(client.recv_exactly(10))
+
+            handler.send("four")
+            greenhouse.pause()
+            assert not results
+
+            handler.send("more bytes")
+            greenhouse.pause()
+            assert results == ["fourmore b"], results
+
+            handler.shutdown(socket.SHUT_WR)
+            greenhouse.pause()
+            assert results == ["fourmore b", "ytes"], results
+
+    def test_recv_until(self):
+        with self.socketpair() as (client, handler):
+            handler.sendall("first\r\nsecond\r")
+            assert client.recv_until("\r\n") == "first\r\n"
+
+            handler.sendall("\nthird is longer\r\n")
+            assert client.recv_until("\r\n") == "second\r\n"
+            assert client.recv_until("\r\n", 8) == "third is"
+
+            # plain recv() picks up whatever the buffer already had
+            assert client.recv(3) == " lo"
+            assert client.recv(64) == "nger\r\n"
+
+    def test_recv_until_mixed_delimiters(self):
+        with self.socketpair() as (client, handler):
+            handler.sendall("abc\r")
+            greenhouse.schedule(handler.sendall, args=("\nrest",))
+            client.settimeout(TESTING_TIMEOUT)
+            self.assertRaises(socket.timeout, client.recv_until, ";")
+
+            # "\r\n" was buffered, but the ";" search had got past it
+            self.assertEqual(client.recv_until("\r\n"), "abc\r\n")
+            self.assertEqual(client.recv(64), "rest")
+
+    def test_frames(self):
+        with self.socketpair() as (client, handler):
+            handler.send_frame("hello")
+            handler.send_frame("")
+            handler.send_frame("x" * 100000)
+            handler.send_frame("short header", "!H")
+
+            assert client.recv_frame() == "hello"
+            assert client.recv_frame() == ""
+            assert client.recv_frame() == "x" * 100000
+            assert client.recv_frame("!H") == "short header"
+
+            handler.shutdown(socket.SHUT_WR)
+            assert client.recv_frame() is None
+
+    def test_frame_errors(self):
+        with self.socketpair() as (client, handler):
+            handler.send_frame("too big")
+            self.assertRaises(ValueError, client.recv_frame, max_size=6)
+
+        with self.socketpair() as (client, handler):
+            handler.sendall("\0\0\0\x09truncated"[:-1])
+            handler.shutdown(socket.SHUT_WR)
+            self.assertRaises(EOFError, client.recv_frame)
+
+    def test_recv_buffer(self):
+        with self.socketpair() as (client, handler):
+            handler.sendall("some data")
+            view = client.recv_buffer()
+            assert isinstance(view, memoryview)
+            assert view.tobytes() == "some data"
+
+            handler.sendall("more data")
+            assert client.recv_buffer(4).tobytes() == "more"
+            assert client.recv(64) == " data"
+
+            handler.shutdown(socket.SHUT_WR)
+            assert not len(client.recv_buffer())
+
+    def test_recv_flags_with_buffered_data(self):
+        with self.socketpair() as (client, handler):
+            handler.sendall("line\nrest of it")
+            self.assertEqual(client.recv_until("\n"), "line\n")
+
+            # the left over data comes first, and MSG_PEEK leaves it there
+            self.assertEqual(client.recv(4, socket.MSG_PEEK), "rest")
+            buf = bytearray(4)
+            self.assertEqual(client.recv_into(buf, 4, socket.MSG_PEEK), 4)
+            self.assertEqual(str(buf), "rest")
+            self.assertRaises(socket.error, client.recv, 4, socket.MSG_OOB)
+            self.assertEqual(client.recv(64), "rest of it")
+
+    def test_read_buffer_limit(self):
+        with self.socketpair() as (client, handler):
+            client.read_buffer_limit = 100
+            handler.sendall("x" * 150)
+            self.assertRaises(ValueError, client.recv_until, "\n")
+
+            # it stopped taking data at the limit
+            self.assertEqual(client.recv(200), "x" * 100)
+            self.assertEqual(client.recv_until("\n", 50), "x" * 50)
+
+    def test_waiting_socket_returns_its_slab(self):
+        pool = greenhouse.io.buffers.slab_pool
+        with self.socketpair() as (client, handler):
+            results = []
+
+            @greenhouse.schedule
+            def f():
+                results.append(client.recv_frame())
+                results.append(client.recv_frame())
+
+            # a partial frame keeps the slab borrowed
+            handler.sendall("\0\0\0\x0bhello")
+            greenhouse.pause()
+            assert client._rbuf._slab
+            idle = len(pool._idle)
+
+            # but once drained and waiting again, it goes back to the pool
+            handler.sendall(" world")
+            greenhouse.pause()
+            assert results == ["hello world"]
+            assert not client._rbuf._slab
+            assert len(pool._idle) == idle + 1
+
+            handler.send_frame("again")
+            greenhouse.pause()
+            assert results == ["hello world", "again"]
+
+    def _drain(self, sock, results):
+        @greenhouse.schedule
+        def f():
+            received = []
+            data = sock.recv(65536)
+            while data:
+                received.append(data)
+                data = sock.recv(65536)
+            results.append("".join(received))
+
+    def test_sendfile(self):
+        contents = os.urandom(300000)
+        with tempfile.TemporaryFile() as fp:
+            fp.write(contents)
+            with self.socketpair() as (client, handler):
+                results = []
+                self._drain(client, results)
+
+                assert handler.sendfile(fp) == len(contents)
+                assert fp.tell() == len(contents)
+                handler.shutdown(socket.SHUT_WR)
+                greenhouse.pause()
+                assert results == [contents]
+
+    def test_sendfile_offset_and_count(self):
+        with tempfile.TemporaryFile() as fp:
+            fp.write("0123456789")
+            with self.socketpair() as (client, handler):
+                assert handler.sendfile(fp, 3, 4) == 4
+                assert fp.tell() == 7
+                assert client.recv(64) == "3456"
+
+                assert handler.sendfile(fp, 8, 100) == 2
+                assert client.recv(64) == "89"
+
+    def test_sendfile_from_pipe(self):
+        rfd, wfd = os.pipe()
+        os.write(wfd, "through a pipe")
+        os.close(wfd)
+        with os.fdopen(rfd) as fp:
+            with self.socketpair() as (client, handler):
+                assert handler.sendfile(fp) == 14
+                assert client.recv(64) == "through a pipe"
+
+    def test_proxy(self):
+        with self.socketpair() as (client, front):
+            with self.socketpair() as (back, server):
+                results = []
+
+                @greenhouse.schedule
+                def f():
+                    results.append(greenhouse.proxy(front, back))
+
+                client.sendall("request")
+                assert server.recv(64) == "request"
+                server.sendall("response")
+                assert client.recv(64) == "response"
+
+                # half-closing one way leaves the other open
+                client.shutdown(socket.SHUT_WR)
+                assert server.recv(64) == ""
+                server.sendall("x" * 200000)
+                server.shutdown(socket.SHUT_WR)
+
+                received = []
+                data = client.recv(65536)
+                while data:
+                    received.append(data)
+                    data = client.recv(65536)
+                assert "".join(received) == "x" * 200000
+
+                greenhouse.pause()
+                assert results == [(7, 200008)], results
+
+    def test_killed_proxy(self):
+        with self.socketpair() as (client, front):
+            with self.socketpair() as (back, server):
+                proxier = greenhouse.greenlet(greenhouse.proxy,
+                        args=(front, back))
+                greenhouse.schedule(proxier)
+
+                client.sendall("request")
+                assert server.recv(64) == "request"
+
+                greenhouse.schedule_exception(
+                        greenhouse.compat.GreenletExit(), proxier)
+                greenhouse.pause()
+
+                # both directions are shut down, not just the killed one
+                assert client.recv(64) == ""
+                assert server.recv(64) == ""
+
+    def test_proxy_without_splice(self):
+        splice = greenhouse.syscalls.splice
+        greenhouse.syscalls.splice = None
+        try:
+            self.test_proxy()
+        finally:
+            greenhouse.syscalls.splice = splice
+
+    def udp_pair(self):
+        receiver = greenhouse.Socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        sender = greenhouse.Socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.bind(("127.0.0.1", 0))
+        return sender, receiver
+
+    def test_recvmany_sendmany(self):
+        sender, receiver = self.udp_pair()
+        address = receiver.getsockname()
+
+        sender.sendmany([("datagram %d" % i, address) for i in xrange(10)])
+        sender.sendmany([(bytearray("a bytearray"), address),
+            (memoryview("a memoryview"), address)])
+
+        batch = receiver.recvmany(64, 2048)
+        self.assertEqual([data for data, addr in batch],
+                ["datagram %d" % i for i in xrange(10)] +
+                ["a bytearray", "a memoryview"])
+        self.assertEqual(set(addr for data, addr in batch),
+                set([sender.getsockname()]))
+
+        # it stops at max_msgs, and truncates to bufsize
+        sender.sendmany([("x" * 100, address)] * 5)
+        self.assertEqual(receiver.recvmany(3, 10), [("x" * 10,
+            sender.getsockname())] * 3)
+        self.assertEqual(len(receiver.recvmany(3, 10)), 2)
+
+    def test_recvmany_blocks(self):
+        sender, receiver = self.udp_pair()
+
+        @greenhouse.schedule
+        def f():
+            sender.sendto("hello", receiver.getsockname())
+
+        self.assertEqual(receiver.recvmany(8, 64),
+                [("hello", sender.getsockname())])
+
+    def test_sendmany_connected_and_by_name(self):
+        sender, receiver = self.udp_pair()
+        sender.connect(receiver.getsockname())
+
+        sender.sendmany([("one", None),
+            ("two", ("localhost", receiver.getsockname()[1])),
+            ("three", None)])
+
+        received = []
+        while len(received) < 3:
+            received.extend(data for data, addr in receiver.recvmany(8, 64))
+        self.assertEqual(received, ["one", "two", "three"])
+
+    def test_recvmany_unix_addresses(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "receiver")
+            receiver = greenhouse.Socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(path)
+            sender = greenhouse.Socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sender.bind(os.path.join(tempdir, "sender"))
+            unbound = greenhouse.Socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+            sender.sendmany([("hello", path)])
+            unbound.sendmany([("anonymous", path)])
+            self.assertEqual(receiver.recvmany(8, 64), [
+                ("hello", os.path.join(tempdir, "sender")),
+                ("anonymous", None)])
+        finally:
+            for name in os.listdir(tempdir):
+                os.unlink(os.path.join(tempdir, name))
+            os.rmdir(tempdir)
+
+    def test_batched_datagrams_without_mmsg(self):
+        recvmmsg, sendmmsg = (greenhouse.syscalls.recvmmsg,
+                greenhouse.syscalls.sendmmsg)
+        greenhouse.syscalls.recvmmsg = greenhouse.syscalls.sendmmsg = None
+        try:
+            self.test_recvmany_sendmany()
+            self.test_sendmany_connected_and_by_name()
+        finally:
+            greenhouse.syscalls.recvmmsg = recvmmsg
+            greenhouse.syscalls.sendmmsg = sendmmsg
+
+    def test_send_fds_recv_fds(self):
+        a, b = [greenhouse.Socket(fromsock=s) for s in socket.socketpair()]
+        r, w = os.pipe()
+        try:
+            self.assertEqual(a.send_fds("x", [r, w]), 1)
+            data, fds = b.recv_fds(16, 2)
+            self.assertEqual(data, "x")
+            self.assertEqual(len(fds), 2)
+            assert r not in fds and w not in fds
+
+            # they are new descriptors for the same pipe
+            os.write(fds[1], "through the pipe")
+            self.assertEqual(os.read(r, 64), "through the pipe")
+            for fd in fds:
+                os.close(fd)
+
+            a.send_fds("no descriptors", [])
+            self.assertEqual(b.recv_fds(64, 2), ("no descriptors", []))
+
+            a.close()
+            self.assertEqual(b.recv_fds(64, 2), ("", []))
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_recv_fds_blocks(self):
+        a, b = [greenhouse.Socket(fromsock=s) for s in socket.socketpair()]
+        r, w = os.pipe()
+        received = []
+
+        @greenhouse.schedule
+        def f():
+            received.append(b.recv_fds(16, 1))
+
+        greenhouse.pause()
+        self.assertEqual(received, [])
+
+        a.send_fds("x", [r])
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0][0], "x")
+        for fd in received[0][1] + [r, w]:
+            os.close(fd)
+
+    def resolving_to(self, *addresses):
+        infos = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', address)
+                for address in addresses]
+        resolvers = greenhouse.io.sockets._resolvers
+        self.addCleanup(resolvers.pop, "getaddrinfo", None)
+        resolvers["getaddrinfo"] = lambda *args: infos
+
+    def listener(self, backlog=5):
+        listener = greenhouse.Socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(backlog)
+        self.addCleanup(listener.close)
+        return listener
+
+    def unresponsive(self):
+        # with its one-connection backlog taken, connecting to this just hangs
+        listener = self.listener(0)
+        filler = socket.socket()
+        filler.connect(listener.getsockname())
+        self.addCleanup(filler.close)
+        return listener.getsockname()
+
+    def refused(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        address = sock.getsockname()
+        sock.close()
+        return address
+
+    def test_create_connection(self):
+        listener = self.listener()
+        sock = greenhouse.create_connection(listener.getsockname())
+        server, address = listener.accept()
+        self.assertEqual(sock.getsockname(), address)
+        assert isinstance(sock, greenhouse.Socket)
+
+    def test_create_connection_races_slow_addresses(self):
+        listener = self.listener()
+        self.resolving_to(self.unresponsive(), listener.getsockname())
+
+        start = time.time()
+        sock = greenhouse.create_connection(("example.com", 80),
+                timeout=TESTING_TIMEOUT * 10, delay=TESTING_TIMEOUT)
+        elapsed = time.time() - start
+
+        self.assertEqual(sock.getpeername(), listener.getsockname())
+        self.assertEqual(sock.gettimeout(), TESTING_TIMEOUT * 10)
+        assert TESTING_TIMEOUT <= elapsed < TESTING_TIMEOUT * 5, elapsed
+
+    def test_create_connection_moves_on_after_failures(self):
+        listener = self.listener()
+        self.resolving_to(self.refused(), listener.getsockname())
+
+        start = time.time()
+        sock = greenhouse.create_connection(("example.com", 80), delay=10)
+        assert time.time() - start < 5
+        self.assertEqual(sock.getpeername(), listener.getsockname())
+
+    def test_create_connection_timeout(self):
+        self.resolving_to(self.unresponsive(), self.unresponsive())
+
+        start = time.time()
+        self.assertRaises(socket.timeout, greenhouse.create_connection,
+                ("example.com", 80), timeout=TESTING_TIMEOUT * 2,
+                delay=TESTING_TIMEOUT)
+        assert time.time() - start >= TESTING_TIMEOUT * 2
+
+    def test_create_connection_all_refused(self):
+        self.resolving_to(self.refused(), self.refused())
+        try:
+            greenhouse.create_connection(("example.com", 80))
+        except socket.error, exc:
+            self.assertEqual(exc.args[0], errno.ECONNREFUSED)
+        else:
+            assert 0, "connected"
+
+    def test_create_connection_patched(self):
+        listener = self.listener()
+        self.resolving_to(self.unresponsive(), listener.getsockname())
+        sock = greenhouse.emulation.socket.create_connection(
+                ("example.com", 80), TESTING_TIMEOUT * 10)
+        self.assertEqual(sock.getpeername(), listener.getsockname())
+
+    def test_interleaves_address_families(self):
+        infos = [(socket.AF_INET6, 1), (socket.AF_INET6, 2),
+                (socket.AF_INET6, 3), (socket.AF_INET, 4), (socket.AF_INET, 5)]
+        ordered = greenhouse.io.sockets._interleave_families(infos)
+        self.assertEqual([info[1] for info in reversed(ordered)],
+                [1, 4, 2, 5, 3])
+
+    def test_track(self):
+        greenhouse.io.stats.reset()
+        with self.socketpair() as (client, handler):
+            client.track("peer")
+
+            @greenhouse.schedule
+            def f():
+                handler.sendall("hello")
+
+            self.assertEqual(client.recv(64), "hello")
+            client.sendall("hi")
+            self.assertEqual(handler.recv(64), "hi")
+
+            client.settimeout(TESTING_TIMEOUT)
+            self.assertRaises(socket.timeout, client.recv, 64)
+
+            stats = greenhouse.io.stats.get("peer")
+            self.assertEqual(stats.bytes_in, 5)
+            self.assertEqual(stats.bytes_out, 2)
+            self.assertEqual(stats.waits, 2)
+            self.assertEqual(stats.retries, 1)
+            self.assertEqual(stats.timeouts, 1)
+            self.assertEqual(stats.calls, 4)
+            self.assertEqual(sum(stats.histogram), 2)
+            assert stats.wait_time >= TESTING_TIMEOUT
+
+            # the buckets it fell into cover the time it blocked
+            bounds = stats.buckets()
+            slowest = max(i for i, n in enumerate(stats.histogram) if n)
+            assert bounds[slowest] is None or \
+                    bounds[slowest] >= TESTING_TIMEOUT
+
+            client.track(None)
+            client.sendall("untracked")
+            self.assertEqual(stats.bytes_out, 2)
+            self.assertEqual(
+                    greenhouse.io.stats.snapshot()["peer"]["bytes_out"], 2)
+
+            greenhouse.io.stats.reset("peer")
+            self.assertEqual(stats.as_dict()["bytes_in"], 0)
+
     def test_socket_timeout(self):
         with self.socketpair() as (client, handler):
             client.settimeout(TESTING_TIMEOUT)
             assert client.gettimeout() == TESTING_TIMEOUT
 
             self.assertRaises(socket.timeout, client.recv, 10)
+            assert client.fileno() not in \
+                    greenhouse.scheduler.state.descriptormap
+            assert client.fileno() not in \
+                    greenhouse.scheduler.state.poller._registry
+
+    def test_waiters_cleaned_up_after_recv(self):
+        with self.socketpair() as (client, handler):
+            @greenhouse.schedule
+            def f():
+                handler.sendall("hello")
+
+            assert client.recv(10) == "hello"
+            assert client.fileno() not in \
+                    greenhouse.scheduler.state.descriptormap
+            assert client.fileno() not in \
+                    greenhouse.scheduler.state.poller._registry
+
+    def test_readiness_wakes_one_reader(self):
+        with self.socketpair() as (client, handler):
+            results = []
+            readers = []
+            for i in xrange(5):
+                @greenhouse.greenlet
+                def reader():
+                    results.append(client.recv(1))
+                readers.append(reader)
+                greenhouse.schedule(reader)
+            greenhouse.pause()
+
+            handler.sendall("a")
+            greenhouse.scheduler._hit_poller(TESTING_TIMEOUT)
+            state = greenhouse.scheduler.state
+            self.assertEqual(
+                    len([g for g in state.to_run if g in readers]), 1)
+
+            handler.sendall("bcde")
+            while len(results) < 5:
+                greenhouse.pause()
+            self.assertEqual(sorted(results), list("abcde"))
 
     def test_socket_timeout_in_grlet(self):
         with self.socketpair() as (client, handler):
@@ -349,6 +965,64 @@ And this is a second line""")
         finally:
             gfp.close()
 
+    def test_readline_limit_stops_at_newline(self):
+        with open(self.fname, 'w') as stdfp:
+            stdfp.write("short\nand a longer line\n")
+
+        gfp = greenhouse.File(self.fname)
+        try:
+            self.assertEqual(gfp.readline(20), "short\n")
+            self.assertEqual(gfp.readline(5), "and a")
+        finally:
+            gfp.close()
+
+    def test_readline_across_chunks(self):
+        with open(self.fname, 'w') as stdfp:
+            stdfp.write("a" * 10 + "\r\n" + "b" * 25 + "\r\n" + "c" * 3)
+
+        gfp = greenhouse.File(self.fname)
+        gfp.CHUNKSIZE = 4
+        gfp.NEWLINE = "\r\n"
+        try:
+            self.assertEqual(gfp.readline(), "a" * 10 + "\r\n")
+            self.assertEqual(gfp.readline(), "b" * 25 + "\r\n")
+            self.assertEqual(gfp.readline(), "ccc")
+            self.assertEqual(gfp.readline(), "")
+        finally:
+            gfp.close()
+
+    def test_readuntil(self):
+        with open(self.fname, 'w') as stdfp:
+            stdfp.write("key1=value1;key2=value2;tail")
+
+        gfp = greenhouse.File(self.fname)
+        try:
+            self.assertEqual(gfp.readuntil(";"), "key1=value1;")
+            self.assertEqual(gfp.readuntil("="), "key2=")
+            self.assertEqual(gfp.readuntil(";", 3), "val")
+            self.assertEqual(gfp.read(4), "ue2;")
+            self.assertEqual(gfp.readuntil(";"), "tail")
+        finally:
+            gfp.close()
+
+    def test_readinto(self):
+        with open(self.fname, 'w') as stdfp:
+            stdfp.write("0123456789")
+
+        gfp = greenhouse.File(self.fname)
+        try:
+            target = bytearray(4)
+            self.assertEqual(gfp.readinto(target), 4)
+            self.assertEqual(target, bytearray("0123"))
+
+            self.assertEqual(gfp.readline(2), "45")
+
+            target = array.array('c', '\0' * 8)
+            self.assertEqual(gfp.readinto(target), 4)
+            self.assertEqual(target.tostring()[:4], "6789")
+        finally:
+            gfp.close()
+
     def test_as_context_manager(self):
         with open(self.fname, 'w') as stdfp:
             stdfp.write("foo bar spam eggs")
@@ -440,6 +1114,44 @@ test""")
         finally:
             fp.close()
 
+    def test_buffered_write(self):
+        fp = greenhouse.File(self.fname, 'w+', 64)
+        try:
+            fp.write("not")
+            fp.write(" yet")
+            with open(self.fname) as check:
+                assert check.read() == ""
+
+            fp.flush()
+            with open(self.fname) as check:
+                assert check.read() == "not yet"
+
+            fp.write(" and more")
+            fp.seek(0)
+            assert fp.read() == "not yet and more"
+        finally:
+            fp.close()
+
+    def test_close_flushes(self):
+        fp = greenhouse.File(self.fname, 'w', 64)
+        fp.write("buffered")
+        fp.close()
+        fp.close()
+
+        with open(self.fname) as check:
+            assert check.read() == "buffered"
+
+    def test_dropped_file_flushes(self):
+        fp = greenhouse.File(self.fname, 'w', 64)
+        fp.write("buffered")
+        fileno = fp.fileno()
+        del fp
+        gc.collect()
+        self.addCleanup(os.close, fileno)
+
+        with open(self.fname) as check:
+            assert check.read() == "buffered"
+
     def test_writelines(self):
         lines = ["this\n", "is\n", "a\n", "test\n"]
         fp = greenhouse.File(self.fname, 'w')
@@ -451,6 +1163,147 @@ test""")
         with open(self.fname) as fp:
             assert fp.read() == "".join(lines)
 
+    def test_regular_files_use_thread_pool(self):
+        with open(self.fname, 'w') as fp:
+            fp.write("x" * 100)
+
+        with greenhouse.File(self.fname) as fp:
+            assert fp._pool is greenhouse.io.threadpool.default
+            self.assertEqual(fp.read(), "x" * 100)
+
+        rfd, wfd = os.pipe()
+        with greenhouse.File.fromfd(rfd) as fp:
+            assert fp._pool is None
+        os.close(wfd)
+
+    def test_read_ahead(self):
+        data = "".join(chr(i % 251) for i in xrange(100000))
+        with open(self.fname, 'w') as fp:
+            fp.write(data)
+
+        fp = greenhouse.File(self.fname)
+        try:
+            # skip the page cache fast path, the way reads of a file that
+            # isn't in memory yet would go
+            fp._nowait = False
+            fp.CHUNKSIZE = 1000
+            self.assertEqual(fp.read(10), data[:10])
+            self.assertEqual(fp.read(10), data[10:20])
+            assert fp._prefetch is not None
+
+            self.assertEqual(fp.tell(), 20)
+            self.assertEqual(fp.read(30000), data[20:30020])
+
+            fp.seek(5, os.SEEK_CUR)
+            self.assertEqual(fp.tell(), 30025)
+            self.assertEqual(fp.read(), data[30025:])
+        finally:
+            fp.close()
+
+    def test_cached_reads(self):
+        data = "".join(chr(i % 251) for i in xrange(100000))
+        with open(self.fname, 'w') as fp:
+            fp.write(data)
+
+        with greenhouse.File(self.fname) as fp:
+            self.assertEqual(fp.read(10), data[:10])
+            self.assertEqual(fp.readline(), data[10:data.index("\n") + 1])
+            self.assertEqual(fp.pread(100, 50000), data[50000:50100])
+            self.assertEqual(fp.read(), data[data.index("\n") + 1:])
+
+            # still reading from the page cache, where that's supported
+            self.assertEqual(fp._nowait,
+                    greenhouse.syscalls.read_nowait is not None)
+            self.assertEqual(fp._prefetch, None)
+
+    def test_pread_and_pwrite(self):
+        with open(self.fname, 'w') as fp:
+            fp.write("0123456789")
+
+        fp = greenhouse.File(self.fname, 'r+')
+        try:
+            self.assertEqual(fp.read(2), "01")
+            self.assertEqual(fp.pread(3, 5), "567")
+            self.assertEqual(fp.pread(10, 8), "89")
+            self.assertEqual(fp.pread(4, 20), "")
+
+            fp.pwrite("abc", 4)
+            self.assertEqual(fp.pread(10, 0), "0123abc789")
+
+            # the file's own position never moved
+            self.assertEqual(fp.tell(), 2)
+            self.assertEqual(fp.read(3), "23a")
+        finally:
+            fp.close()
+
+    def test_readinto_at(self):
+        with open(self.fname, 'w') as fp:
+            fp.write("0123456789")
+
+        with greenhouse.File(self.fname) as fp:
+            target = bytearray(4)
+            self.assertEqual(fp.readinto_at(target, 3), 4)
+            self.assertEqual(target, bytearray("3456"))
+
+            target = bytearray(6)
+            self.assertEqual(fp.readinto_at(memoryview(target), 7), 3)
+            self.assertEqual(target[:3], bytearray("789"))
+
+            target = array.array('c', '\0' * 5)
+            self.assertEqual(fp.readinto_at(target, 0), 5)
+            self.assertEqual(target.tostring(), "01234")
+
+            self.assertEqual(fp.read(2), "01")
+
+    def test_concurrent_preads(self):
+        data = "".join(chr(i % 251) for i in xrange(40000))
+        with open(self.fname, 'w') as fp:
+            fp.write(data)
+
+        results = {}
+        fp = greenhouse.File(self.fname)
+
+        def reader(offset):
+            results[offset] = fp.pread(1000, offset)
+
+        try:
+            glets = [greenhouse.greenlet(reader, args=(i * 1000,))
+                    for i in xrange(40)]
+            for glet in glets:
+                greenhouse.schedule(glet)
+            while len(results) < 40:
+                greenhouse.pause()
+        finally:
+            fp.close()
+
+        for offset, chunk in results.items():
+            self.assertEqual(chunk, data[offset:offset + 1000])
+
+    def test_emulated_pread_and_pwrite(self):
+        pread, pwrite = greenhouse.syscalls.pread, greenhouse.syscalls.pwrite
+        greenhouse.syscalls.pread = greenhouse.syscalls.pwrite = None
+        try:
+            self.test_pread_and_pwrite()
+        finally:
+            greenhouse.syscalls.pread = pread
+            greenhouse.syscalls.pwrite = pwrite
+
+    def test_fsync(self):
+        fp = greenhouse.File(self.fname, 'w', 64)
+        try:
+            fp.write("synced")
+            fp.fsync()
+            with open(self.fname) as check:
+                self.assertEqual(check.read(), "synced")
+        finally:
+            fp.close()
+
+    def test_fsync_with_os_patched(self):
+        # the patched os.fsync would itself go to the pool, from a worker
+        greenhouse.emulation.patch("os")
+        self.addCleanup(greenhouse.emulation.unpatch, "os")
+        self.test_fsync()
+
 if greenhouse.poller.Epoll._POLLER:
     class FileWithEpollTestCase(FilePollerMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.Epoll
@@ -499,6 +1352,49 @@ class PipePollerMixin(object):
             rfp.close()
             wfp.close()
 
+    def test_track(self):
+        greenhouse.io.stats.reset()
+        rfp, wfp = greenhouse.pipe()
+        rfp.track("pipe")
+        wfp.track("pipe")
+        l = []
+        try:
+            @greenhouse.schedule
+            def f():
+                l.append(rfp.read(4))
+
+            greenhouse.pause()
+            wfp.write("heyo")
+            wfp.flush()
+            greenhouse.pause_for(TESTING_TIMEOUT)
+            self.assertEqual(l, ["heyo"])
+
+            stats = greenhouse.io.stats.get("pipe")
+            self.assertEqual(stats.bytes_in, 4)
+            self.assertEqual(stats.bytes_out, 4)
+            self.assertEqual(stats.waits, 1)
+        finally:
+            rfp.close()
+            wfp.close()
+
+    def test_large_write(self):
+        # more than a pipe holds, so the write has to go out in pieces
+        data = "".join(chr(i % 256) for i in xrange(256)) * 1024
+        rfp, wfp = greenhouse.pipe()
+        l = []
+        try:
+            @greenhouse.schedule
+            def f():
+                l.append(rfp.read(len(data)))
+
+            wfp.write(data)
+            while not l:
+                greenhouse.pause()
+            assert l[0] == data
+        finally:
+            rfp.close()
+            wfp.close()
+
 if greenhouse.poller.Epoll._POLLER:
     class PipeWithEpollTestCase(PipePollerMixin, StateClearingTestCase):
         POLLER = greenhouse.poller.Epoll
@@ -569,5 +1465,381 @@ class WaitFDsWithSelect(WaitFDsMixin, StateClearingTestCase):
     POLLER = greenhouse.poller.Select
 
 
+class WriteQueueTestCase(StateClearingTestCase):
+    def pair(self):
+        a, b = [greenhouse.Socket(fromsock=s) for s in socket.socketpair()]
+        a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        b.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        return a, b
+
+    def read(self, sock, size):
+        data = []
+        while size > 0:
+            data.append(sock.recv(size))
+            size -= len(data[-1])
+        return "".join(data)
+
+    def test_writes_in_the_background(self):
+        a, b = self.pair()
+        queue = greenhouse.WriteQueue(a)
+        for i in xrange(100):
+            queue.write("%03d" % i)
+
+        # nothing has been sent yet, the writer hasn't had a chance to run
+        self.assertEqual(queue.size, 300)
+        self.assertEqual(queue.flush(TESTING_TIMEOUT), True)
+        self.assertEqual(self.read(b, 300),
+                "".join("%03d" % i for i in xrange(100)))
+
+    def test_blocks_above_high_water(self):
+        a, b = self.pair()
+        queue = greenhouse.WriteQueue(a, high_water=65536, low_water=16384)
+        sizes = []
+
+        @greenhouse.schedule
+        def producer():
+            for i in xrange(8):
+                queue.write("x" * 16384)
+                sizes.append(queue.size)
+
+        greenhouse.pause_for(TESTING_TIMEOUT)
+
+        # stuck on the write that took it to high_water
+        self.assertEqual(len(sizes), 3)
+        assert queue.size >= 65536 - 16384
+
+        # it carries on once the reader has drained it to low_water
+        received = len(self.read(b, 8 * 16384))
+        self.assertEqual(received, 8 * 16384)
+        greenhouse.pause()
+        self.assertEqual(len(sizes), 8)
+        assert max(sizes) < 65536 + 16384
+
+    def test_disconnects_stalled_consumer(self):
+        a, b = self.pair()
+        queue = greenhouse.WriteQueue(a, high_water=65536,
+                stall_timeout=TESTING_TIMEOUT)
+
+        start = time.time()
+        self.assertRaises(socket.error, queue.write, "x" * 131072)
+        assert time.time() - start >= TESTING_TIMEOUT
+        assert queue.error is not None
+        self.assertRaises(socket.error, queue.write, "more")
+
+    def test_drops_for_stalled_consumer(self):
+        a, b = self.pair()
+        queue = greenhouse.WriteQueue(a, high_water=65536,
+                stall_timeout=TESTING_TIMEOUT,
+                on_stall=greenhouse.io.writequeue.drop)
+
+        for i in xrange(8):
+            queue.write("x" * 16384)
+        assert queue.dropped > 0
+        self.assertEqual(queue.error, None)
+
+        # the connection still works
+        queue.write("y")
+        b.settimeout(TESTING_TIMEOUT)
+        data = ""
+        while not data.endswith("y"):
+            data += b.recv(65536)
+        self.assertEqual(len(data), 8 * 16384 - queue.dropped + 1)
+
+    def test_custom_stall_policy(self):
+        a, b = self.pair()
+        stalls = []
+        queue = greenhouse.WriteQueue(a, stall_timeout=TESTING_TIMEOUT,
+                on_stall=stalls.append)
+        queue.write("x" * 131072)
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+        assert stalls and stalls[0] is queue
+        self.read(b, 131072)
+        self.assertEqual(queue.flush(TESTING_TIMEOUT), True)
+
+    def test_writer_errors(self):
+        a, b = self.pair()
+        queue = greenhouse.WriteQueue(a)
+        b.close()
+        queue.write("hello")
+        self.assertEqual(queue.flush(TESTING_TIMEOUT), False)
+        self.assertRaises(socket.error, queue.write, "hello")
+
+    def test_killed_writer(self):
+        a, b = self.pair()
+        queue = greenhouse.WriteQueue(a, high_water=65536)
+        errors, flushed = [], []
+
+        @greenhouse.schedule
+        def producer():
+            try:
+                queue.write("x" * 131072)
+            except socket.error:
+                errors.append(True)
+
+        @greenhouse.schedule
+        def flusher():
+            flushed.append(queue.flush())
+
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        self.assertEqual((errors, flushed), ([], []))
+
+        greenhouse.schedule_exception(greenhouse.compat.GreenletExit(),
+                queue._writer)
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        self.assertEqual((errors, flushed), ([True], [False]))
+        assert queue.error is not None
+        self.assertRaises(socket.error, queue.write, "more")
+
+    def test_close(self):
+        a, b = self.pair()
+        queue = greenhouse.WriteQueue(a)
+        queue.write("x" * 131072)
+        greenhouse.pause()
+        queue.write("y" * 1024)
+        queue.close()
+        self.assertRaises(socket.error, queue.write, "more")
+        self.assertEqual(queue.dropped, 1024)
+
+        # the piece being sent still goes
+        self.assertEqual(self.read(b, 131072), "x" * 131072)
+        greenhouse.pause()
+        self.assertEqual(queue.size, 0)
+
+
+class MappedFileTestCase(StateClearingTestCase):
+    def setUp(self):
+        super(MappedFileTestCase, self).setUp()
+        fd, self.fname = tempfile.mkstemp()
+        self.data = "".join("key%05d=value%05d\n" % (i, i)
+                for i in xrange(2000))
+        os.write(fd, self.data)
+        os.close(fd)
+        self.addCleanup(os.unlink, self.fname)
+
+    def test_access(self):
+        with greenhouse.File(self.fname) as fp:
+            mapping = fp.mmap()
+        try:
+            self.assertEqual(len(mapping), len(self.data))
+            self.assertEqual(mapping[4], self.data[4])
+            self.assertEqual(mapping[20:40], self.data[20:40])
+
+            self.assertEqual(mapping.find("key01000="), self.data.find(
+                "key01000="))
+            self.assertEqual(mapping.find("key01000=", 30000),
+                    self.data.find("key01000=", 30000))
+            self.assertEqual(mapping.rfind("value"), self.data.rfind("value"))
+            self.assertEqual(mapping.find("missing"), -1)
+
+            view = mapping.view(40, 10)
+            self.assertEqual(view.tobytes(), self.data[40:50])
+            self.assertEqual(len(mapping.view(len(self.data) - 5)), 5)
+            del view
+        finally:
+            mapping.close()
+        assert mapping.closed
+
+    def test_offset(self):
+        granularity = mmap.ALLOCATIONGRANULARITY
+        with open(self.fname) as fp:
+            with greenhouse.MappedFile(fp, 100, granularity) as mapping:
+                self.assertEqual(mapping[:],
+                        self.data[granularity:granularity + 100])
+
+    def test_madvise(self):
+        fd = os.open(self.fname, os.O_RDONLY)
+        self.addCleanup(os.close, fd)
+
+        with greenhouse.MappedFile(fd,
+                advice=greenhouse.syscalls.MADV_RANDOM) as mapping:
+            mapping.madvise(greenhouse.syscalls.MADV_SEQUENTIAL, 5000, 100)
+            self.assertEqual(mapping[5000:5010], self.data[5000:5010])
+
+    def test_prefetch(self):
+        with greenhouse.File(self.fname) as fp:
+            mapping = fp.mmap()
+        with mapping:
+            mapping.prefetch()
+            mapping.prefetch(1000, 5000, wait=False)
+            mapping.prefetch(2000, 500, wait=False)
+            self.assertEqual(mapping[1000:6000], self.data[1000:6000])
+        assert mapping.closed
+
+
+class ThreadPoolTestCase(StateClearingTestCase):
+    def test_run(self):
+        pool = greenhouse.io.threadpool.ThreadPool(2)
+        self.assertEqual(pool.run(sum, [1, 2, 3]), 6)
+
+    def test_raises(self):
+        pool = greenhouse.io.threadpool.ThreadPool(2)
+        self.assertRaises(OSError, pool.run, os.fstat, -1)
+
+    def test_other_greenlets_run(self):
+        pool = greenhouse.io.threadpool.ThreadPool(2)
+        ticks = []
+
+        @greenhouse.schedule
+        def f():
+            while len(ticks) < 3:
+                ticks.append(time.time())
+                greenhouse.pause_for(TESTING_TIMEOUT / 5)
+
+        start = time.time()
+        pool.run(time.sleep, TESTING_TIMEOUT)
+        self.assertEqual(len(ticks), 3)
+        assert ticks[-1] - start < TESTING_TIMEOUT
+
+    def test_concurrency(self):
+        pool = greenhouse.io.threadpool.ThreadPool(3)
+        jobs = [pool.submit(time.sleep, TESTING_TIMEOUT) for i in xrange(3)]
+
+        start = time.time()
+        for job in jobs:
+            pool.wait(job)
+        assert time.time() - start < TESTING_TIMEOUT * 2
+
+    def test_fork_replaces_wakeup_pipe(self):
+        pool = greenhouse.io.threadpool.ThreadPool(1)
+        open_fds = len(os.listdir("/proc/self/fd"))
+
+        # as a forked child sees it
+        pool._pid = -1
+        self.assertEqual(pool.run(sum, [1, 2]), 3)
+        self.assertEqual(len(os.listdir("/proc/self/fd")), open_fds)
+
+    def test_size_zero_runs_inline(self):
+        pool = greenhouse.io.threadpool.ThreadPool(0)
+        self.assertEqual(pool.run(threading.current_thread),
+                threading.current_thread())
+
+        pool.resize(1)
+        assert pool.run(threading.current_thread) is not \
+                threading.current_thread()
+        pool.resize(0)
+
+
+class WatcherTestCase(StateClearingTestCase):
+    def setUp(self):
+        super(WatcherTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def watcher(self):
+        watcher = greenhouse.Watcher()
+        self.addCleanup(watcher.close)
+        return watcher
+
+    def write(self, name, data, mode='a'):
+        with open(os.path.join(self.dir, name), mode) as fp:
+            fp.write(data)
+
+    def test_directory_events(self):
+        watcher = self.watcher()
+        wd = watcher.add(self.dir, greenhouse.syscalls.IN_CREATE |
+                greenhouse.syscalls.IN_MODIFY)
+
+        self.write("a", "data")
+        event = watcher.get(timeout=TESTING_TIMEOUT)
+        self.assertEqual(event.wd, wd)
+        self.assertEqual(event.name, "a")
+        self.assertEqual(event.path, os.path.join(self.dir, "a"))
+        assert event.mask & greenhouse.syscalls.IN_CREATE
+
+        event = watcher.get(timeout=TESTING_TIMEOUT)
+        self.assertEqual(event.name, "a")
+        assert event.mask & greenhouse.syscalls.IN_MODIFY
+
+    def test_events_come_in_batches(self):
+        watcher = self.watcher()
+        watcher.add(self.dir, greenhouse.syscalls.IN_CREATE)
+
+        for i in xrange(50):
+            self.write(str(i), "")
+
+        names = [watcher.get(timeout=TESTING_TIMEOUT).name]
+        # the rest were read and queued along with the first
+        while 1:
+            try:
+                names.append(watcher.get(block=False).name)
+            except greenhouse.util.Empty:
+                break
+        self.assertEqual(names, map(str, xrange(50)))
+
+    def test_remove(self):
+        watcher = self.watcher()
+        wd = watcher.add(self.dir)
+        watcher.remove(wd)
+
+        event = watcher.get(timeout=TESTING_TIMEOUT)
+        self.assertEqual(event.wd, wd)
+        assert event.mask & greenhouse.syscalls.IN_IGNORED
+
+        self.write("a", "data")
+        self.assertRaises(greenhouse.util.Empty, watcher.get,
+                timeout=TESTING_TIMEOUT)
+
+    def test_close_wakes_getters(self):
+        watcher = self.watcher()
+        watcher.add(self.dir)
+        got = []
+
+        @greenhouse.schedule
+        def f():
+            got.extend(watcher)
+
+        greenhouse.pause()
+        watcher.close()
+        greenhouse.pause()
+        self.assertEqual(got, [])
+        self.assertEqual(watcher.get(), None)
+
+    def test_follow(self):
+        self.write("log", "before\n")
+        lines = greenhouse.follow(os.path.join(self.dir, "log"))
+        self.addCleanup(lines.close)
+
+        self.write("log", "one\ntw")
+        self.assertEqual(lines.next(), "one\n")
+        self.write("log", "o\nthree\n")
+        self.assertEqual(lines.next(), "two\n")
+        self.assertEqual(lines.next(), "three\n")
+
+    def test_follow_from_start(self):
+        self.write("log", "before\n")
+        lines = greenhouse.follow(os.path.join(self.dir, "log"), True)
+        self.addCleanup(lines.close)
+        self.assertEqual(lines.next(), "before\n")
+
+    def test_follow_rotation(self):
+        path = os.path.join(self.dir, "log")
+        self.write("log", "")
+        lines = greenhouse.follow(path)
+        self.addCleanup(lines.close)
+
+        self.write("log", "one\ntwo")
+        os.rename(path, path + ".1")
+        self.write("log", "three\n")
+        self.assertEqual(list(itertools.islice(lines, 3)),
+                ["one\n", "two", "three\n"])
+
+        # truncated in place
+        self.write("log", "four\n", 'w')
+        self.assertEqual(lines.next(), "four\n")
+
+        lines.close()
+        self.assertRaises(StopIteration, lines.next)
+
+    def test_follow_missing_file(self):
+        lines = greenhouse.follow(os.path.join(self.dir, "log"))
+        self.addCleanup(lines.close)
+
+        self.write("log", "one\n")
+        self.assertEqual(lines.next(), "one\n")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,115 @@
+import logging
+import os
+import tempfile
+import unittest
+
+import greenhouse
+import greenhouse.logging
+
+from test_base import TESTING_TIMEOUT, StateClearingTestCase
+
+
+class Target(object):
+    def __init__(self):
+        self.writes = []
+        self.blocker = None
+
+    def write(self, data):
+        if self.blocker is not None:
+            self.blocker.wait()
+        self.writes.append(data)
+
+
+class AsyncHandlerTestCase(StateClearingTestCase):
+    def logger(self, **kwargs):
+        target = Target()
+        handler = greenhouse.logging.AsyncHandler(target, **kwargs)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+
+        log = logging.getLogger("greenhouse.test.%d" % id(handler))
+        log.propagate = False
+        log.setLevel(logging.DEBUG)
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+        return log, handler, target
+
+    def test_batches_by_size(self):
+        log, handler, target = self.logger(flush_size=30, flush_interval=10)
+
+        log.info("one")
+        log.info("two")
+        greenhouse.pause()
+        self.assertEqual(target.writes, [])
+
+        log.info("three")
+        log.info("four")
+        greenhouse.pause()
+        self.assertEqual(target.writes,
+                ["INFO one\nINFO two\nINFO three\nINFO four\n"])
+        self.assertEqual(handler.size, 0)
+
+    def test_flushes_on_interval(self):
+        log, handler, target = self.logger(flush_interval=TESTING_TIMEOUT)
+
+        log.info("one")
+        greenhouse.pause()
+        log.info("two")
+        greenhouse.pause()
+        self.assertEqual(target.writes, [])
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        self.assertEqual(target.writes, ["INFO one\nINFO two\n"])
+
+    def test_flushes_on_level(self):
+        log, handler, target = self.logger(flush_interval=10)
+
+        log.info("one")
+        log.error("two")
+        greenhouse.pause()
+        self.assertEqual(target.writes, ["INFO one\nERROR two\n"])
+
+    def test_drops_when_full(self):
+        log, handler, target = self.logger(flush_size=1, max_size=60)
+        target.blocker = greenhouse.Event()
+
+        # the first gets taken by the writer, which then blocks on it
+        log.info("first")
+        greenhouse.pause()
+
+        for i in xrange(10):
+            log.info("record %d" % i)
+        self.assertEqual(handler.dropped, 6)
+
+        target.blocker.set()
+        handler.flush()
+        self.assertEqual(target.writes, ["INFO first\n",
+            "INFO record 0\nINFO record 1\nINFO record 2\nINFO record 3\n"
+            "6 log records dropped\n"])
+
+    def test_flush(self):
+        log, handler, target = self.logger(flush_interval=10)
+
+        log.info("one")
+        log.info("two")
+        handler.flush()
+        self.assertEqual(target.writes, ["INFO one\nINFO two\n"])
+
+        handler.flush()
+        self.assertEqual(len(target.writes), 1)
+
+    def test_file_target(self):
+        fname = tempfile.mktemp()
+        self.addCleanup(os.unlink, fname)
+        handler = greenhouse.logging.AsyncHandler(fname)
+
+        record = logging.makeLogRecord({"msg": "logged", "levelno":
+            logging.INFO, "levelname": "INFO"})
+        handler.handle(record)
+        handler.close()
+
+        with open(fname) as fp:
+            self.assertEqual(fp.read(), "logged\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ from __future__ import with_statement
 import gc
 import os
 import socket
+import threading
 import time
 import unittest
 
@@ -233,6 +234,118 @@ class ScheduleMixin(object):
         greenhouse.pause_until(until)
         assert until + 0.03 > time.time() >= until
 
+    def test_slack_shares_a_wakeup(self):
+        wakeups = greenhouse.scheduler.state.poll_wakeups
+        at = time.time() + TESTING_TIMEOUT
+        l = []
+
+        @greenhouse.schedule_at(at, slack=TESTING_TIMEOUT)
+        def f():
+            l.append(wakeups.total)
+
+        @greenhouse.schedule_at(at + TESTING_TIMEOUT / 2, slack=TESTING_TIMEOUT)
+        def g():
+            l.append(wakeups.total)
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+        self.assertEqual(len(l), 2)
+        self.assertEqual(l[0], l[1])
+
+    def test_global_timer_slack(self):
+        greenhouse.set_timer_slack(TESTING_TIMEOUT)
+        try:
+            wakeups = greenhouse.scheduler.state.poll_wakeups
+            at = time.time() + TESTING_TIMEOUT
+            l = []
+
+            @greenhouse.schedule_at(at)
+            def f():
+                l.append(wakeups.total)
+
+            @greenhouse.schedule_at(at + TESTING_TIMEOUT / 2)
+            def g():
+                l.append(wakeups.total)
+
+            greenhouse.pause_for(TESTING_TIMEOUT * 3)
+            self.assertEqual(len(l), 2)
+            self.assertEqual(l[0], l[1])
+            assert time.time() >= at + TESTING_TIMEOUT / 2
+        finally:
+            greenhouse.set_timer_slack(0)
+
+    def test_wakeup_honors_the_tightest_slack(self):
+        manager = type(greenhouse.scheduler.state.timed_paused)()
+        glets = [greenhouse.greenlet(lambda: None) for i in xrange(3)]
+
+        manager.insert(10, glets[0], 5)
+        self.assertEqual(manager.wakeup(), 15)
+
+        manager.insert(12, glets[1], 0)
+        self.assertEqual(manager.wakeup(), 12)
+
+        manager.insert(13, glets[2], 4)
+        self.assertEqual(manager.wakeup(), 12)
+
+        manager.remove(12, glets[1])
+        self.assertEqual(manager.wakeup(), 15)
+
+    if greenhouse.syscalls.timerfd_create is not None:
+        def test_high_resolution_timers(self):
+            greenhouse.set_high_resolution_timers()
+            try:
+                elapsed = []
+                for i in xrange(20):
+                    start = time.time()
+                    greenhouse.pause_for(0.0002)
+                    elapsed.append(time.time() - start)
+
+                assert min(elapsed) >= 0.0002, elapsed
+                assert min(elapsed) < 0.001, elapsed
+            finally:
+                greenhouse.set_high_resolution_timers(False)
+
+        def test_high_resolution_timers_with_sockets(self):
+            greenhouse.set_high_resolution_timers()
+            try:
+                with self.socketpair() as (client, handler):
+                    client.settimeout(TESTING_TIMEOUT)
+                    start = time.time()
+                    self.assertRaises(socket.timeout, client.recv, 10)
+                    assert time.time() - start >= TESTING_TIMEOUT
+
+                    @greenhouse.schedule_in(TESTING_TIMEOUT / 2)
+                    def f():
+                        handler.send("hi")
+
+                    self.assertEqual(client.recv(10), "hi")
+            finally:
+                greenhouse.set_high_resolution_timers(False)
+
+        def test_high_resolution_timers_survive_poller_reset(self):
+            greenhouse.set_high_resolution_timers()
+            try:
+                greenhouse.reset_poller(self.POLLER())
+                start = time.time()
+                greenhouse.pause_for(TESTING_TIMEOUT)
+                assert time.time() - start >= TESTING_TIMEOUT
+            finally:
+                greenhouse.set_high_resolution_timers(False)
+
+    def test_negative_slack_rejected(self):
+        self.assertRaises(ValueError, greenhouse.set_timer_slack, -1)
+        self.assertRaises(ValueError, greenhouse.pause_for,
+                TESTING_TIMEOUT, -1)
+        self.assertRaises(ValueError, greenhouse.schedule_in,
+                TESTING_TIMEOUT, lambda: None, slack=-1)
+        self.assertEqual(greenhouse.scheduler.state.timed_paused.slacks, {})
+
+    def test_poll_wakeup_rate(self):
+        wakeups = greenhouse.scheduler.state.poll_wakeups
+        before = wakeups.total
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        assert wakeups.total > before
+        assert greenhouse.poll_wakeup_rate() >= 0
+
     def test_exceptions_raised_in_grlets(self):
         l = [False]
 
@@ -379,6 +492,41 @@ class ScheduleMixin(object):
 
         assert not l[0]
 
+    def test_exception_cancels_pending_timer(self):
+        l = []
+
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def glet():
+            try:
+                greenhouse.pause_for(TESTING_TIMEOUT)
+            except self.CustomError:
+                l.append("raised")
+            # the old timer mustn't cut this second wait short
+            greenhouse.pause_for(TESTING_TIMEOUT * 4)
+            l.append("woke")
+
+        greenhouse.pause()
+        greenhouse.schedule_exception(self.CustomError(), glet)
+        greenhouse.pause()
+        self.assertEqual(l, ["raised"])
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        self.assertEqual(l, ["raised"])
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+        self.assertEqual(l, ["raised", "woke"])
+
+    def test_plain_greenlets_get_no_control_block(self):
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def glet():
+            greenhouse.pause()
+
+        greenhouse.pause()
+        greenhouse.pause()
+        assert greenhouse.scheduler._CONTROL not in glet.__dict__
+
     def test_end_rejects_funcs(self):
         def f(): pass
         self.assertRaises(TypeError, greenhouse.end, f)
@@ -529,6 +677,27 @@ class ScheduleMixin(object):
         self.assertEqual(m[0], 1)
         self.assertEqual(l[0], 5)
 
+    def test_overdue_poll_timeout(self):
+        # a timeout that has already gone negative must not poll forever
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+
+        def readable(fd):
+            pass
+        reg = greenhouse.scheduler._register_fd(rfd, readable, None)
+        self.addCleanup(greenhouse.scheduler._unregister_fd, rfd, readable,
+                None, reg)
+
+        # something to end the poll if it does block
+        timer = threading.Timer(TESTING_TIMEOUT * 4, os.write, (wfd, "x"))
+        timer.start()
+        self.addCleanup(timer.join)
+
+        start = time.time()
+        greenhouse.scheduler._hit_poller(-0.001)
+        assert time.time() - start < TESTING_TIMEOUT
+
 
 class ScheduleTestsWithSelect(ScheduleMixin, StateClearingTestCase):
     POLLER = greenhouse.poller.Select
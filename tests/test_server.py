@@ -0,0 +1,534 @@
+from __future__ import with_statement
+
+import errno
+import fcntl
+import os
+import socket
+import unittest
+
+import greenhouse
+
+from test_base import TESTING_TIMEOUT, StateClearingTestCase
+
+
+def echo(sock, address):
+    while 1:
+        data = sock.recv(8192)
+        if not data:
+            break
+        sock.sendall(data)
+
+
+class StreamServerTestCase(StateClearingTestCase):
+    def connect(self, server):
+        return self.connect_to(server.address)
+
+    def connect_to(self, address):
+        sock = greenhouse.Socket()
+        sock.settimeout(TESTING_TIMEOUT)
+        sock.connect(address)
+        return sock
+
+    def test_echo(self):
+        server = greenhouse.StreamServer(("127.0.0.1", 0), echo)
+        server.start()
+
+        clients = [self.connect(server) for i in xrange(5)]
+        for i, client in enumerate(clients):
+            client.sendall("hello %d" % i)
+        for i, client in enumerate(clients):
+            self.assertEqual(client.recv(8192), "hello %d" % i)
+            client.close()
+
+        self.assertEqual(server.stop(TESTING_TIMEOUT), True)
+        self.assertEqual(server.connections, 0)
+
+    def test_context_manager(self):
+        with greenhouse.StreamServer(("127.0.0.1", 0), echo) as server:
+            client = self.connect(server)
+            client.sendall("hi")
+            self.assertEqual(client.recv(8192), "hi")
+            client.close()
+            address = server.address
+
+        self.assertRaises(socket.error, self.connect_to, address)
+
+    def test_accepted_sockets_are_non_blocking(self):
+        flags = []
+
+        def handler(sock, address):
+            flags.append(fcntl.fcntl(sock.fileno(), fcntl.F_GETFL))
+
+        server = greenhouse.StreamServer(("127.0.0.1", 0), handler)
+        server.start()
+        self.connect(server).recv(1)
+        server.stop(TESTING_TIMEOUT)
+
+        self.assertEqual(len(flags), 1)
+        assert flags[0] & os.O_NONBLOCK
+
+    def test_closes_connection_after_handler(self):
+        def handler(sock, address):
+            sock.sendall("bye")
+
+        server = greenhouse.StreamServer(("127.0.0.1", 0), handler)
+        server.start()
+
+        client = self.connect(server)
+        self.assertEqual(client.recv(8192), "bye")
+        self.assertEqual(client.recv(8192), "")
+
+        server.stop(TESTING_TIMEOUT)
+
+    def test_reuses_workers(self):
+        workers = set()
+
+        def handler(sock, address):
+            workers.add(greenhouse.compat.getcurrent())
+
+        server = greenhouse.StreamServer(("127.0.0.1", 0), handler)
+        server.start()
+
+        for i in xrange(5):
+            self.connect(server).recv(1)
+
+        server.stop(TESTING_TIMEOUT)
+        self.assertEqual(len(workers), 1)
+
+    def test_drains_backlog(self):
+        handled = []
+
+        def handler(sock, address):
+            handled.append(address)
+
+        listener = greenhouse.Socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(10)
+        server = greenhouse.StreamServer(listener, handler)
+
+        clients = []
+        for i in xrange(5):
+            client = socket.socket()
+            client.connect(listener.getsockname())
+            clients.append(client)
+
+        # a single run of the acceptor takes everything that is queued
+        server.start()
+        greenhouse.pause()
+        self.assertEqual(server._workers, 5)
+
+        greenhouse.pause()
+        self.assertEqual(len(handled), 5)
+
+        server.stop(TESTING_TIMEOUT)
+
+    def test_max_connections(self):
+        release = greenhouse.Event()
+        running = []
+
+        def handler(sock, address):
+            running.append(address)
+            release.wait()
+
+        server = greenhouse.StreamServer(("127.0.0.1", 0), handler,
+                max_connections=2)
+        server.start()
+
+        clients = [self.connect(server) for i in xrange(5)]
+        greenhouse.pause_for(0.01)
+
+        # the rest are left waiting in the listen backlog
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(len(running), 2)
+
+        release.set()
+        for client in clients:
+            self.assertEqual(client.recv(1), "")
+        self.assertEqual(len(running), 5)
+        self.assertEqual(server._workers, 2)
+
+        server.stop(TESTING_TIMEOUT)
+
+    def test_idle_timeout(self):
+        server = greenhouse.StreamServer(("127.0.0.1", 0), echo,
+                idle_timeout=0.02)
+        server.start()
+
+        client = self.connect(server)
+        client.sendall("hi")
+        self.assertEqual(client.recv(8192), "hi")
+
+        # once it goes quiet the server hangs up
+        self.assertEqual(client.recv(8192), "")
+        self.assertEqual(server.connections, 0)
+
+        server.stop(TESTING_TIMEOUT)
+
+    def test_stop_waits_for_handlers(self):
+        finished = []
+
+        def handler(sock, address):
+            greenhouse.pause_for(0.02)
+            finished.append(address)
+
+        server = greenhouse.StreamServer(("127.0.0.1", 0), handler)
+        server.start()
+        self.connect(server)
+        greenhouse.pause()
+
+        self.assertEqual(server.stop(TESTING_TIMEOUT), True)
+        self.assertEqual(len(finished), 1)
+
+    def test_stop_timeout_shuts_connections_down(self):
+        finished = []
+
+        def handler(sock, address):
+            finished.append(sock.recv(8192))
+
+        server = greenhouse.StreamServer(("127.0.0.1", 0), handler)
+        server.start()
+        client = self.connect(server)
+        greenhouse.pause()
+
+        self.assertEqual(server.stop(0.01), False)
+        greenhouse.pause()
+        self.assertEqual(finished, [""])
+        self.assertEqual(client.recv(8192), "")
+        self.assertEqual(server.connections, 0)
+
+    def test_serve_forever(self):
+        server = greenhouse.StreamServer(("127.0.0.1", 0), echo)
+        address = server.address
+
+        @greenhouse.schedule
+        def stopper():
+            client = self.connect(server)
+            client.sendall("hi")
+            self.assertEqual(client.recv(8192), "hi")
+            client.close()
+            server.stop(TESTING_TIMEOUT)
+
+        server.serve_forever()
+        self.assertRaises(socket.error, self.connect_to, address)
+
+    def test_serve_forever_returns_if_the_listener_fails(self):
+        server = greenhouse.StreamServer(("127.0.0.1", 0), echo)
+
+        def accept():
+            raise socket.error(errno.EBADF, "broken")
+        server.listener.accept = accept
+
+        @greenhouse.schedule
+        def watchdog():
+            greenhouse.pause_for(TESTING_TIMEOUT)
+            if not server._stopped.is_set():
+                server._stopped.set()
+                failed.append(True)
+        failed = []
+
+        server.serve_forever()
+        self.assertFalse(failed)
+        self.assertTrue(server.stop(TESTING_TIMEOUT))
+
+    def test_listener_timeouts(self):
+        listener = greenhouse.Socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(5)
+        listener.settimeout(TESTING_TIMEOUT / 5)
+        server = greenhouse.StreamServer(listener, echo)
+        server.start()
+
+        greenhouse.pause_for(TESTING_TIMEOUT / 2)
+        client = self.connect(server)
+        client.sendall("hi")
+        self.assertEqual(client.recv(8192), "hi")
+        client.close()
+
+        server.stop(TESTING_TIMEOUT)
+
+    def test_handler_exceptions(self):
+        errors = []
+
+        def handler(sock, address):
+            raise ValueError("oops")
+
+        def exception_handler(klass, exc, tb):
+            errors.append(klass)
+        greenhouse.global_exception_handler(exception_handler)
+
+        server = greenhouse.StreamServer(("127.0.0.1", 0), handler)
+        server.start()
+
+        client = self.connect(server)
+        self.assertEqual(client.recv(8192), "")
+        self.assertEqual(errors, [ValueError])
+
+        # the worker survives it
+        client = self.connect(server)
+        self.assertEqual(client.recv(8192), "")
+        self.assertEqual(server._workers, 1)
+
+        server.stop(TESTING_TIMEOUT)
+
+
+class DatagramServerTestCase(StateClearingTestCase):
+    def client(self):
+        sock = greenhouse.Socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(TESTING_TIMEOUT)
+        return sock
+
+    def test_echo_in_batches(self):
+        batches = []
+
+        def handler(sock, batch):
+            batches.append(len(batch))
+            sock.sendmany(batch)
+
+        server = greenhouse.DatagramServer(("127.0.0.1", 0), handler)
+        server.start()
+
+        client = self.client()
+        client.sendmany([("ping %d" % i, server.address) for i in xrange(20)])
+
+        received = []
+        while len(received) < 20:
+            received.extend(client.recvmany(64, 64))
+        self.assertEqual(received,
+                [("ping %d" % i, server.address) for i in xrange(20)])
+
+        # all of them were waiting by the time the server got to run
+        self.assertEqual(batches, [20])
+
+        self.assertEqual(server.stop(TESTING_TIMEOUT), True)
+
+    def test_batch_size(self):
+        batches = []
+
+        def handler(sock, batch):
+            batches.append(len(batch))
+
+        server = greenhouse.DatagramServer(("127.0.0.1", 0), handler,
+                batch_size=8)
+        server.start()
+
+        self.client().sendmany([("x", server.address)] * 20)
+        greenhouse.pause()
+        greenhouse.pause()
+        self.assertEqual(batches, [8, 8, 4])
+
+        server.stop(TESTING_TIMEOUT)
+
+    def test_stop(self):
+        finished = []
+
+        def handler(sock, batch):
+            greenhouse.pause_for(0.02)
+            finished.append(batch)
+
+        server = greenhouse.DatagramServer(("127.0.0.1", 0), handler,
+                workers=3)
+        server.start()
+        address = server.address
+
+        self.client().sendto("hello", address)
+        greenhouse.pause()
+
+        # waits for the running handler, not the idle workers
+        self.assertEqual(server.stop(TESTING_TIMEOUT), True)
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(server._running, 0)
+        self.assertRaises(socket.error, server.socket.getsockname)
+
+    def test_stop_timeout(self):
+        release = greenhouse.Event()
+
+        def handler(sock, batch):
+            release.wait()
+
+        server = greenhouse.DatagramServer(("127.0.0.1", 0), handler)
+        server.start()
+        self.client().sendto("hello", server.address)
+        greenhouse.pause()
+
+        self.assertEqual(server.stop(0.01), False)
+        release.set()
+        greenhouse.pause()
+        self.assertEqual(server._running, 0)
+
+    def test_handler_exceptions(self):
+        errors = []
+        batches = []
+
+        def handler(sock, batch):
+            batches.append(batch)
+            raise ValueError("oops")
+
+        def exception_handler(klass, exc, tb):
+            errors.append(klass)
+        greenhouse.global_exception_handler(exception_handler)
+
+        server = greenhouse.DatagramServer(("127.0.0.1", 0), handler)
+        server.start()
+
+        client = self.client()
+        client.sendto("one", server.address)
+        greenhouse.pause()
+        client.sendto("two", server.address)
+        greenhouse.pause()
+
+        self.assertEqual(errors, [ValueError, ValueError])
+        self.assertEqual(len(batches), 2)
+
+        server.stop(TESTING_TIMEOUT)
+
+
+class DispatcherTestCase(StateClearingTestCase):
+    def workers(self, count):
+        channels, listeners = [], []
+        for i in xrange(count):
+            a, b = socket.socketpair()
+            channels.append(a)
+            listeners.append(greenhouse.HandoffListener(b))
+        return channels, listeners
+
+    def connection(self, listener):
+        client = greenhouse.Socket()
+        client.connect(listener.getsockname())
+        server, address = listener.accept()
+        return client, server
+
+    def test_handoff(self):
+        channels, [worker] = self.workers(1)
+        dispatcher = greenhouse.Dispatcher(channels)
+        listener = greenhouse.Socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(5)
+
+        client, server = self.connection(listener)
+        self.assertEqual(dispatcher.dispatch(server), 0)
+        self.assertRaises(socket.error, server.getsockname)
+
+        sock, address = worker.accept()
+        self.assertEqual(address, client.getsockname())
+        self.assertEqual(worker.received, 1)
+        assert fcntl.fcntl(sock.fileno(), fcntl.F_GETFL) & os.O_NONBLOCK
+
+        client.sendall("hello")
+        self.assertEqual(sock.recv(64), "hello")
+
+    def test_spreads_a_burst(self):
+        channels, workers = self.workers(3)
+        dispatcher = greenhouse.Dispatcher(channels)
+        listener = greenhouse.Socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(10)
+
+        chosen = [dispatcher.dispatch(self.connection(listener)[1])
+                for i in xrange(9)]
+        self.assertEqual(sorted(chosen), [0, 0, 0, 1, 1, 1, 2, 2, 2])
+
+    def test_follows_reported_load(self):
+        channels, workers = self.workers(2)
+        with greenhouse.Dispatcher(channels) as dispatcher:
+            listener = greenhouse.Socket()
+            listener.bind(("127.0.0.1", 0))
+            listener.listen(10)
+
+            workers[0].report(3)
+            greenhouse.pause_for(TESTING_TIMEOUT)
+            self.assertEqual(dispatcher.load(0), 3)
+
+            chosen = [dispatcher.dispatch(self.connection(listener)[1])
+                    for i in xrange(5)]
+            self.assertEqual(chosen[:3], [1, 1, 1])
+            self.assertEqual(dispatcher.load(0) + dispatcher.load(1), 8)
+
+            # the report counts the connections it had received by then
+            for i in xrange(chosen.count(0)):
+                workers[0].accept()
+            workers[0].report(0)
+            greenhouse.pause_for(TESTING_TIMEOUT)
+            self.assertEqual(dispatcher.load(0), 0)
+
+    def test_skips_dead_workers(self):
+        channels, workers = self.workers(2)
+        dispatcher = greenhouse.Dispatcher(channels)
+        dispatcher.start()
+        listener = greenhouse.Socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(10)
+
+        workers[0].close()
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        chosen = [dispatcher.dispatch(self.connection(listener)[1])
+                for i in xrange(3)]
+        self.assertEqual(chosen, [1, 1, 1])
+
+        workers[1].close()
+        greenhouse.pause_for(TESTING_TIMEOUT)
+        self.assertRaises(socket.error, dispatcher.dispatch,
+                self.connection(listener)[1])
+        dispatcher.close()
+
+    def test_send_errors_keep_the_worker(self):
+        channels, [worker] = self.workers(1)
+        dispatcher = greenhouse.Dispatcher(channels)
+        listener = greenhouse.Socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(5)
+
+        class BadSocket(object):
+            family = socket.AF_INET
+            type = socket.SOCK_STREAM
+
+            def fileno(self):
+                # no such descriptor, so sending it fails with EBADF
+                return 2 ** 20
+
+        self.assertRaises(socket.error, dispatcher.dispatch, BadSocket())
+        self.assertEqual(dispatcher._live, set([0]))
+
+        client, server = self.connection(listener)
+        self.assertEqual(dispatcher.dispatch(server), 0)
+
+    def test_worker_server_stops_with_the_dispatcher(self):
+        channels, [worker] = self.workers(1)
+        dispatcher = greenhouse.Dispatcher(channels)
+        back = greenhouse.StreamServer(worker, echo)
+
+        @greenhouse.schedule
+        def closer():
+            dispatcher.close()
+            channels[0].close()
+            greenhouse.pause_for(TESTING_TIMEOUT)
+            if not back._stopped.is_set():
+                back._stopped.set()
+                failed.append(True)
+        failed = []
+
+        back.serve_forever()
+        self.assertFalse(failed)
+
+    def test_worker_stream_server(self):
+        channels, [worker] = self.workers(1)
+        dispatcher = greenhouse.Dispatcher(channels)
+        front = greenhouse.StreamServer(("127.0.0.1", 0), dispatcher.dispatch)
+        back = greenhouse.StreamServer(worker, echo)
+        front.start()
+        back.start()
+
+        client = greenhouse.Socket()
+        client.settimeout(TESTING_TIMEOUT)
+        client.connect(front.address)
+        client.sendall("hello")
+        self.assertEqual(client.recv(64), "hello")
+        client.close()
+
+        front.stop(TESTING_TIMEOUT)
+        back.stop(TESTING_TIMEOUT)
+        dispatcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
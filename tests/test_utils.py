@@ -637,6 +637,123 @@ class PriorityQueueTestCase(QueueTestCase):
             self.assertEqual(q.get(), item)
 
 
+class DirectHandoffTestCase(StateClearingTestCase):
+    def test_queue_getter_runs_first(self):
+        greenhouse.set_direct_handoff()
+        q = greenhouse.Queue()
+        l = []
+
+        @greenhouse.schedule
+        def getter():
+            l.append(q.get())
+
+        greenhouse.pause()
+
+        @greenhouse.schedule
+        def other():
+            l.append("other")
+
+        q.put("item")
+        greenhouse.pause()
+
+        self.assertEqual(l, ["item", "other"])
+
+    def test_queue_getter_waits_a_poll_without_handoff(self):
+        q = greenhouse.Queue()
+        l = []
+
+        @greenhouse.schedule
+        def getter():
+            l.append(q.get())
+
+        greenhouse.pause()
+
+        @greenhouse.schedule
+        def other():
+            l.append("other")
+
+        q.put("item")
+        greenhouse.pause()
+
+        self.assertEqual(l, ["other", "item"])
+
+    def test_lock_release_hands_off(self):
+        greenhouse.set_direct_handoff()
+        lock = greenhouse.Lock()
+        lock.acquire()
+
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def waiter():
+            lock.acquire()
+
+        greenhouse.pause()
+        lock.release()
+
+        state = greenhouse.scheduler.state
+        assert state.handoffs[0] is waiter
+        assert waiter not in state.awoken_from_events
+
+    def test_semaphore_release_hands_off(self):
+        greenhouse.set_direct_handoff()
+        sem = greenhouse.Semaphore(0)
+
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def waiter():
+            sem.acquire()
+
+        greenhouse.pause()
+        sem.release()
+
+        assert greenhouse.scheduler.state.handoffs[0] is waiter
+
+    def test_handoffs_keep_wake_order(self):
+        greenhouse.set_direct_handoff()
+        sem = greenhouse.Semaphore(0)
+        l = []
+
+        def waiter(name):
+            sem.acquire()
+            l.append(name)
+
+        greenhouse.schedule(waiter, args=("first",))
+        greenhouse.schedule(waiter, args=("second",))
+        greenhouse.pause()
+
+        @greenhouse.schedule
+        def other():
+            l.append("other")
+
+        sem.release()
+        sem.release()
+        greenhouse.pause()
+
+        self.assertEqual(l, ["first", "second", "other"])
+
+    def test_handoff_streak_is_limited(self):
+        greenhouse.set_direct_handoff()
+        state = greenhouse.scheduler.state
+        lock = greenhouse.Lock()
+        lock.acquire()
+
+        @greenhouse.schedule
+        @greenhouse.greenlet
+        def waiter():
+            lock.acquire()
+
+        greenhouse.pause()
+        state.handoff_streak = greenhouse.scheduler.HANDOFF_LIMIT
+        lock.release()
+
+        assert waiter not in state.handoffs
+        assert waiter in state.awoken_from_events
+
+        # the next poll resets the streak
+        greenhouse.pause()
+        self.assertEqual(state.handoff_streak, 0)
+
+
 class ThreadTestCase(StateClearingTestCase):
     def test_order(self):
         l = []
@@ -820,5 +937,205 @@ class CounterTestCase(StateClearingTestCase):
         self.assertEqual(l[0], 1)
 
 
+class Resource(object):
+    def __init__(self, n):
+        self.n = n
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ResourcePoolTestCase(StateClearingTestCase):
+    def factory(self):
+        self.made.append(Resource(len(self.made)))
+        return self.made[-1]
+
+    def setUp(self):
+        super(ResourcePoolTestCase, self).setUp()
+        self.made = []
+
+    def test_reuses_resources(self):
+        pool = util.ResourcePool(self.factory)
+        a = pool.get()
+        b = pool.get()
+        pool.put(a)
+        pool.put(b)
+
+        # the most recently returned comes out first
+        self.assertEqual(pool.get(), b)
+        self.assertEqual(len(self.made), 2)
+        self.assertEqual(pool.stats()['idle'], 1)
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+    def test_blocks_when_exhausted(self):
+        pool = util.ResourcePool(self.factory, max_size=1)
+        a = pool.get()
+        got = []
+
+        @greenhouse.schedule
+        def f():
+            got.append(pool.get())
+
+        greenhouse.pause()
+        self.assertEqual(got, [])
+        self.assertEqual(pool.stats()['waiting'], 1)
+
+        pool.put(a)
+        greenhouse.pause()
+        self.assertEqual(got, [a])
+        self.assertEqual(len(self.made), 1)
+
+        stats = pool.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['utilization'], 1.0)
+
+    def test_nonblocking_and_timeout(self):
+        pool = util.ResourcePool(self.factory, max_size=1)
+        pool.get()
+        self.assertRaises(util.Empty, pool.get, False)
+
+        start = time.time()
+        self.assertRaises(util.Empty, pool.get, timeout=TESTING_TIMEOUT)
+        assert time.time() - start >= TESTING_TIMEOUT
+        self.assertEqual(pool.stats()['waiting'], 0)
+
+    def test_discard_makes_room(self):
+        pool = util.ResourcePool(self.factory, max_size=1)
+        a = pool.get()
+        got = []
+
+        @greenhouse.schedule
+        def f():
+            got.append(pool.get())
+
+        greenhouse.pause()
+        pool.discard(a)
+        greenhouse.pause()
+
+        assert a.closed
+        self.assertEqual(got, [self.made[1]])
+
+    def test_checkout(self):
+        pool = util.ResourcePool(self.factory)
+        with pool.checkout() as a:
+            self.assertEqual(pool.in_use, 1)
+        self.assertEqual(pool.in_use, 0)
+        assert not a.closed
+
+        try:
+            with pool.checkout() as b:
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(a, b)
+        assert b.closed
+        self.assertEqual(pool.size, 0)
+
+    def test_prewarms(self):
+        pool = util.ResourcePool(self.factory, min_size=3)
+        self.assertEqual(len(self.made), 0)
+
+        greenhouse.pause()
+        self.assertEqual(len(self.made), 3)
+        self.assertEqual(pool.stats()['idle'], 3)
+
+        # keeps min_size around when one is discarded
+        pool.discard(pool.get())
+        greenhouse.pause()
+        self.assertEqual(len(self.made), 4)
+        self.assertEqual(pool.size, 3)
+
+    def test_check(self):
+        broken = set()
+        pool = util.ResourcePool(self.factory,
+                check=lambda resource: resource not in broken)
+        a, b = pool.get(), pool.get()
+        pool.put(a)
+        pool.put(b)
+        broken.add(b)
+
+        self.assertEqual(pool.get(), a)
+        assert b.closed
+        self.assertEqual(pool.stats()['failed_checks'], 1)
+
+    def test_idle_timeout(self):
+        pool = util.ResourcePool(self.factory, min_size=1,
+                idle_timeout=TESTING_TIMEOUT)
+        resources = [pool.get() for i in xrange(3)]
+        for resource in resources:
+            pool.put(resource)
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+
+        # all but min_size are closed
+        self.assertEqual([r.closed for r in resources], [True, True, False])
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(pool._reaper, None)
+
+    def test_max_lifetime(self):
+        pool = util.ResourcePool(self.factory, min_size=1,
+                max_lifetime=TESTING_TIMEOUT)
+        greenhouse.pause()
+        a = self.made[0]
+
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+
+        # replaced with a new one
+        assert a.closed
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(pool.get(), self.made[-1])
+
+    def test_max_lifetime_staggered(self):
+        pool = util.ResourcePool(self.factory, min_size=2,
+                max_lifetime=TESTING_TIMEOUT * 4)
+        greenhouse.pause()
+
+        # replace one of them, so the two expire at different times
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        other = pool.get()
+        a, = [r for r in self.made if r is not other]
+        pool.discard(other)
+        greenhouse.pause()
+        b = self.made[-1]
+
+        # a has expired and b hasn't, min_size still holds
+        greenhouse.pause_for(TESTING_TIMEOUT * 3)
+        assert a.closed
+        assert not b.closed
+        self.assertEqual(pool.size, 2)
+
+    def test_expired_while_checked_out(self):
+        pool = util.ResourcePool(self.factory, max_lifetime=TESTING_TIMEOUT)
+        a = pool.get()
+        greenhouse.pause_for(TESTING_TIMEOUT * 2)
+        pool.put(a)
+
+        assert a.closed
+        self.assertEqual(pool.size, 0)
+
+    def test_close(self):
+        pool = util.ResourcePool(self.factory, max_size=1)
+        a = pool.get()
+        errors = []
+
+        @greenhouse.schedule
+        def f():
+            try:
+                pool.get()
+            except RuntimeError:
+                errors.append(True)
+
+        greenhouse.pause()
+        pool.close()
+        greenhouse.pause()
+        self.assertEqual(errors, [True])
+
+        pool.put(a)
+        assert a.closed
+        self.assertRaises(RuntimeError, pool.get)
+
+
 if __name__ == '__main__':
     unittest.main()